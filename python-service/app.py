@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 import cv2
 import numpy as np
 import os
@@ -9,22 +9,35 @@ import time
 import threading
 from typing import Optional, List, Dict, Any
 from datetime import datetime
-import psutil
 import json
-from ocr_service import ocr_service
+from ocr_service import ocr_service, Deadline
+from metrics import Metrics, stage_timer, render_prometheus, instrument_app, CONTENT_TYPE_LATEST
+import tracing
+import profiler
+import json_provider
+import startup
+import structured_logging
+from structured_logging import debug_sampled
+import lifecycle
+import tiling
+from phash import phash_index, compute_phash, to_hex
+from retrieval import retrieval_index, InvertedIndex
+import verification
+import compact
+import ocr_response
+from ocr_response import ResponseOptionsError
+from catalog import media_catalog, CatalogError
+from image_source import image_source, ImageSourceError, InvalidMediaKey
+from singleflight import coalesce
+from concurrency import thread_policy
+import documents
+from documents import DocumentError
 from werkzeug.utils import secure_filename
 import tempfile
 import uuid
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('opencv_service.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+# Configure logging: JSON lines written by a background thread (LOG_FORMAT, LOG_FILE, LOG_LEVEL)
+structured_logging.configure()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
@@ -40,56 +53,68 @@ class Config:
         self.REQUEST_TIMEOUT = int(os.getenv('REQUEST_TIMEOUT', 30))  # 30 seconds
         self.LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
         self.ENABLE_METRICS = os.getenv('ENABLE_METRICS', 'true').lower() == 'true'
+        # Default time budget for the OCR pipeline; kept below REQUEST_TIMEOUT so a
+        # (partial) result is returned before gunicorn kills the worker. 0 disables it.
+        self.OCR_TIME_BUDGET = float(os.getenv('OCR_TIME_BUDGET', self.REQUEST_TIMEOUT * 0.8))
+        # Request tracing: requests opt in with timings=true; when an export file is
+        # set, TRACE_SAMPLE_RATE of all requests is traced and appended to it as JSON lines
+        self.TRACE_EXPORT_FILE = os.getenv('TRACE_EXPORT_FILE', '')
+        self.TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 1.0))
+        # On-demand profiler endpoints (/admin/profiler/*) are only enabled when a token is set
+        self.PROFILER_TOKEN = os.getenv('PROFILER_TOKEN', '')
 
 config = Config()
 
+# OpenCV and Tesseract thread counts from this worker's share of the CPUs
+thread_policy.apply()
+
 # Initialize ORB detector with configurable features
 orb = cv2.ORB_create(nfeatures=config.ORB_FEATURES)
 
-# Metrics tracking
-class Metrics:
-    def __init__(self):
-        self.requests_total = 0
-        self.requests_success = 0
-        self.requests_error = 0
-        self.features_extracted = 0
-        self.matches_performed = 0
-        self.start_time = time.time()
-        self.lock = threading.Lock()
-    
-    def increment_requests(self, success=True):
-        with self.lock:
-            self.requests_total += 1
-            if success:
-                self.requests_success += 1
-            else:
-                self.requests_error += 1
-    
-    def increment_features(self, count):
-        with self.lock:
-            self.features_extracted += count
-    
-    def increment_matches(self):
-        with self.lock:
-            self.matches_performed += 1
-    
-    def get_stats(self):
-        with self.lock:
-            uptime = time.time() - self.start_time
-            return {
-                'uptime_seconds': uptime,
-                'requests_total': self.requests_total,
-                'requests_success': self.requests_success,
-                'requests_error': self.requests_error,
-                'success_rate': self.requests_success / max(self.requests_total, 1),
-                'features_extracted': self.features_extracted,
-                'matches_performed': self.matches_performed,
-                'memory_usage_mb': psutil.Process().memory_info().rss / 1024 / 1024,
-                'cpu_percent': psutil.cpu_percent()
-            }
-
+# Metrics tracking (Prometheus, aggregated across gunicorn workers)
 metrics = Metrics() if config.ENABLE_METRICS else None
+if metrics:
+    instrument_app(app)
 
+json_provider.init_app(app)
+structured_logging.init_app(app)
+tracing.init_app(app, export_file=config.TRACE_EXPORT_FILE or None, sample_rate=config.TRACE_SAMPLE_RATE)
+profiler.init_app(app, token=config.PROFILER_TOKEN)
+startup.init_app(app)
+
+
+def warm_up_worker():
+    """
+    First calls that are slow in a fresh process (OpenCV's thread pool, ORB and
+    CLAHE buffers, the journal tail) run here, from gunicorn's post_fork hook,
+    instead of in the worker's first request
+    """
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (240, 320), dtype=np.uint8)
+    cv2.rectangle(image, (40, 40), (200, 160), 255, 3)
+    warm_descriptors = []
+
+    def orb_detect():
+        _, descriptors = orb.detectAndCompute(image, None)
+        if descriptors is not None:
+            warm_descriptors.append(descriptors)
+
+    def matching():
+        if warm_descriptors and len(warm_descriptors[0]) >= 2:
+            ratio_test_matches(warm_descriptors[0], warm_descriptors[0])
+
+    steps = {
+        "orb": orb_detect,
+        "matching": matching,
+        "phash": lambda: compute_phash(image),
+        "preprocessing": lambda: ocr_service.preprocessor.filter_and_threshold(image),
+        "catalog": media_catalog.refresh
+    }
+    if retrieval_index is not None:
+        steps["retrieval"] = lambda: warm_descriptors and retrieval_index.vocabulary.encode(warm_descriptors[0])
+    if image_source is not None and image_source.kind == 's3':
+        steps["object_store"] = lambda: image_source.backend.client
+    startup.warm(steps)
 
 def with_ocr_provider(result: Dict[str, Any], provider: str = "tesseract") -> Dict[str, Any]:
     """Attach OCR provider name for client-side clarity."""
@@ -97,57 +122,245 @@ def with_ocr_provider(result: Dict[str, Any], provider: str = "tesseract") -> Di
         result.setdefault("provider", provider)
     return result
 
-def extract_features(image_path: str) -> Optional[List[List[int]]]:
+def request_image(data: Dict[str, Any], path_field: str = 'image_path', key_field: str = 'media_key') -> Optional[str]:
+    """Local path of a request's image: path_field as sent, or key_field resolved through the image source"""
+    if not isinstance(data, dict):
+        raise InvalidMediaKey(f"Expected a JSON object with {path_field} or {key_field}")
+    if data.get(key_field):
+        if image_source is None:
+            raise InvalidMediaKey(f"{key_field} needs IMAGE_SOURCE to be configured")
+        return image_source.resolve(data[key_field])
+    return data.get(path_field)
+
+def make_deadline(time_budget: Any = None) -> Deadline:
+    """Build the OCR deadline for a request, capped at the configured OCR_TIME_BUDGET"""
+    if config.OCR_TIME_BUDGET <= 0:
+        return Deadline(None)
+    try:
+        budget = float(time_budget) if time_budget not in (None, '') else config.OCR_TIME_BUDGET
+    except (TypeError, ValueError):
+        budget = config.OCR_TIME_BUDGET
+    if budget <= 0:
+        budget = config.OCR_TIME_BUDGET
+    return Deadline(min(budget, config.OCR_TIME_BUDGET))
+
+def run_ocr(method: str, image_path: str, deadline: Deadline, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+    """
+    ocr_service.<method>(image_path, *args, deadline=deadline, **kwargs), annotated
+    with the deadline. Overlapping requests for the same image content, options
+    and time budget share one run (see singleflight.py).
+    """
+    def compute():
+        return deadline.annotate(getattr(ocr_service, method)(image_path, *args, deadline=deadline, **kwargs))
+    # A follower's deadline runs while it waits: wait only as long as the budget allows
+    return coalesce(f"ocr_{method}", image_path, [args, kwargs, deadline.budget], compute,
+                    wait=deadline.remaining() if deadline.budget is not None else None)
+
+def param_flag(params: Any, name: str, default: bool) -> bool:
+    """Boolean parameter from a JSON body (bool) or form ('true'/'false')"""
+    value = params.get(name, default)
+    return value.lower() == 'true' if isinstance(value, str) else bool(value)
+
+class InvalidParameter(ValueError):
+    """A malformed or out-of-range request parameter (answered with 400)"""
+
+def param_number(params: Any, name: str, default: Any, cast: type = int, minimum: Any = 0,
+                 maximum: Any = None) -> Any:
+    """Numeric parameter from a JSON body or query string, within [minimum, maximum]"""
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        # true/false are not numbers here, even though bool is an int
+        if isinstance(value, bool):
+            raise ValueError(value)
+        number = cast(value)
+    except (TypeError, ValueError, OverflowError):
+        raise InvalidParameter(f"{name} must be {'an integer' if cast is int else 'a number'}")
+    # Also rejects NaN
+    if not (minimum <= number and (maximum is None or number <= maximum)):
+        bounds = f"between {minimum} and {maximum}" if maximum is not None else f"at least {minimum}"
+        raise InvalidParameter(f"{name} must be {bounds}")
+    return number
+
+def document_ocr(document_path: str, params: Any, cleanup_path: Optional[str] = None) -> Response:
+    """
+    OCR every page of a PDF or multi-frame image (see documents.py). Streams one
+    NDJSON line per page and a final document line when `stream` is set (or
+    the client accepts application/x-ndjson), otherwise answers one JSON object
+    with the pages. cleanup_path is removed once the document is done.
+    """
+    start_time = time.time()
+    language = params.get('language', 'eng')
+    preprocess = param_flag(params, 'preprocess', True)
+    ocr_config = params.get('config') or None
+    auto_rotate = param_flag(params, 'auto_rotate', True)
+    improve_readability = param_flag(params, 'improve_readability', True)
+    post_process = param_flag(params, 'post_process', True)
+    deadline = make_deadline(params.get('time_budget'))
+    response_options = ocr_response.parse_options(params)
+    streaming = param_flag(params, 'stream', False) or \
+        'application/x-ndjson' in request.headers.get('Accept', '')
+    try:
+        dpi = int(params.get('dpi') or documents.DOCUMENT_DPI)
+    except (TypeError, ValueError):
+        raise DocumentError("dpi must be a number")
+
+    document = documents.Document(document_path, dpi)
+    try:
+        first_page, last_page = documents.page_range(document.page_count, params.get('first_page'),
+                                                     params.get('last_page'))
+    except DocumentError:
+        document.close()
+        raise
+    summary = documents.DocumentSummary(document.page_count, first_page, last_page)
+
+    def ocr_page(page_path: str, number: int) -> Dict[str, Any]:
+        # Pages share the request's time budget; each gets what is left when it starts
+        if deadline.expired():
+            return {"success": False, "error": "Time budget exhausted", "skipped": True,
+                    "text": "", "confidence": 0.0}
+        page_deadline = Deadline(deadline.remaining() if deadline.budget is not None else None)
+        return page_deadline.annotate(ocr_service.extract_text(
+            page_path, language, preprocess, ocr_config, auto_rotate, improve_readability, post_process,
+            deadline=page_deadline))
+
+    def pages():
+        try:
+            for page in documents.ocr_pages(document, ocr_page, first_page, last_page):
+                summary.add(page)
+                yield ocr_response.shape(page, response_options)
+        finally:
+            document.close()
+            if cleanup_path and os.path.exists(cleanup_path):
+                os.unlink(cleanup_path)
+
+    def finished() -> Dict[str, Any]:
+        result = with_ocr_provider(summary.to_dict())
+        result["partial"] = summary.pages_failed > 0
+        result["processing_time"] = time.time() - start_time
+        logger.info("Document OCR completed: %d/%d pages, %d characters, confidence: %.1f%%, time: %.3fs",
+                    summary.pages_processed, last_page - first_page + 1, result['character_count'],
+                    result['confidence'], result['processing_time'])
+        return result
+
+    if streaming:
+        def lines():
+            for page in pages():
+                yield app.json.dumps(dict(page, type="page")) + "\n"
+            yield app.json.dumps(dict(finished(), type="document")) + "\n"
+        return Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+
+    page_results = list(pages())
+    result = finished()
+    result["pages"] = page_results
+    return jsonify(result)
+
+def extract_features(image_path: str) -> Optional[np.ndarray]:
     """
     Extract ORB features from an image with enhanced error handling and logging
     """
+    signature = extract_signature(image_path)
+    return signature['descriptors'] if signature else None
+
+def extract_signature(image_path: str, max_keypoints: int = 0, packed: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    ORB descriptors, keypoints and perceptual hash from a single decode.
+    max_keypoints keeps only that many strong, spread-out keypoints (ANMS);
+    packed returns descriptors and keypoints as base64 strings, otherwise
+    they are arrays (serialized by the app's JSON provider). Overlapping
+    requests for the same image content share one extraction.
+    """
+    return coalesce('signature', image_path, [max_keypoints, packed],
+                    lambda: _compute_signature(image_path, max_keypoints, packed))
+
+def _compute_signature(image_path: str, max_keypoints: int, packed: bool) -> Optional[Dict[str, Any]]:
     start_time = time.time()
     try:
         # Validate file exists and size
         if not os.path.exists(image_path):
-            logger.error(f"Image file not found: {image_path}")
+            logger.error("Image file not found: %s", image_path)
             return None
         
         file_size = os.path.getsize(image_path)
         if file_size > config.MAX_FILE_SIZE:
-            logger.error(f"Image file too large: {file_size} bytes (max: {config.MAX_FILE_SIZE})")
+            logger.error("Image file too large: %s bytes (max: %s)", file_size, config.MAX_FILE_SIZE)
             return None
         
         # Read image
-        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        with stage_timer('decode'):
+            img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
         if img is None:
-            logger.error(f"Could not read image from {image_path}")
+            logger.error("Could not read image from %s", image_path)
             return None
 
-        # Extract features
-        keypoints, descriptors = orb.detectAndCompute(img, None)
+        # Extract features; very large images go through a keypoint grid over tiles
+        # so only one tile's image pyramid is in memory at a time
+        with stage_timer('orb_detect'):
+            if tiling.needs_tiling(img.size, tiling.ORB_BYTES_PER_PIXEL):
+                tile_side = int((tiling.budget_bytes() / tiling.ORB_BYTES_PER_PIXEL) ** 0.5)
+                keypoints, descriptors = tiling.detect_and_compute_tiled(orb, img, tile_side)
+            else:
+                keypoints, descriptors = orb.detectAndCompute(img, None)
+            if max_keypoints and descriptors is not None:
+                keypoints, descriptors = compact.select_keypoints(keypoints, descriptors, max_keypoints)
+        with stage_timer('phash'):
+            image_hash = to_hex(compute_phash(img))
+        bow = None
+        if retrieval_index is not None and descriptors is not None:
+            with stage_timer('bow_encode'):
+                words, weights = retrieval_index.vocabulary.encode(descriptors)
+            bow = {"words": words, "weights": np.round(weights.astype(np.float64), 5)}
         
         processing_time = time.time() - start_time
         
         if descriptors is not None:
             feature_count = len(descriptors)
-            logger.info(f"Extracted {feature_count} features from {os.path.basename(image_path)} in {processing_time:.3f}s")
+            logger.debug("Extracted %d features from %s in %.3fs", feature_count, image_path, processing_time)
             
             if metrics:
                 metrics.increment_features(feature_count)
             
-            return descriptors.tolist()
+            signature = {
+                "phash": image_hash,
+                "bow": bow,
+                "footprint_bytes": compact.footprint(descriptors, keypoints)
+            }
+            if packed:
+                signature["descriptors"] = compact.pack_descriptors(descriptors)
+                signature["keypoints"] = compact.pack_keypoints(keypoints)
+            else:
+                signature["descriptors"] = descriptors
+                signature["keypoints"] = np.array([kp.pt for kp in keypoints], dtype=np.float64).round(1)
+            return signature
         else:
-            logger.warning(f"No features found in image: {image_path}")
+            logger.warning("No features found in image: %s", image_path)
             return None
 
     except Exception as e:
-        logger.error(f"Error extracting features from {image_path}: {str(e)}", exc_info=True)
+        logger.error("Error extracting features from %s: %s", image_path, e, exc_info=True)
         return None
 
-def match_features(query_desc: List[List[int]], stored_desc: List[List[int]]) -> Dict[str, Any]:
+def ratio_test_matches(query_desc: np.ndarray, stored_desc: np.ndarray) -> List[cv2.DMatch]:
+    """Nearest-neighbour matches that pass Lowe's ratio test"""
+    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False)
+    matches = bf.knnMatch(query_desc, stored_desc, k=2)
+
+    good_matches = []
+    for m, n in matches:
+        if m.distance < 0.75 * n.distance:  # Lowe's ratio test
+            good_matches.append(m)
+    return good_matches
+
+def match_features(query_desc: Any, stored_desc: Any) -> Dict[str, Any]:
     """
     Match features using Lowe's ratio test and return normalized similarity.
+    Descriptors are integer lists, arrays or packed base64 strings.
     """
     start_time = time.time()
     try:
-        query_desc = np.array(query_desc, dtype=np.uint8)
-        stored_desc = np.array(stored_desc, dtype=np.uint8)
+        query_desc = compact.descriptor_array(query_desc)
+        stored_desc = compact.descriptor_array(stored_desc)
 
         if len(query_desc) < 2 or len(stored_desc) < 2:
             logger.warning("Not enough descriptors to compare")
@@ -158,18 +371,14 @@ def match_features(query_desc: List[List[int]], stored_desc: List[List[int]]) ->
                 "match_count": 0
             }
 
-        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False)
-        matches = bf.knnMatch(query_desc, stored_desc, k=2)
-
-        good_matches = []
-        for m, n in matches:
-            if m.distance < 0.75 * n.distance:  # Lowe's ratio test
-                good_matches.append(m)
+        with stage_timer('matching'):
+            good_matches = ratio_test_matches(query_desc, stored_desc)
 
         similarity = len(good_matches) / max(len(query_desc), len(stored_desc))
         processing_time = time.time() - start_time
         
-        logger.info(f"Feature matching completed: {len(good_matches)} matches, similarity: {similarity:.3f}, time: {processing_time:.3f}s")
+        debug_sampled(logger, 'match_features', "Feature matching completed: %d matches, similarity: %.3f, time: %.3fs",
+                      len(good_matches), similarity, processing_time)
         
         if metrics:
             metrics.increment_matches()
@@ -181,7 +390,7 @@ def match_features(query_desc: List[List[int]], stored_desc: List[List[int]]) ->
         }
 
     except Exception as e:
-        logger.error(f"Error matching features: {str(e)}", exc_info=True)
+        logger.error("Error matching features: %s", e, exc_info=True)
         return {
             "success": False,
             "error": str(e),
@@ -189,6 +398,111 @@ def match_features(query_desc: List[List[int]], stored_desc: List[List[int]]) ->
             "match_count": 0
         }
 
+def compare_descriptors(query_desc: Any, stored_descriptors: List[Dict[str, Any]]):
+    """
+    Match query descriptors against every stored entry ({"id", "descriptors"}).
+    Returns (best_match, all_matches); best_match is None when nothing matched.
+    Entries are matched on the shared OpenCV pool (knnMatch releases the GIL).
+    """
+    best_match = None
+    best_score = -1.0
+    all_matches = []
+    # Converted once rather than per entry
+    query_desc = compact.descriptor_array(query_desc)
+    entries = [stored for stored in stored_descriptors if 'id' in stored and 'descriptors' in stored]
+    results = thread_policy.map(lambda stored: match_features(query_desc, stored['descriptors']), entries)
+
+    for stored, result in zip(entries, results):
+        if result['success']:
+            sim = result['similarity']
+            all_matches.append({
+                "id": stored['id'],
+                "similarity": sim,
+                "match_count": result['match_count']
+            })
+
+            if sim > best_score:
+                best_score = sim
+                best_match = {
+                    "id": stored['id'],
+                    "similarity": sim,
+                    "match_count": result['match_count']
+                }
+
+    return best_match, all_matches
+
+def compare_with_prefilter(signature: Dict[str, Any], stored_descriptors: List[Dict[str, Any]],
+                           threshold: float, index: Optional[InvertedIndex] = None, hash_search=None):
+    """
+    Coarse-to-fine compare: ORB-match the catalog entries nearest the query by
+    perceptual hash, then (with a retrieval index) the best visual-word shortlist
+    of the rest, then everything left, stopping at the first stage whose best
+    match reaches the threshold. hash_search queries a maintained BK-tree (the
+    server catalog's) instead of indexing the entries per request.
+    Returns (best_match, all_matches, prefilter_info).
+    """
+    index = index if index is not None else retrieval_index
+    query_desc = signature['descriptors']
+    query_value = int(signature['phash'], 16) if signature.get('phash') else None
+    use_retrieval = index is not None and signature.get('bow') is not None
+
+    with stage_timer('phash_shortlist'):
+        candidates, remainder, info = phash_index.shortlist(query_value, stored_descriptors,
+                                                            include_unhashed=not use_retrieval, search=hash_search)
+    best_match, all_matches = compare_descriptors(query_desc, candidates)
+    compared = len(candidates)
+
+    def reached():
+        return best_match is not None and best_match['similarity'] >= threshold
+
+    def merge(stage_best, stage_matches):
+        nonlocal best_match
+        all_matches.extend(stage_matches)
+        if stage_best and (best_match is None or stage_best['similarity'] > best_match['similarity']):
+            best_match = stage_best
+
+    if use_retrieval and remainder and not reached():
+        with stage_timer('retrieval_shortlist'):
+            candidates, remainder, info["retrieval"] = index.shortlist(
+                signature['bow']['words'], signature['bow']['weights'], remainder)
+        merge(*compare_descriptors(query_desc, candidates))
+        compared += len(candidates)
+
+    info["fallback"] = bool(remainder) and not reached()
+    if info["fallback"]:
+        merge(*compare_descriptors(query_desc, remainder))
+        compared += len(remainder)
+    info["compared"] = compared
+    return best_match, all_matches, info
+
+def verify_matches(signature: Dict[str, Any], stored_descriptors: List[Dict[str, Any]],
+                   all_matches: List[Dict[str, Any]], min_inliers: int, top_k: int = verification.TOP_K):
+    """
+    Geometric verification of the top_k matches (by similarity) whose catalog entries
+    carry keypoints. Adds inliers and confidence to those matches in place.
+    Returns (best verified match or None, verified matches).
+    """
+    by_id = {entry['id']: entry for entry in stored_descriptors if 'id' in entry}
+    query_desc = compact.descriptor_array(signature['descriptors'])
+    query_points = compact.keypoint_array(signature['keypoints'])
+    verified = []
+    with stage_timer('verification'):
+        for match in sorted(all_matches, key=lambda m: m['similarity'], reverse=True):
+            if len(verified) >= top_k:
+                break
+            entry = by_id.get(match['id'])
+            if not entry:
+                continue
+            stored_desc = compact.descriptor_array(entry['descriptors'])
+            stored_points = compact.keypoint_array(entry.get('keypoints'))
+            if not verification.valid_keypoints(stored_points, len(stored_desc)):
+                continue
+            good_matches = ratio_test_matches(query_desc, stored_desc)
+            pairs = [(m.queryIdx, m.trainIdx) for m in good_matches]
+            match.update(verification.verify_homography(query_points, stored_points, pairs))
+            verified.append(match)
+    return verification.rerank(verified, min_inliers), verified
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Enhanced health check endpoint with system information"""
@@ -209,10 +523,13 @@ def health_check():
         
         if metrics:
             health_data["metrics"] = metrics.get_stats()
+        health_data["worker_startup"] = startup.stats()
+        health_data["worker_memory"] = lifecycle.worker_lifecycle.stats()
+        health_data["logging"] = structured_logging.stats()
         
         return jsonify(health_data)
     except Exception as e:
-        logger.error(f"Health check failed: {str(e)}")
+        logger.error("Health check failed: %s", e)
         return jsonify({
             "status": "unhealthy",
             "error": str(e),
@@ -221,14 +538,19 @@ def health_check():
 
 @app.route('/metrics', methods=['GET'])
 def get_metrics():
-    """Get detailed service metrics"""
+    """
+    Get service metrics in Prometheus text format (aggregated across workers).
+    Use ?format=json for the JSON summary.
+    """
     if not metrics:
         return jsonify({"error": "Metrics disabled"}), 404
-    
+
     try:
-        return jsonify(metrics.get_stats())
+        if request.args.get('format') == 'json':
+            return jsonify(metrics.get_stats())
+        return Response(render_prometheus(), content_type=CONTENT_TYPE_LATEST)
     except Exception as e:
-        logger.error(f"Metrics retrieval failed: {str(e)}")
+        logger.error("Metrics retrieval failed: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/info', methods=['GET'])
@@ -245,12 +567,18 @@ def get_info():
             "extract": "POST /extract",
             "match": "POST /match",
             "compare": "POST /compare",
+            "catalog_upsert": "POST /catalog/entries",
+            "catalog_delete": "POST /catalog/entries/delete",
+            "catalog_changes": "GET /catalog/changes?since=<seq>",
+            "catalog_stats": "GET /catalog/stats",
             "ocr_extract": "POST /ocr/extract",
             "ocr_extract_with_boxes": "POST /ocr/extract-with-boxes",
             "ocr_extract_auto": "POST /ocr/extract-auto",
             "ocr_upload_extract": "POST /ocr/upload-extract",
             "ocr_upload_extract_with_boxes": "POST /ocr/upload-extract-with-boxes",
             "ocr_upload_extract_auto": "POST /ocr/upload-extract-auto",
+            "ocr_document": "POST /ocr/document",
+            "ocr_upload_document": "POST /ocr/upload-document",
             "ocr_languages": "GET /ocr/languages",
             "ocr_info": "GET /ocr/info"
         },
@@ -259,7 +587,17 @@ def get_info():
             "max_file_size_mb": config.MAX_FILE_SIZE // (1024 * 1024),
             "request_timeout": config.REQUEST_TIMEOUT,
             "debug_mode": config.DEBUG,
-            "metrics_enabled": config.ENABLE_METRICS
+            "metrics_enabled": config.ENABLE_METRICS,
+            "ocr_time_budget": config.OCR_TIME_BUDGET,
+            "trace_export_file": config.TRACE_EXPORT_FILE or None,
+            "trace_sample_rate": config.TRACE_SAMPLE_RATE,
+            "profiler_enabled": bool(config.PROFILER_TOKEN),
+            "tile_memory_budget_mb": tiling.MEMORY_BUDGET_MB,
+            "retrieval_vocabulary_words": retrieval_index.vocabulary.size if retrieval_index else None,
+            "retrieval_index_entries": len(retrieval_index) if retrieval_index else None,
+            "json_provider": app.json.name,
+            "image_source": image_source.kind if image_source else None,
+            "threading": thread_policy.settings()
         }
     })
 
@@ -271,36 +609,56 @@ def extract():
     
     try:
         data = request.get_json()
-        if not data or 'image_path' not in data:
+        image_path = request_image(data) if data else None
+        if not image_path:
             logger.warning("Extract request missing image_path")
-            return jsonify({"success": False, "error": "Missing image_path in request"}), 400
+            return jsonify({"success": False, "error": "Missing image_path or media_key in request"}), 400
 
-        image_path = data['image_path']
-        logger.info(f"Feature extraction request for: {os.path.basename(image_path)}")
+        include_keypoints = data.get('keypoints', False)  # [x, y] per descriptor, for verified /compare
+        # Index mode: a budget of spread-out keypoints, packed for catalog storage
+        index_mode = data.get('mode') == 'index'
+        # 0 keeps every keypoint
+        max_keypoints = param_number(data, 'max_keypoints', compact.INDEX_MAX_KEYPOINTS) if index_mode else 0
+        logger.debug("Feature extraction request for: %s", image_path)
         
-        descriptors = extract_features(image_path)
-        if descriptors is None:
-            logger.error(f"Feature extraction failed for: {image_path}")
+        signature = extract_signature(image_path, max_keypoints=max_keypoints, packed=index_mode)
+        if signature is None:
+            logger.error("Feature extraction failed for: %s", image_path)
             return jsonify({"success": False, "error": "No features could be extracted"}), 500
+        descriptors = signature['descriptors']
+        feature_count = compact.descriptor_count(descriptors)
 
         processing_time = time.time() - start_time
         success = True
         
-        logger.info(f"Feature extraction completed: {len(descriptors)} features in {processing_time:.3f}s")
+        logger.info("Feature extraction completed: %d features in %.3fs", feature_count, processing_time)
         
-        return jsonify({
+        response = {
             "success": True,
             "descriptors": descriptors,
-            "feature_count": len(descriptors),
+            "feature_count": feature_count,
+            "phash": signature['phash'],
+            "footprint_bytes": signature['footprint_bytes'],
             "processing_time": processing_time
-        })
+        }
+        if signature['bow'] is not None:
+            response["bow"] = signature['bow']
+        if index_mode:
+            response["encoding"] = "base64"
+        if include_keypoints or index_mode:
+            response["keypoints"] = signature['keypoints']
+        return jsonify(response)
 
+    except InvalidParameter as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except ImageSourceError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status
     except Exception as e:
-        logger.error(f"Extract endpoint error: {str(e)}", exc_info=True)
+        logger.error("Extract endpoint error: %s", e, exc_info=True)
         return jsonify({"success": False, "error": f"Internal server error: {str(e)}"}), 500
     finally:
         if metrics:
-            metrics.increment_requests(success)
+            metrics.increment_requests(success, request.path)
 
 @app.route('/match', methods=['POST'])
 def match():
@@ -321,7 +679,8 @@ def match():
             logger.warning("Empty descriptors provided")
             return jsonify({"success": False, "error": "Empty descriptors provided"}), 400
 
-        logger.info(f"Feature matching request: {len(query_desc)} vs {len(stored_desc)} descriptors")
+        logger.debug("Feature matching request: %d vs %d descriptors", compact.descriptor_count(query_desc),
+                     compact.descriptor_count(stored_desc))
         
         result = match_features(query_desc, stored_desc)
         success = result.get('success', False)
@@ -332,11 +691,11 @@ def match():
         return jsonify(result)
 
     except Exception as e:
-        logger.error(f"Match endpoint error: {str(e)}", exc_info=True)
+        logger.error("Match endpoint error: %s", e, exc_info=True)
         return jsonify({"success": False, "error": f"Internal server error: {str(e)}"}), 500
     finally:
         if metrics:
-            metrics.increment_requests(success)
+            metrics.increment_requests(success, request.path)
 
 @app.route('/compare', methods=['POST'])
 def compare():
@@ -346,75 +705,166 @@ def compare():
     
     try:
         data = request.get_json()
-        if not data or 'query_image_path' not in data or 'stored_descriptors' not in data:
+        # Without stored_descriptors the query is compared against the server-side catalog
+        query_image_path = request_image(data, 'query_image_path', 'query_media_key') if data else None
+        if not query_image_path or ('stored_descriptors' not in data and not len(media_catalog)):
             logger.warning("Compare request missing required fields")
             return jsonify({"success": False, "error": "Missing query_image_path or stored_descriptors"}), 400
 
-        query_image_path = data['query_image_path']
-        stored_descriptors = data['stored_descriptors']
-        threshold = data.get('threshold', 0.2)  # similarity threshold (20%)
+        use_catalog = 'stored_descriptors' not in data
+        stored_descriptors = media_catalog.entries() if use_catalog else data['stored_descriptors']
+        threshold = param_number(data, 'threshold', 0.2, float, 0.0, 1.0)  # similarity threshold (20%)
+        prefilter = data.get('prefilter', True)  # shortlist entries by perceptual hash first
+        verify = data.get('verify', False)  # rerank top matches by RANSAC homography inliers
+        min_inliers = param_number(data, 'min_inliers', verification.MIN_INLIERS)
 
-        logger.info(f"Image comparison request: {os.path.basename(query_image_path)} vs {len(stored_descriptors)} stored descriptors")
+        logger.debug("Image comparison request: %s vs %d stored descriptors", query_image_path, len(stored_descriptors))
 
-        query_desc = extract_features(query_image_path)
-        if query_desc is None:
-            logger.error(f"No features extracted from query image: {query_image_path}")
+        signature = extract_signature(query_image_path)
+        if signature is None:
+            logger.error("No features extracted from query image: %s", query_image_path)
             return jsonify({"success": False, "error": "No features extracted from query image"}), 500
+        query_desc = signature['descriptors']
 
-        best_match = None
-        best_score = -1.0
-        all_matches = []
-
-        for stored in stored_descriptors:
-            if 'id' not in stored or 'descriptors' not in stored:
-                continue
-
-            result = match_features(query_desc, stored['descriptors'])
-            if result['success']:
-                sim = result['similarity']
-                all_matches.append({
-                    "id": stored['id'],
-                    "similarity": sim,
-                    "match_count": result['match_count']
-                })
+        if prefilter:
+            best_match, all_matches, prefilter_info = compare_with_prefilter(
+                signature, stored_descriptors, threshold,
+                hash_search=media_catalog.search_hash if use_catalog else None)
+        else:
+            best_match, all_matches = compare_descriptors(query_desc, stored_descriptors)
+            prefilter_info = None
+        best_score = best_match['similarity'] if best_match else -1.0
+        found = best_match is not None and best_score >= threshold
 
-                if sim > best_score:
-                    best_score = sim
-                    best_match = {
-                        "id": stored['id'],
-                        "similarity": sim,
-                        "match_count": result['match_count']
-                    }
+        verification_info = None
+        if verify:
+            verified_best, verified = verify_matches(signature, stored_descriptors, all_matches, min_inliers)
+            verification_info = {"verified": len(verified), "min_inliers": min_inliers}
+            if verified:
+                # Verified candidates are judged by inliers, not by the similarity threshold
+                best_match, found = verified_best, verified_best is not None
 
         processing_time = time.time() - start_time
         success = True
         
-        if best_match and best_score >= threshold:
-            logger.info(f"Match found: ID {best_match['id']} with similarity {best_score:.3f} in {processing_time:.3f}s")
+        if found:
+            logger.info("Match found: ID %s with similarity %.3f in %.3fs",
+                        best_match['id'], best_match['similarity'], processing_time)
             return jsonify({
                 "success": True,
                 "best_match": best_match,
                 "all_matches": all_matches,
                 "threshold": threshold,
+                "prefilter": prefilter_info,
+                "verification": verification_info,
                 "processing_time": processing_time
             })
         else:
-            logger.info(f"No match found above threshold {threshold} in {processing_time:.3f}s")
+            logger.info("No match found above threshold %s in %.3fs", threshold, processing_time)
             return jsonify({
                 "success": True,
                 "best_match": None,
                 "all_matches": all_matches,
                 "threshold": threshold,
+                "prefilter": prefilter_info,
+                "verification": verification_info,
                 "message": "No match found above threshold",
                 "processing_time": processing_time
             })
 
+    except InvalidParameter as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except ImageSourceError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status
+    except Exception as e:
+        logger.error("Compare endpoint error: %s", e, exc_info=True)
+        return jsonify({"success": False, "error": f"Internal server error: {str(e)}"}), 500
+    finally:
+        if metrics:
+            metrics.increment_requests(success, request.path)
+
+@app.route('/catalog/entries', methods=['POST'])
+def catalog_upsert():
+    """
+    Insert or update server-side catalog entries:
+    {"entries": [{"id", "version", "descriptors" | "image_path" | "media_key", "keypoints"?, "phash"?}]}.
+    Entries given an image are extracted here in index mode. Versions older
+    than (or equal to) the stored one are ignored, so retries and replays are safe.
+    """
+    start_time = time.time()
+    success = False
+
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('entries'), list):
+            return jsonify({"success": False, "error": "Missing entries"}), 400
+
+        records = []
+        for entry in data['entries']:
+            image_path = request_image(entry) if not isinstance(entry, dict) or 'descriptors' not in entry else None
+            if image_path:
+                signature = extract_signature(image_path, max_keypoints=compact.INDEX_MAX_KEYPOINTS,
+                                              packed=True)
+                if signature is None:
+                    return jsonify({"success": False,
+                                    "error": f"No features could be extracted for entry {entry.get('id')}"}), 422
+                entry = dict(entry, descriptors=signature['descriptors'], keypoints=signature['keypoints'],
+                             phash=signature['phash'])
+            records.append(entry)
+
+        result = media_catalog.upsert(records)
+        success = True
+        logger.info("Catalog upsert: %d applied, %d ignored", result['applied'], result['ignored'])
+        return jsonify(dict(result, success=True, processing_time=time.time() - start_time))
+
+    except CatalogError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except ImageSourceError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status
     except Exception as e:
-        logger.error(f"Compare endpoint error: {str(e)}", exc_info=True)
+        logger.error("Catalog upsert error: %s", e, exc_info=True)
         return jsonify({"success": False, "error": f"Internal server error: {str(e)}"}), 500
     finally:
         if metrics:
-            metrics.increment_requests(success)
+            metrics.increment_requests(success, request.path)
+
+@app.route('/catalog/entries/delete', methods=['POST'])
+def catalog_delete():
+    """Delete server-side catalog entries: {"entries": [{"id", "version"}]}"""
+    success = False
+
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('entries'), list):
+            return jsonify({"success": False, "error": "Missing entries"}), 400
+
+        result = media_catalog.delete(data['entries'])
+        success = True
+        logger.info("Catalog delete: %d applied, %d ignored", result['applied'], result['ignored'])
+        return jsonify(dict(result, success=True))
+
+    except CatalogError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logger.error("Catalog delete error: %s", e, exc_info=True)
+        return jsonify({"success": False, "error": f"Internal server error: {str(e)}"}), 500
+    finally:
+        if metrics:
+            metrics.increment_requests(success, request.path)
+
+@app.route('/catalog/changes', methods=['GET'])
+def catalog_changes():
+    """Change feed: ids (and deletions) changed after change sequence ?since=, oldest first"""
+    try:
+        since = param_number(request.args, 'since', 0)
+        limit = min(param_number(request.args, 'limit', 1000, minimum=1), 10000)
+    except InvalidParameter as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify(dict(media_catalog.changes(since, limit), success=True))
+
+@app.route('/catalog/stats', methods=['GET'])
+def catalog_stats():
+    return jsonify(dict(media_catalog.stats(), success=True))
 
 @app.route('/ocr/extract', methods=['POST'])
 def ocr_extract():
@@ -424,21 +874,24 @@ def ocr_extract():
     
     try:
         data = request.get_json()
-        if not data or 'image_path' not in data:
+        image_path = request_image(data) if data else None
+        if not image_path:
             logger.warning("OCR extract request missing image_path")
-            return jsonify({"success": False, "error": "Missing image_path in request"}), 400
+            return jsonify({"success": False, "error": "Missing image_path or media_key in request"}), 400
 
-        image_path = data['image_path']
         language = data.get('language', 'eng')
         preprocess = data.get('preprocess', True)
         config = data.get('config', None)
         auto_rotate = data.get('auto_rotate', True)
         improve_readability = data.get('improve_readability', True)
         post_process = data.get('post_process', True)
+        deadline = make_deadline(data.get('time_budget'))
+        response_options = ocr_response.parse_options(data)
+
+        logger.debug("OCR text extraction request for: %s (lang: %s, auto_rotate: %s, readability: %s)",
+                     image_path, language, auto_rotate, improve_readability)
         
-        logger.info(f"OCR text extraction request for: {os.path.basename(image_path)} (lang: {language}, auto_rotate: {auto_rotate}, readability: {improve_readability})")
-        
-        result = ocr_service.extract_text(image_path, language, preprocess, config, auto_rotate, improve_readability, post_process)
+        result = run_ocr('extract_text', image_path, deadline, language, preprocess, config, auto_rotate, improve_readability, post_process)
         result = with_ocr_provider(result)
         success = result.get('success', False)
         
@@ -446,18 +899,23 @@ def ocr_extract():
         result['total_processing_time'] = processing_time
         
         if success:
-            logger.info(f"OCR extraction completed: {result['character_count']} characters, confidence: {result['confidence']:.1f}%")
+            logger.info("OCR extraction completed: %d characters, confidence: %.1f%%",
+                        result['character_count'], result['confidence'])
         else:
-            logger.error(f"OCR extraction failed: {result.get('error', 'Unknown error')}")
+            logger.error("OCR extraction failed: %s", result.get('error', 'Unknown error'))
         
-        return jsonify(result)
+        return jsonify(ocr_response.shape(result, response_options))
 
+    except ResponseOptionsError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except ImageSourceError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status
     except Exception as e:
-        logger.error(f"OCR extract endpoint error: {str(e)}", exc_info=True)
+        logger.error("OCR extract endpoint error: %s", e, exc_info=True)
         return jsonify({"success": False, "error": f"Internal server error: {str(e)}"}), 500
     finally:
         if metrics:
-            metrics.increment_requests(success)
+            metrics.increment_requests(success, request.path)
 
 @app.route('/ocr/extract-with-boxes', methods=['POST'])
 def ocr_extract_with_boxes():
@@ -467,21 +925,25 @@ def ocr_extract_with_boxes():
     
     try:
         data = request.get_json()
-        if not data or 'image_path' not in data:
+        image_path = request_image(data) if data else None
+        if not image_path:
             logger.warning("OCR extract-with-boxes request missing image_path")
-            return jsonify({"success": False, "error": "Missing image_path in request"}), 400
+            return jsonify({"success": False, "error": "Missing image_path or media_key in request"}), 400
 
-        image_path = data['image_path']
         language = data.get('language', 'eng')
         preprocess = data.get('preprocess', True)
         config = data.get('config', None)
         auto_rotate = data.get('auto_rotate', True)
         improve_readability = data.get('improve_readability', True)
         post_process = data.get('post_process', True)
+        deadline = make_deadline(data.get('time_budget'))
+        response_options = ocr_response.parse_options(data)
+
+        logger.debug("OCR text extraction with boxes request for: %s (lang: %s, auto_rotate: %s, readability: %s)",
+                     image_path, language, auto_rotate, improve_readability)
         
-        logger.info(f"OCR text extraction with boxes request for: {os.path.basename(image_path)} (lang: {language}, auto_rotate: {auto_rotate}, readability: {improve_readability})")
-        
-        result = ocr_service.extract_text_with_boxes(image_path, language, preprocess, config, auto_rotate, improve_readability, post_process)
+        result = run_ocr('extract_text_with_boxes', image_path, deadline, language, preprocess, config, auto_rotate, improve_readability, post_process,
+                         box_encoding=response_options.box_encoding)
         result = with_ocr_provider(result)
         success = result.get('success', False)
         
@@ -489,18 +951,23 @@ def ocr_extract_with_boxes():
         result['total_processing_time'] = processing_time
         
         if success:
-            logger.info(f"OCR extraction with boxes completed: {len(result['boxes'])} text regions, {result['character_count']} characters")
+            logger.info("OCR extraction with boxes completed: %d text regions, %d characters",
+                        result['box_count'], result['character_count'])
         else:
-            logger.error(f"OCR extraction with boxes failed: {result.get('error', 'Unknown error')}")
+            logger.error("OCR extraction with boxes failed: %s", result.get('error', 'Unknown error'))
         
-        return jsonify(result)
+        return jsonify(ocr_response.shape(result, response_options))
 
+    except ResponseOptionsError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except ImageSourceError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status
     except Exception as e:
-        logger.error(f"OCR extract-with-boxes endpoint error: {str(e)}", exc_info=True)
+        logger.error("OCR extract-with-boxes endpoint error: %s", e, exc_info=True)
         return jsonify({"success": False, "error": f"Internal server error: {str(e)}"}), 500
     finally:
         if metrics:
-            metrics.increment_requests(success)
+            metrics.increment_requests(success, request.path)
 
 @app.route('/ocr/languages', methods=['GET'])
 def ocr_languages():
@@ -513,7 +980,7 @@ def ocr_languages():
             "default_language": ocr_service.default_language
         })
     except Exception as e:
-        logger.error(f"OCR languages endpoint error: {str(e)}", exc_info=True)
+        logger.error("OCR languages endpoint error: %s", e, exc_info=True)
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/ocr/info', methods=['GET'])
@@ -523,7 +990,7 @@ def ocr_info():
         info = ocr_service.get_tesseract_info()
         return jsonify(info)
     except Exception as e:
-        logger.error(f"OCR info endpoint error: {str(e)}", exc_info=True)
+        logger.error("OCR info endpoint error: %s", e, exc_info=True)
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/ocr/upload-extract', methods=['POST'])
@@ -548,7 +1015,9 @@ def ocr_upload_extract():
         auto_rotate = request.form.get('auto_rotate', 'true').lower() == 'true'
         improve_readability = request.form.get('improve_readability', 'true').lower() == 'true'
         post_process = request.form.get('post_process', 'true').lower() == 'true'
-        
+        deadline = make_deadline(request.form.get('time_budget'))
+        response_options = ocr_response.parse_options(request.form)
+
         # Validate file type
         allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'}
         file_ext = os.path.splitext(file.filename)[1].lower()
@@ -563,10 +1032,11 @@ def ocr_upload_extract():
         try:
             # Save uploaded file to temporary location
             file.save(temp_path)
-            logger.info(f"OCR upload extract request for: {file.filename} (lang: {language}, auto_rotate: {auto_rotate}, readability: {improve_readability})")
+            logger.debug("OCR upload extract request for: %s (lang: %s, auto_rotate: %s, readability: %s)",
+                         file.filename, language, auto_rotate, improve_readability)
             
             # Process with OCR
-            result = ocr_service.extract_text(temp_path, language, preprocess, config, auto_rotate, improve_readability, post_process)
+            result = run_ocr('extract_text', temp_path, deadline, language, preprocess, config, auto_rotate, improve_readability, post_process)
             result = with_ocr_provider(result)
             success = result.get('success', False)
             
@@ -575,11 +1045,12 @@ def ocr_upload_extract():
             result['original_filename'] = file.filename
             
             if success:
-                logger.info(f"OCR upload extraction completed: {result['character_count']} characters, confidence: {result['confidence']:.1f}%")
+                logger.info("OCR upload extraction completed: %d characters, confidence: %.1f%%",
+                            result['character_count'], result['confidence'])
             else:
-                logger.error(f"OCR upload extraction failed: {result.get('error', 'Unknown error')}")
+                logger.error("OCR upload extraction failed: %s", result.get('error', 'Unknown error'))
             
-            return jsonify(result)
+            return jsonify(ocr_response.shape(result, response_options))
             
         finally:
             # Clean up temporary file
@@ -587,14 +1058,16 @@ def ocr_upload_extract():
                 if os.path.exists(temp_path):
                     os.unlink(temp_path)
             except Exception as cleanup_error:
-                logger.warning(f"Failed to cleanup temp file {temp_path}: {cleanup_error}")
+                logger.warning("Failed to cleanup temp file %s: %s", temp_path, cleanup_error)
 
+    except ResponseOptionsError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
-        logger.error(f"OCR upload extract endpoint error: {str(e)}", exc_info=True)
+        logger.error("OCR upload extract endpoint error: %s", e, exc_info=True)
         return jsonify({"success": False, "error": f"Internal server error: {str(e)}"}), 500
     finally:
         if metrics:
-            metrics.increment_requests(success)
+            metrics.increment_requests(success, request.path)
 
 @app.route('/ocr/upload-extract-with-boxes', methods=['POST'])
 def ocr_upload_extract_with_boxes():
@@ -618,7 +1091,9 @@ def ocr_upload_extract_with_boxes():
         auto_rotate = request.form.get('auto_rotate', 'true').lower() == 'true'
         improve_readability = request.form.get('improve_readability', 'true').lower() == 'true'
         post_process = request.form.get('post_process', 'true').lower() == 'true'
-        
+        deadline = make_deadline(request.form.get('time_budget'))
+        response_options = ocr_response.parse_options(request.form)
+
         # Validate file type
         allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'}
         file_ext = os.path.splitext(file.filename)[1].lower()
@@ -633,10 +1108,12 @@ def ocr_upload_extract_with_boxes():
         try:
             # Save uploaded file to temporary location
             file.save(temp_path)
-            logger.info(f"OCR upload extract with boxes request for: {file.filename} (lang: {language}, auto_rotate: {auto_rotate}, readability: {improve_readability})")
+            logger.debug("OCR upload extract with boxes request for: %s (lang: %s, auto_rotate: %s, readability: %s)",
+                         file.filename, language, auto_rotate, improve_readability)
             
             # Process with OCR
-            result = ocr_service.extract_text_with_boxes(temp_path, language, preprocess, config, auto_rotate, improve_readability, post_process)
+            result = run_ocr('extract_text_with_boxes', temp_path, deadline, language, preprocess, config, auto_rotate, improve_readability, post_process,
+                             box_encoding=response_options.box_encoding)
             result = with_ocr_provider(result)
             success = result.get('success', False)
             
@@ -645,11 +1122,12 @@ def ocr_upload_extract_with_boxes():
             result['original_filename'] = file.filename
             
             if success:
-                logger.info(f"OCR upload extraction with boxes completed: {len(result['boxes'])} text regions, {result['character_count']} characters")
+                logger.info("OCR upload extraction with boxes completed: %d text regions, %d characters",
+                            result['box_count'], result['character_count'])
             else:
-                logger.error(f"OCR upload extraction with boxes failed: {result.get('error', 'Unknown error')}")
+                logger.error("OCR upload extraction with boxes failed: %s", result.get('error', 'Unknown error'))
             
-            return jsonify(result)
+            return jsonify(ocr_response.shape(result, response_options))
             
         finally:
             # Clean up temporary file
@@ -657,14 +1135,16 @@ def ocr_upload_extract_with_boxes():
                 if os.path.exists(temp_path):
                     os.unlink(temp_path)
             except Exception as cleanup_error:
-                logger.warning(f"Failed to cleanup temp file {temp_path}: {cleanup_error}")
+                logger.warning("Failed to cleanup temp file %s: %s", temp_path, cleanup_error)
 
+    except ResponseOptionsError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
-        logger.error(f"OCR upload extract with boxes endpoint error: {str(e)}", exc_info=True)
+        logger.error("OCR upload extract with boxes endpoint error: %s", e, exc_info=True)
         return jsonify({"success": False, "error": f"Internal server error: {str(e)}"}), 500
     finally:
         if metrics:
-            metrics.increment_requests(success)
+            metrics.increment_requests(success, request.path)
 
 @app.route('/ocr/extract-auto', methods=['POST'])
 def ocr_extract_auto():
@@ -677,38 +1157,46 @@ def ocr_extract_auto():
         if not data:
             return jsonify({"success": False, "error": "No JSON data provided"}), 400
         
-        image_path = data.get('image_path')
+        image_path = request_image(data)
         if not image_path:
-            return jsonify({"success": False, "error": "image_path is required"}), 400
+            return jsonify({"success": False, "error": "image_path or media_key is required"}), 400
         
         # Get parameters with defaults
         preprocess = data.get('preprocess', True)
         auto_rotate = data.get('auto_rotate', True)
         improve_readability = data.get('improve_readability', False)
         post_process = data.get('post_process', True)
-        
-        logger.info(f"OCR auto language extraction request for: {os.path.basename(image_path)} (preprocess: {preprocess}, auto_rotate: {auto_rotate}, readability: {improve_readability})")
+        deadline = make_deadline(data.get('time_budget'))
+        response_options = ocr_response.parse_options(data)
+
+        logger.debug("OCR auto language extraction request for: %s (preprocess: %s, auto_rotate: %s, readability: %s)",
+                     image_path, preprocess, auto_rotate, improve_readability)
         
         # Process with auto language detection
-        result = ocr_service.extract_text_auto_language(
-            image_path, preprocess, auto_rotate, improve_readability, post_process
-        )
+        result = run_ocr('extract_text_auto_language', image_path, deadline, preprocess, auto_rotate,
+                         improve_readability, post_process)
         result = with_ocr_provider(result)
         success = result.get('success', False)
         
         if success:
-            logger.info(f"OCR auto extraction completed: {result.get('character_count', 0)} characters, confidence: {result.get('confidence', 0):.1f}%, detected language: {result.get('detected_language', 'unknown')}")
+            logger.info("OCR auto extraction completed: %d characters, confidence: %.1f%%, detected language: %s",
+                        result.get('character_count', 0), result.get('confidence', 0),
+                        result.get('detected_language', 'unknown'))
         else:
-            logger.error(f"OCR auto extraction failed: {result.get('error', 'Unknown error')}")
+            logger.error("OCR auto extraction failed: %s", result.get('error', 'Unknown error'))
         
-        return jsonify(result)
+        return jsonify(ocr_response.shape(result, response_options))
         
+    except ResponseOptionsError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except ImageSourceError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status
     except Exception as e:
-        logger.error(f"OCR extract-auto endpoint error: {str(e)}", exc_info=True)
+        logger.error("OCR extract-auto endpoint error: %s", e, exc_info=True)
         return jsonify({"success": False, "error": f"Internal server error: {str(e)}"}), 500
     finally:
         if metrics:
-            metrics.increment_requests(success)
+            metrics.increment_requests(success, request.path)
 
 @app.route('/ocr/upload-extract-auto', methods=['POST'])
 def ocr_upload_extract_auto():
@@ -730,7 +1218,9 @@ def ocr_upload_extract_auto():
         auto_rotate = request.form.get('auto_rotate', 'true').lower() == 'true'
         improve_readability = request.form.get('improve_readability', 'false').lower() == 'true'
         post_process = request.form.get('post_process', 'true').lower() == 'true'
-        
+        deadline = make_deadline(request.form.get('time_budget'))
+        response_options = ocr_response.parse_options(request.form)
+
         # Validate file type
         allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'}
         file_ext = os.path.splitext(file.filename)[1].lower()
@@ -745,12 +1235,12 @@ def ocr_upload_extract_auto():
         try:
             # Save uploaded file to temporary location
             file.save(temp_path)
-            logger.info(f"OCR upload extract-auto request for: {file.filename} (preprocess: {preprocess}, auto_rotate: {auto_rotate}, readability: {improve_readability})")
+            logger.debug("OCR upload extract-auto request for: %s (preprocess: %s, auto_rotate: %s, readability: %s)",
+                         file.filename, preprocess, auto_rotate, improve_readability)
             
             # Process with auto language detection
-            result = ocr_service.extract_text_auto_language(
-                temp_path, preprocess, auto_rotate, improve_readability, post_process
-            )
+            result = run_ocr('extract_text_auto_language', temp_path, deadline, preprocess, auto_rotate,
+                             improve_readability, post_process)
             result = with_ocr_provider(result)
             success = result.get('success', False)
             
@@ -758,27 +1248,103 @@ def ocr_upload_extract_auto():
             result['original_filename'] = file.filename
             
             if success:
-                logger.info(f"OCR upload extract-auto completed: {result.get('character_count', 0)} characters, confidence: {result.get('confidence', 0):.1f}%, detected language: {result.get('detected_language', 'unknown')}")
+                logger.info("OCR upload extract-auto completed: %d characters, confidence: %.1f%%, detected language: %s",
+                            result.get('character_count', 0), result.get('confidence', 0),
+                            result.get('detected_language', 'unknown'))
             else:
-                logger.error(f"OCR upload extract-auto failed: {result.get('error', 'Unknown error')}")
+                logger.error("OCR upload extract-auto failed: %s", result.get('error', 'Unknown error'))
             
-            return jsonify(result)
+            return jsonify(ocr_response.shape(result, response_options))
             
         finally:
             # Clean up temporary file
             if os.path.exists(temp_path):
                 os.remove(temp_path)
                 
+    except ResponseOptionsError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logger.error("OCR upload extract-auto endpoint error: %s", e, exc_info=True)
+        return jsonify({"success": False, "error": f"Internal server error: {str(e)}"}), 500
+    finally:
+        if metrics:
+            metrics.increment_requests(success, request.path)
+
+@app.route('/ocr/document', methods=['POST'])
+def ocr_document():
+    """Extract text from every page of a PDF or multi-page TIFF by path or media key"""
+    success = False
+
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"success": False, "error": "No JSON data provided"}), 400
+
+        document_path = request_image(data, 'document_path')
+        if not document_path:
+            return jsonify({"success": False, "error": "document_path or media_key is required"}), 400
+        if not os.path.isfile(document_path):
+            return jsonify({"success": False, "error": f"Document not found: {document_path}"}), 404
+
+        logger.debug("Document OCR request for: %s", document_path)
+        response = document_ocr(document_path, data)
+        success = True
+        return response
+
+    except (DocumentError, ResponseOptionsError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except ImageSourceError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status
+    except Exception as e:
+        logger.error("OCR document endpoint error: %s", e, exc_info=True)
+        return jsonify({"success": False, "error": f"Internal server error: {str(e)}"}), 500
+    finally:
+        if metrics:
+            metrics.increment_requests(success, request.path)
+
+@app.route('/ocr/upload-document', methods=['POST'])
+def ocr_upload_document():
+    """Extract text from every page of an uploaded PDF or multi-page TIFF"""
+    success = False
+    temp_path = None
+
+    try:
+        if 'document' not in request.files:
+            return jsonify({"success": False, "error": "No document file provided"}), 400
+
+        file = request.files['document']
+        if file.filename == '':
+            return jsonify({"success": False, "error": "No document file selected"}), 400
+
+        file_ext = os.path.splitext(file.filename)[1].lower()
+        if file_ext not in documents.DOCUMENT_EXTENSIONS:
+            allowed = ', '.join(sorted(documents.DOCUMENT_EXTENSIONS))
+            return jsonify({"success": False, "error": f"Invalid file type. Allowed: {allowed}"}), 400
+
+        temp_path = os.path.join(tempfile.gettempdir(), f"ocr_document_{uuid.uuid4()}{file_ext}")
+        file.save(temp_path)
+        logger.debug("Document OCR upload request for: %s", file.filename)
+
+        # The upload is removed when the last page is done (after streaming, if streamed)
+        response = document_ocr(temp_path, request.form, cleanup_path=temp_path)
+        temp_path = None
+        success = True
+        return response
+
+    except (DocumentError, ResponseOptionsError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
-        logger.error(f"OCR upload extract-auto endpoint error: {str(e)}", exc_info=True)
+        logger.error("OCR upload document endpoint error: %s", e, exc_info=True)
         return jsonify({"success": False, "error": f"Internal server error: {str(e)}"}), 500
     finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
         if metrics:
-            metrics.increment_requests(success)
+            metrics.increment_requests(success, request.path)
 
 # Graceful shutdown handler
 def signal_handler(signum, frame):
-    logger.info(f"Received signal {signum}, shutting down gracefully...")
+    logger.info("Received signal %s, shutting down gracefully...", signum)
     sys.exit(0)
 
 signal.signal(signal.SIGINT, signal_handler)
@@ -786,30 +1352,34 @@ signal.signal(signal.SIGTERM, signal_handler)
 
 if __name__ == "__main__":
     logger.info("🚀 Starting OpenCV Feature Matching Service v2.0.0...")
-    logger.info(f"📡 Service running at: http://{config.HOST}:{config.PORT}")
-    logger.info(f"🔧 Configuration:")
-    logger.info(f"  - ORB Features: {config.ORB_FEATURES}")
-    logger.info(f"  - Max File Size: {config.MAX_FILE_SIZE // (1024*1024)}MB")
-    logger.info(f"  - Request Timeout: {config.REQUEST_TIMEOUT}s")
-    logger.info(f"  - Debug Mode: {config.DEBUG}")
-    logger.info(f"  - Metrics Enabled: {config.ENABLE_METRICS}")
-    logger.info(f"🔍 Available Endpoints:")
-    logger.info(f"  - GET  /health - Health check with system info")
-    logger.info(f"  - GET  /metrics - Service metrics")
-    logger.info(f"  - GET  /info - Service information")
-    logger.info(f"  - POST /extract - Extract features from image")
-    logger.info(f"  - POST /match - Match two descriptor sets")
-    logger.info(f"  - POST /compare - Compare image against stored descriptors")
-    logger.info(f"  - POST /ocr/extract - Extract text from image using OCR")
-    logger.info(f"  - POST /ocr/extract-with-boxes - Extract text with bounding boxes")
-    logger.info(f"  - POST /ocr/upload-extract - Extract text from uploaded image file")
-    logger.info(f"  - POST /ocr/upload-extract-with-boxes - Extract text with boxes from uploaded file")
-    logger.info(f"  - POST /ocr/extract-auto - Extract text with automatic language detection")
-    logger.info(f"  - POST /ocr/upload-extract-auto - Extract text from uploaded file with auto language detection")
-    logger.info(f"  - GET  /ocr/languages - Get supported OCR languages")
-    logger.info(f"  - GET  /ocr/info - Get OCR service information")
-    logger.info(f"📊 OpenCV Version: {cv2.__version__}")
-    logger.info(f"🐍 Python Version: {sys.version.split()[0]}")
+    logger.info("📡 Service running at: http://%s:%s", config.HOST, config.PORT)
+    logger.info("🔧 Configuration:")
+    logger.info("  - ORB Features: %s", config.ORB_FEATURES)
+    logger.info("  - Max File Size: %sMB", config.MAX_FILE_SIZE // (1024*1024))
+    logger.info("  - Request Timeout: %ss", config.REQUEST_TIMEOUT)
+    logger.info("  - OCR Time Budget: %ss", config.OCR_TIME_BUDGET)
+    logger.info("  - Debug Mode: %s", config.DEBUG)
+    logger.info("  - Metrics Enabled: %s", config.ENABLE_METRICS)
+    logger.info("  - OpenCV Threads: %s (pool: %s)", cv2.getNumThreads(), thread_policy.pool_threads)
+    logger.info("🔍 Available Endpoints:")
+    logger.info("  - GET  /health - Health check with system info")
+    logger.info("  - GET  /metrics - Service metrics")
+    logger.info("  - GET  /info - Service information")
+    logger.info("  - POST /extract - Extract features from image")
+    logger.info("  - POST /match - Match two descriptor sets")
+    logger.info("  - POST /compare - Compare image against stored descriptors")
+    logger.info("  - POST /ocr/extract - Extract text from image using OCR")
+    logger.info("  - POST /ocr/extract-with-boxes - Extract text with bounding boxes")
+    logger.info("  - POST /ocr/upload-extract - Extract text from uploaded image file")
+    logger.info("  - POST /ocr/upload-extract-with-boxes - Extract text with boxes from uploaded file")
+    logger.info("  - POST /ocr/extract-auto - Extract text with automatic language detection")
+    logger.info("  - POST /ocr/upload-extract-auto - Extract text from uploaded file with auto language detection")
+    logger.info("  - POST /ocr/document - Extract text from every page of a PDF or multi-page TIFF")
+    logger.info("  - POST /ocr/upload-document - Extract text from every page of an uploaded document")
+    logger.info("  - GET  /ocr/languages - Get supported OCR languages")
+    logger.info("  - GET  /ocr/info - Get OCR service information")
+    logger.info("📊 OpenCV Version: %s", cv2.__version__)
+    logger.info("🐍 Python Version: %s", sys.version.split()[0])
     logger.info("=" * 60)
 
     try:
@@ -821,5 +1391,5 @@ if __name__ == "__main__":
             use_reloader=False  # Disable reloader in production
         )
     except Exception as e:
-        logger.error(f"Failed to start service: {str(e)}", exc_info=True)
+        logger.error("Failed to start service: %s", e, exc_info=True)
         sys.exit(1)
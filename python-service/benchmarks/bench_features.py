@@ -0,0 +1,324 @@
+"""
+Feature benchmark: ORB extraction, descriptor matching and /compare scaling
+
+Measures
+- extract_features() throughput by image resolution (synthetic + optional fixtures)
+- match_features() latency by descriptor count
+- compare latency as the catalog grows, for every matching mode, both in-process
+  (compare core) and through the Flask /compare endpoint for smaller catalogs
+
+Runs offline on CPU. Example:
+    python benchmarks/bench_features.py -o bench.json
+    python benchmarks/bench_features.py --baseline bench.json --threshold 0.2
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, Any, List, Callable
+
+import numpy as np
+
+from common import (
+    add_common_args, new_report, finish, progress, quiet_service_logging, synthetic_image,
+    summarize, time_call, parse_int_list, parse_resolutions
+)
+
+import cv2  # noqa: E402
+import app as service  # noqa: E402
+import retrieval  # noqa: E402
+import compact  # noqa: E402
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')
+# /compare's default similarity threshold
+DEFAULT_THRESHOLD = 0.2
+
+
+# Compare callables take the query signature ({"descriptors", "phash"}) and the catalog
+def compare_bruteforce(query, catalog):
+    return service.compare_descriptors(query['descriptors'], catalog)
+
+
+def compare_prefilter(query, catalog):
+    best_match, all_matches, _ = service.compare_with_prefilter(query, catalog, DEFAULT_THRESHOLD)
+    return best_match, all_matches
+
+
+def compare_verified(query, catalog):
+    _, all_matches = service.compare_descriptors(query['descriptors'], catalog)
+    best_match, _ = service.verify_matches(query, catalog, all_matches, service.verification.MIN_INLIERS)
+    return best_match, all_matches
+
+
+# name -> (in-process compare callable, extra /compare request fields, optional catalog entry fields)
+MATCHING_MODES: Dict[str, tuple] = {
+    'bruteforce': (compare_bruteforce, {'prefilter': False}, ()),
+    'phash': (compare_prefilter, {}, ('phash',)),
+    # BoW shortlist only: catalog entries carry no phash; uses a vocabulary trained on the pool
+    'retrieval': (compare_prefilter, {}, ()),
+    'verified': (compare_verified, {'prefilter': False, 'verify': True}, ('keypoints',)),
+}
+
+
+def bench_extraction(args, workdir: str) -> List[Dict[str, Any]]:
+    results = []
+    images = []
+    for index, (width, height) in enumerate(parse_resolutions(args.resolutions)):
+        path = os.path.join(workdir, f"synthetic_{width}x{height}.png")
+        cv2.imwrite(path, synthetic_image(width, height, args.seed + index))
+        images.append((f"extract/synthetic/{width}x{height}", path, width * height))
+    if args.fixtures:
+        for name in sorted(os.listdir(args.fixtures)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(args.fixtures, name)
+                img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+                if img is not None:
+                    images.append((f"extract/fixture/{name}", path, img.size))
+
+    for case_id, path, pixels in images:
+        progress(f"  {case_id}")
+        descriptors = service.extract_features(path)
+        stats = time_call(lambda: service.extract_features(path), args.repeat, args.warmup)
+        stats.update({
+            "id": case_id,
+            "group": "extraction",
+            "megapixels": round(pixels / 1e6, 3),
+            "features": len(descriptors) if descriptors is not None else 0,
+            "images_per_second": round(1000.0 / stats['p50_ms'], 3) if stats['p50_ms'] else None,
+            "megapixels_per_second": round(pixels / 1e6 / (stats['p50_ms'] / 1000.0), 3) if stats['p50_ms'] else None
+        })
+        results.append(stats)
+    return results
+
+
+def bench_matching(args) -> List[Dict[str, Any]]:
+    results = []
+    rng = np.random.default_rng(args.seed)
+    for count in parse_int_list(args.descriptor_counts):
+        case_id = f"match/{count}x{count}"
+        progress(f"  {case_id}")
+        query = rng.integers(0, 256, (count, 32), dtype=np.uint8).tolist()
+        stored = rng.integers(0, 256, (count, 32), dtype=np.uint8).tolist()
+        stats = time_call(lambda: service.match_features(query, stored), args.repeat * 4, args.warmup)
+        stats.update({"id": case_id, "group": "matching", "descriptors": count})
+        results.append(stats)
+    return results
+
+
+def build_catalog(size: int, pool: List[Dict[str, Any]], fields: tuple = ()) -> List[Dict[str, Any]]:
+    """Catalog of `size` entries sharing a pool of real signatures (keeps memory flat)"""
+    catalog = []
+    for i in range(size):
+        signature = pool[i % len(pool)]
+        entry = {"id": i, "descriptors": signature['descriptors']}
+        entry.update((field, signature[field]) for field in fields)
+        catalog.append(entry)
+    return catalog
+
+
+def build_retrieval_index(catalog: List[Dict[str, Any]], pool: List[Dict[str, Any]],
+                          vocabulary: retrieval.Vocabulary) -> retrieval.InvertedIndex:
+    encoded = [vocabulary.encode(signature['descriptors']) for signature in pool]
+    index = retrieval.InvertedIndex(vocabulary)
+    for entry in catalog:
+        index.add(entry['id'], *encoded[entry['id'] % len(pool)])
+    return index
+
+
+def bench_compare(args, workdir: str) -> List[Dict[str, Any]]:
+    results = []
+    query_path = os.path.join(workdir, 'query.png')
+    cv2.imwrite(query_path, synthetic_image(1280, 960, args.seed))
+    query = service.extract_signature(query_path)
+
+    progress(f"  building descriptor pool ({args.pool_size} images)")
+    pool = []
+    for index in range(args.pool_size):
+        pool_path = os.path.join(workdir, f"pool_{index}.png")
+        cv2.imwrite(pool_path, synthetic_image(800, 600, args.seed + 1000 + index))
+        signature = service.extract_signature(pool_path)
+        if signature:
+            pool.append(signature)
+    # Make the query a true duplicate of one catalog entry
+    pool[0] = query
+
+    modes = args.modes.split(',') if args.modes else list(MATCHING_MODES)
+    vocabulary = None
+    configured_index = service.retrieval_index
+    if 'retrieval' in modes:
+        progress(f"  training a {args.vocabulary_words}-word vocabulary on the pool")
+        vocabulary = retrieval.train_vocabulary([np.array(s['descriptors'], np.uint8) for s in pool],
+                                                args.vocabulary_words, seed=args.seed)
+    client = service.app.test_client()
+
+    for mode in modes:
+        if mode not in MATCHING_MODES:
+            progress(f"  unknown matching mode '{mode}', skipping")
+            continue
+        compare_fn, request_fields, catalog_fields = MATCHING_MODES[mode]
+        per_entry_seconds = None
+        for size in parse_int_list(args.catalog_sizes):
+            case_id = f"compare/{mode}/{size}"
+            if per_entry_seconds is not None and per_entry_seconds * size > args.max_case_seconds:
+                progress(f"  {case_id}: skipped (projected {per_entry_seconds * size:.1f}s per run)")
+                results.append({"id": case_id, "group": "compare", "mode": mode, "catalog_size": size,
+                                "skipped": True,
+                                "projected_ms": round(per_entry_seconds * size * 1000, 1)})
+                continue
+            progress(f"  {case_id}")
+            catalog = build_catalog(size, pool, catalog_fields)
+            mode_query = query
+            if mode == 'retrieval':
+                # The endpoint picks the index up from the service module
+                service.retrieval_index = build_retrieval_index(catalog, pool, vocabulary)
+                words, weights = vocabulary.encode(query['descriptors'])
+                mode_query = dict(query, bow={"words": words, "weights": weights})
+
+            start = time.perf_counter()
+            best_match, _ = compare_fn(mode_query, catalog)
+            first = time.perf_counter() - start
+            per_entry_seconds = first / size
+            repeat = max(1, min(args.repeat, int(args.max_case_seconds / max(first, 1e-6))))
+            stats = time_call(lambda: compare_fn(mode_query, catalog), repeat, 0)
+            stats.update({
+                "id": case_id,
+                "group": "compare",
+                "mode": mode,
+                "catalog_size": size,
+                "found_duplicate": bool(best_match and best_match['id'] % len(pool) == 0),
+                "us_per_entry": round(stats['p50_ms'] * 1000.0 / size, 3)
+            })
+            results.append(stats)
+
+            if size <= args.endpoint_max_catalog:
+                payload = dict(request_fields, query_image_path=query_path, stored_descriptors=catalog)
+                # Signatures hold arrays: serialize as the service does
+                body = service.app.json.dumps(payload)
+                endpoint_id = f"compare_endpoint/{mode}/{size}"
+                progress(f"  {endpoint_id} ({len(body) / 1e6:.1f} MB request)")
+
+                def post():
+                    response = client.post('/compare', data=body, content_type='application/json')
+                    response.get_data()
+
+                endpoint_stats = time_call(post, repeat, 0)
+                endpoint_stats.update({"id": endpoint_id, "group": "compare_endpoint", "mode": mode,
+                                       "catalog_size": size, "request_bytes": len(body)})
+                results.append(endpoint_stats)
+            del catalog
+            service.retrieval_index = configured_index
+    return results
+
+
+def distorted(image: np.ndarray, seed: int) -> np.ndarray:
+    """Re-photographed look: rotation, downscale and JPEG compression"""
+    rng = np.random.default_rng(seed)
+    height, width = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), float(rng.uniform(-15, 15)), float(rng.uniform(0.7, 0.9)))
+    warped = cv2.warpAffine(image, matrix, (width, height), borderValue=(255, 255, 255))
+    _, encoded = cv2.imencode('.jpg', warped, [cv2.IMWRITE_JPEG_QUALITY, 60])
+    return cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+
+def bench_recall(args, workdir: str) -> List[Dict[str, Any]]:
+    """
+    Recall@1 of distorted queries against full and keypoint-budgeted (packed)
+    catalogs, by similarity and with geometric verification, and the catalog
+    footprint per entry
+    """
+    catalogs: Dict[str, List[Dict[str, Any]]] = {"full": []}
+    budgets = parse_int_list(args.keypoint_budgets)
+    for budget in budgets:
+        catalogs[f"anms/{budget}"] = []
+    queries = []
+    for index in range(args.recall_images):
+        image = synthetic_image(800, 600, args.seed + 2000 + index)
+        path = os.path.join(workdir, f"recall_{index}.png")
+        cv2.imwrite(path, image)
+        query_path = os.path.join(workdir, f"recall_query_{index}.png")
+        cv2.imwrite(query_path, distorted(image, args.seed + index))
+        full = service.extract_signature(path)
+        catalogs["full"].append({"id": index, "descriptors": full['descriptors'], "keypoints": full['keypoints']})
+        for budget in budgets:
+            packed = service.extract_signature(path, max_keypoints=budget, packed=True)
+            catalogs[f"anms/{budget}"].append({"id": index, "descriptors": packed['descriptors'],
+                                               "keypoints": packed['keypoints']})
+        queries.append(service.extract_signature(query_path))
+
+    results = []
+    for name, catalog in catalogs.items():
+        progress(f"  recall/{name}")
+        hits = verified_hits = 0
+        samples = []
+        for source, query in enumerate(queries):
+            start = time.perf_counter()
+            best_match, all_matches = service.compare_descriptors(query['descriptors'], catalog)
+            samples.append(time.perf_counter() - start)
+            hits += bool(best_match and best_match['id'] == source)
+            verified_best, _ = service.verify_matches(query, catalog, all_matches,
+                                                      service.verification.MIN_INLIERS)
+            verified_hits += bool(verified_best and verified_best['id'] == source)
+        stats = summarize(samples)
+        stats.update({
+            "id": f"recall/{name}",
+            "group": "recall",
+            "recall_at_1": round(hits / len(queries), 4),
+            "verified_recall_at_1": round(verified_hits / len(queries), 4),
+            "entry_json_bytes": round(sum(len(service.app.json.dumps(entry)) for entry in catalog)
+                                      / len(catalog)),
+            "footprint_bytes": round(sum(compact.descriptor_count(entry['descriptors']) for entry in catalog)
+                                     / len(catalog)) * (compact.DESCRIPTOR_BYTES + 4)
+        })
+        results.append(stats)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_common_args(parser)
+    parser.add_argument('--resolutions', default='640x480,1280x960,2048x1536,4000x3000')
+    parser.add_argument('--fixtures', help='Directory of real images to include in the extraction benchmark')
+    parser.add_argument('--descriptor-counts', default='100,250,500,1000')
+    parser.add_argument('--catalog-sizes', default='100,1000,10000,100000')
+    parser.add_argument('--modes', help=f"Comma-separated matching modes (default: all of {', '.join(MATCHING_MODES)})")
+    parser.add_argument('--pool-size', type=int, default=32,
+                        help='Distinct synthetic images whose descriptors populate the catalog')
+    parser.add_argument('--vocabulary-words', type=int, default=256,
+                        help='Vocabulary size trained for the retrieval mode')
+    parser.add_argument('--endpoint-max-catalog', type=int, default=1000,
+                        help='Largest catalog also measured end-to-end through POST /compare')
+    parser.add_argument('--max-case-seconds', type=float, default=60.0,
+                        help='Skip catalog sizes whose projected single run exceeds this')
+    parser.add_argument('--keypoint-budgets', default='100,200',
+                        help='Keypoint budgets of the packed catalogs in the recall group')
+    parser.add_argument('--recall-images', type=int, default=24,
+                        help='Catalog images (each queried once, distorted) in the recall group')
+    parser.add_argument('--only', choices=['extraction', 'matching', 'compare', 'recall'],
+                        help='Run a single group')
+    args = parser.parse_args(argv)
+
+    quiet_service_logging()
+    report = new_report('features', args)
+    report['config']['orb_features'] = service.config.ORB_FEATURES
+
+    with tempfile.TemporaryDirectory(prefix='bench_features_') as workdir:
+        if args.only in (None, 'extraction'):
+            progress("ORB extraction")
+            report['results'] += bench_extraction(args, workdir)
+        if args.only in (None, 'matching'):
+            progress("Descriptor matching")
+            report['results'] += bench_matching(args)
+        if args.only in (None, 'compare'):
+            progress("Compare scaling")
+            report['results'] += bench_compare(args, workdir)
+        if args.only in (None, 'recall'):
+            progress("Catalog recall")
+            report['results'] += bench_recall(args, workdir)
+
+    return finish(report, args, higher_is_worse={"recall_at_1": False, "verified_recall_at_1": False})
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""
+JSON benchmark: response encoding and request parsing of real payloads
+
+Measures, for each available JSON provider (stdlib, orjson):
+- encode: provider.response() as jsonify builds it, for /extract responses
+  (descriptor arrays and the integer lists clients echo back), /compare
+  requests and responses, and OCR responses with raw_data and boxes
+- decode: request-body parsing of the same payloads as a client sends them
+
+Runs offline on CPU. Example:
+    python benchmarks/bench_json.py -o bench-json.json
+    python benchmarks/bench_json.py --baseline bench-json.json --threshold 0.2
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from typing import Dict, Any, List
+
+import numpy as np
+
+from common import (
+    add_common_args, new_report, finish, progress, quiet_service_logging, synthetic_image,
+    time_call, parse_int_list
+)
+
+import cv2  # noqa: E402
+import app as service  # noqa: E402
+import json_provider  # noqa: E402
+import ocr_response  # noqa: E402
+
+
+def ocr_raw_data(words: int, rng: np.random.Generator) -> Dict[str, List[Any]]:
+    """image_to_data output of a dense page: one entry per word in each of 12 lists"""
+    data = {name: rng.integers(0, 40, words).tolist()
+            for name in ('level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num')}
+    data.update({name: rng.integers(0, 3000, words).tolist() for name in ('left', 'top', 'width', 'height')})
+    data['conf'] = rng.integers(-1, 97, words).tolist()
+    data['text'] = [f"word{i % 997}" for i in range(words)]
+    return data
+
+
+def build_payloads(args, workdir: str) -> Dict[str, Any]:
+    rng = np.random.default_rng(args.seed)
+    path = os.path.join(workdir, 'extract.png')
+    cv2.imwrite(path, synthetic_image(1280, 960, args.seed))
+    signature = service.extract_signature(path)
+    extract = {
+        "success": True,
+        "descriptors": signature['descriptors'],
+        "keypoints": signature['keypoints'],
+        "feature_count": len(signature['descriptors']),
+        "phash": signature['phash'],
+        "footprint_bytes": signature['footprint_bytes'],
+        "processing_time": 0.1
+    }
+    payloads = {
+        "extract/arrays": extract,
+        "extract/lists": dict(extract, descriptors=signature['descriptors'].tolist(),
+                              keypoints=signature['keypoints'].tolist())
+    }
+    for size in parse_int_list(args.catalog_sizes):
+        # As the Node app sends it: integer lists per stored entry
+        payloads[f"compare_request/{size}"] = {
+            "query_image_path": path,
+            "stored_descriptors": [{"id": i, "descriptors": signature['descriptors'].tolist()}
+                                   for i in range(size)]
+        }
+        matches = [{"id": i, "similarity": float(rng.random()), "match_count": int(rng.integers(0, 500))}
+                   for i in range(size)]
+        payloads[f"compare_response/{size}"] = {
+            "success": True, "found": True, "best_match": matches[0], "all_matches": matches,
+            "processing_time": 0.5
+        }
+    for words in parse_int_list(args.ocr_words):
+        data = ocr_raw_data(words, rng)
+        columns = ocr_response.box_columns(data)
+        payloads[f"ocr_raw_data/{words}"] = {"success": True, "text": " ".join(columns['text']),
+                                             "confidence": 88.0, "raw_data": data}
+        payloads[f"ocr_boxes/{words}"] = {"success": True, "text": " ".join(columns['text']),
+                                          "boxes": ocr_response.encode_boxes(columns)}
+    return payloads
+
+
+def bench_provider(name: str, provider, payloads: Dict[str, Any], args) -> List[Dict[str, Any]]:
+    results = []
+    for payload_name, payload in payloads.items():
+        body = provider.response(payload).get_data()
+        case_id = f"encode/{name}/{payload_name}"
+        progress(f"  {case_id}")
+        stats = time_call(lambda: provider.response(payload), args.repeat, args.warmup)
+        stats.update({"id": case_id, "group": "encode", "provider": name, "bytes": len(body)})
+        results.append(stats)
+
+        case_id = f"decode/{name}/{payload_name}"
+        stats = time_call(lambda: provider.loads(body), args.repeat, args.warmup)
+        stats.update({"id": case_id, "group": "decode", "provider": name, "bytes": len(body)})
+        results.append(stats)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_common_args(parser)
+    parser.add_argument('--catalog-sizes', default='100,500',
+                        help='Stored entries in the /compare request and response payloads')
+    parser.add_argument('--ocr-words', default='500,3000', help='Words per page in the OCR payloads')
+    parser.add_argument('--providers', help='Comma-separated providers (default: stdlib and orjson if installed)')
+    args = parser.parse_args(argv)
+
+    quiet_service_logging()
+    report = new_report('json', args)
+    names = args.providers.split(',') if args.providers else ['stdlib'] + (['orjson'] if json_provider.orjson else [])
+    report['config']['providers'] = names
+
+    with tempfile.TemporaryDirectory(prefix='bench_json_') as workdir:
+        payloads = build_payloads(args, workdir)
+        for name in names:
+            progress(f"Provider {name}")
+            provider = json_provider.provider_class(name)(service.app)
+            report['results'] += bench_provider(name, provider, payloads, args)
+
+    return finish(report, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
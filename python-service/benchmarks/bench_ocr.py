@@ -0,0 +1,191 @@
+"""
+OCR benchmark: latency, Tesseract invocations and accuracy per endpoint and options
+
+Runs every OCRService entry point (the code behind /ocr/extract, /ocr/extract-with-boxes
+and /ocr/extract-auto) with several option combinations over the rendered corpus
+(see ocr_corpus.py) and reports, per combination, p50/p95 latency, Tesseract calls
+per request and character error rate (CER) against the ground truth.
+
+Requires the tesseract binary and language packs. Example:
+    python benchmarks/bench_ocr.py --corpus-dir /tmp/ocr_corpus -o ocr.json
+    python benchmarks/bench_ocr.py --corpus-dir /tmp/ocr_corpus --baseline ocr.json
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Callable
+
+from common import add_common_args, new_report, finish, progress, quiet_service_logging, summarize
+from ocr_corpus import build_corpus
+
+import pytesseract  # noqa: E402
+from ocr_service import ocr_service, Deadline  # noqa: E402
+
+
+def _extract(item, opts, deadline):
+    return ocr_service.extract_text(item['path'], language=item['language'], deadline=deadline, **opts)
+
+
+def _extract_single_config(item, opts, deadline):
+    return ocr_service.extract_text(item['path'], language=item['language'], config=ocr_service.default_config,
+                                    deadline=deadline, **opts)
+
+
+def _extract_with_boxes(item, opts, deadline):
+    return ocr_service.extract_text_with_boxes(item['path'], language=item['language'], deadline=deadline, **opts)
+
+
+def _extract_auto(item, opts, deadline):
+    return ocr_service.extract_text_auto_language(item['path'], deadline=deadline, **opts)
+
+
+# Service entry points, named after the routes that call them
+ENDPOINTS: Dict[str, Callable] = {
+    'extract': _extract,                       # /ocr/extract (multi-config)
+    'extract_config': _extract_single_config,  # /ocr/extract with an explicit config
+    'extract_with_boxes': _extract_with_boxes,  # /ocr/extract-with-boxes
+    'extract_auto': _extract_auto,             # /ocr/extract-auto
+}
+
+OPTION_SETS: Dict[str, Dict[str, bool]] = {
+    'default': dict(preprocess=True, auto_rotate=True, improve_readability=False, post_process=True),
+    'readability': dict(preprocess=True, auto_rotate=True, improve_readability=True, post_process=True),
+    'no_rotate': dict(preprocess=True, auto_rotate=False, improve_readability=False, post_process=True),
+    'no_preprocess': dict(preprocess=False, auto_rotate=False, improve_readability=False, post_process=True),
+    'no_post_process': dict(preprocess=True, auto_rotate=True, improve_readability=False, post_process=False),
+}
+
+
+def levenshtein(a: str, b: str) -> int:
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def character_error_rate(reference: str, hypothesis: str) -> float:
+    """Edit distance over reference length, with whitespace normalized"""
+    reference = ' '.join(reference.split())
+    hypothesis = ' '.join((hypothesis or '').split())
+    if not reference:
+        return 0.0 if not hypothesis else 1.0
+    return levenshtein(reference, hypothesis) / len(reference)
+
+
+class TesseractCallCounter:
+    """Counts pytesseract invocations made through OCRService._run_tesseract"""
+
+    def __init__(self, service):
+        self.counts: Counter = Counter()
+        original = service._run_tesseract
+
+        def counting(method, *args, **kwargs):
+            self.counts[method] += 1
+            return original(method, *args, **kwargs)
+        service._run_tesseract = counting
+
+    def take(self) -> Counter:
+        counts, self.counts = self.counts, Counter()
+        return counts
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_common_args(parser)
+    parser.set_defaults(repeat=1, warmup=0, min_ms=1.0)
+    parser.add_argument('--corpus-dir', default=os.path.join(os.path.expanduser('~'), '.cache', 'archivart-ocr-corpus'),
+                        help='Where the rendered corpus is generated / cached')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    parser.add_argument('--options', default=','.join(OPTION_SETS))
+    parser.add_argument('--languages', help='Comma-separated corpus languages (default: all installed)')
+    parser.add_argument('--limit', type=int, help='Use only the first N corpus images')
+    parser.add_argument('--time-budget', type=float, help='Run every request with this deadline (seconds)')
+    parser.add_argument('--per-item', action='store_true', help='Include one result row per corpus image')
+    args = parser.parse_args(argv)
+
+    quiet_service_logging()
+    try:
+        version = str(pytesseract.get_tesseract_version())
+        installed = set(pytesseract.get_languages())
+    except Exception as e:
+        progress(f"Tesseract is not available: {e}")
+        return 2
+
+    languages = args.languages.split(',') if args.languages else None
+    manifest = build_corpus(args.corpus_dir, languages=languages)
+    skipped_languages = sorted({item['language'] for item in manifest} - installed)
+    manifest = [item for item in manifest if item['language'] in installed]
+    if args.limit:
+        manifest = manifest[:args.limit]
+
+    report = new_report('ocr', args)
+    report['environment']['tesseract'] = version
+    report['config']['corpus_items'] = len(manifest)
+    report['config']['skipped_languages'] = skipped_languages
+
+    counter = TesseractCallCounter(ocr_service)
+    for endpoint in args.endpoints.split(','):
+        for option_name in args.options.split(','):
+            run = ENDPOINTS[endpoint]
+            opts = OPTION_SETS[option_name]
+            progress(f"{endpoint}/{option_name}")
+            latencies: List[float] = []
+            calls: List[int] = []
+            errors: List[float] = []
+            partial = 0
+            failures = 0
+            for item in manifest:
+                item_latencies = []
+                for _ in range(args.warmup):
+                    run(item, opts, None)
+                for _ in range(args.repeat):
+                    deadline = Deadline(args.time_budget) if args.time_budget else None
+                    counter.take()
+                    start = time.perf_counter()
+                    result = run(item, opts, deadline)
+                    item_latencies.append(time.perf_counter() - start)
+                    item_calls = sum(counter.take().values())
+                cer = character_error_rate(item['text'], result.get('text', ''))
+                latencies.extend(item_latencies)
+                calls.append(item_calls)
+                errors.append(cer)
+                failures += 0 if result.get('success') else 1
+                partial += 1 if deadline is not None and deadline.partial else 0
+                if args.per_item:
+                    row = summarize(item_latencies)
+                    row.update({"id": f"ocr/{endpoint}/{option_name}/{item['id']}", "group": "ocr_item",
+                                "tesseract_calls": item_calls, "cer": round(cer, 4),
+                                "confidence": result.get('confidence'), "success": bool(result.get('success'))})
+                    report['results'].append(row)
+            if not latencies:
+                continue
+            row = summarize(latencies)
+            row.update({
+                "id": f"ocr/{endpoint}/{option_name}",
+                "group": "ocr",
+                "endpoint": endpoint,
+                "options": opts,
+                "items": len(manifest),
+                "tesseract_calls": round(statistics.fmean(calls), 2),
+                "tesseract_calls_max": max(calls),
+                "cer": round(statistics.fmean(errors), 4),
+                "cer_p95": round(sorted(errors)[min(len(errors) - 1, int(round(0.95 * (len(errors) - 1))))], 4),
+                "failures": failures,
+                "partial_results": partial
+            })
+            report['results'].append(row)
+
+    return finish(report, args, higher_is_worse={"cer": True, "tesseract_calls": True})
+
+
+if __name__ == '__main__':
+    sys.exit(main())
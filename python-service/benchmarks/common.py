@@ -0,0 +1,185 @@
+"""
+Shared helpers for the benchmark suites
+Synthetic images, timing statistics, JSON reports and baseline comparison
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict, Any, List, Optional
+
+import numpy as np
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
+
+import cv2  # noqa: E402
+
+
+def quiet_service_logging():
+    """The service logs at INFO on every call; keep benchmark output readable"""
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def synthetic_image(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Deterministic textured BGR image (shapes, lines and text) with plenty of ORB corners"""
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 235, np.uint8)
+    scale = max(width, height) / 1000.0
+    for _ in range(int(60 * scale) + 20):
+        color = tuple(int(c) for c in rng.integers(0, 200, 3))
+        kind = rng.integers(0, 3)
+        x1, x2 = sorted(rng.integers(0, width, 2))
+        y1, y2 = sorted(rng.integers(0, height, 2))
+        if kind == 0:
+            cv2.rectangle(img, (int(x1), int(y1)), (int(x2), int(y2)), color, int(rng.integers(1, 6)))
+        elif kind == 1:
+            radius = int(rng.integers(5, max(6, min(width, height) // 6)))
+            cv2.circle(img, (int(x1), int(y1)), radius, color, int(rng.integers(1, 6)))
+        else:
+            cv2.line(img, (int(x1), int(y1)), (int(x2), int(y2)), color, int(rng.integers(1, 4)))
+    for line in range(int(12 * scale) + 4):
+        org = (int(rng.integers(0, max(1, width - 200))), int(rng.integers(20, height)))
+        cv2.putText(img, f"ArchivArt {seed}-{line}", org, cv2.FONT_HERSHEY_SIMPLEX,
+                    0.6 * max(scale, 0.5), (20, 20, 20), max(1, int(scale)))
+    noise = rng.normal(0, 6, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+
+def summarize(samples_s: List[float]) -> Dict[str, float]:
+    ms = sorted(s * 1000.0 for s in samples_s)
+    return {
+        "runs": len(ms),
+        "p50_ms": round(statistics.median(ms), 4),
+        "p95_ms": round(ms[min(len(ms) - 1, int(round(0.95 * (len(ms) - 1))))], 4),
+        "mean_ms": round(statistics.fmean(ms), 4),
+        "min_ms": round(ms[0], 4),
+        "max_ms": round(ms[-1], 4)
+    }
+
+
+def time_call(fn: Callable[[], Any], repeat: int = 5, warmup: int = 1) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def parse_resolutions(value: str) -> List[tuple]:
+    resolutions = []
+    for item in value.split(','):
+        width, _, height = item.strip().lower().partition('x')
+        resolutions.append((int(width), int(height)))
+    return resolutions
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "opencv_threads": cv2.getNumThreads()
+    }
+
+
+def add_common_args(parser: argparse.ArgumentParser):
+    parser.add_argument('--output', '-o', help='Write the JSON report to this file (default: stdout)')
+    parser.add_argument('--baseline', help='Compare against a previously saved JSON report')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='Allowed relative slowdown vs. baseline before a case counts as a regression')
+    parser.add_argument('--min-ms', type=float, default=0.05,
+                        help='Ignore regressions on cases faster than this in both runs (timer noise)')
+    parser.add_argument('--repeat', type=int, default=5, help='Measured runs per case')
+    parser.add_argument('--warmup', type=int, default=1, help='Unmeasured warm-up runs per case')
+    parser.add_argument('--seed', type=int, default=1234, help='Seed for synthetic data')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='cv2.setNumThreads() value for the run (default: OpenCV default)')
+
+
+def new_report(suite: str, args: argparse.Namespace) -> Dict[str, Any]:
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+    return {
+        "suite": suite,
+        "created_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "environment": environment(),
+        "config": {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        "results": []
+    }
+
+
+def compare_to_baseline(report: Dict[str, Any], baseline: Dict[str, Any], threshold: float,
+                        min_ms: float, metric: str = 'p50_ms',
+                        higher_is_worse: Optional[Dict[str, bool]] = None) -> List[Dict[str, Any]]:
+    """
+    Cases whose metric got worse by more than threshold. Extra per-case metrics can
+    be checked via higher_is_worse ({"cer": True, "throughput": False}).
+    """
+    checks = {metric: True}
+    checks.update(higher_is_worse or {})
+    previous = {r['id']: r for r in baseline.get('results', [])}
+    regressions = []
+    for result in report['results']:
+        before = previous.get(result['id'])
+        if before is None:
+            continue
+        for key, worse_when_higher in checks.items():
+            if key not in result or key not in before or result[key] is None or before[key] is None:
+                continue
+            old, new = float(before[key]), float(result[key])
+            if key.endswith('_ms') and max(old, new) < min_ms:
+                continue
+            if worse_when_higher:
+                limit = old * (1 + threshold) if old > 0 else threshold
+                regressed = new > limit
+            else:
+                regressed = new < old * (1 - threshold)
+            if regressed:
+                regressions.append({"id": result['id'], "metric": key, "baseline": old, "current": new,
+                                    "change": round((new - old) / old, 4) if old else None})
+    return regressions
+
+
+def finish(report: Dict[str, Any], args: argparse.Namespace,
+           higher_is_worse: Optional[Dict[str, bool]] = None) -> int:
+    """Write the report, compare with the baseline and return the process exit code"""
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as handle:
+            baseline = json.load(handle)
+        regressions = compare_to_baseline(report, baseline, args.threshold, args.min_ms,
+                                          higher_is_worse=higher_is_worse)
+        report['baseline'] = {"file": args.baseline, "threshold": args.threshold, "regressions": regressions}
+        for regression in regressions:
+            print(f"REGRESSION {regression['id']} {regression['metric']}: "
+                  f"{regression['baseline']} -> {regression['current']}", file=sys.stderr)
+        exit_code = 1 if regressions else 0
+    payload = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            handle.write(payload + '\n')
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(payload)
+    return exit_code
+
+
+def progress(message: str):
+    print(message, file=sys.stderr, flush=True)
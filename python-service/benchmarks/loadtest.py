@@ -0,0 +1,403 @@
+"""
+Load test: replay a mixed open-loop request stream against a running service
+
+Requests are scheduled at a fixed arrival rate (Poisson or uniform inter-arrival
+times) independently of how fast the service answers, so queueing inside gunicorn
+shows up as latency and timeouts instead of silently lowering the offered load.
+Latency is measured from each request's scheduled start. Several rates can be run
+back to back to find the knee of the curve.
+
+Reports, per rate step: achieved throughput, latency percentiles per route,
+error and timeout rates, and the RSS of every gunicorn worker sampled over time.
+
+The service must run on this machine (the JSON endpoints take server-side paths):
+    gunicorn -c gunicorn.conf.py app:app
+    python benchmarks/loadtest.py --rates 2,4,8 --duration 60 -o load.json
+    python benchmarks/loadtest.py --mix extract=1,compare=1 --catalog-size 1000 --rates 5
+"""
+
+import argparse
+import json
+import mimetypes
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import psutil
+
+from common import environment, finish, progress, synthetic_image, summarize
+from ocr_corpus import build_corpus
+
+import cv2  # noqa: E402
+
+DEFAULT_MIX = 'extract=30,compare=20,ocr_extract=20,ocr_upload_auto=10,health=20'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')
+
+
+class Fixtures:
+    """Images the traffic is drawn from: feature images, OCR pages and a /compare catalog"""
+
+    def __init__(self, workdir: str, fixtures_dir: Optional[str], seed: int):
+        self.images: List[str] = []
+        self.pages: List[str] = []
+        if fixtures_dir:
+            for name in sorted(os.listdir(fixtures_dir)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    self.images.append(os.path.abspath(os.path.join(fixtures_dir, name)))
+            self.pages = list(self.images)
+        if not self.images:
+            for index, (width, height) in enumerate([(800, 600), (1280, 960), (2048, 1536)] * 2):
+                path = os.path.join(workdir, f"image_{index}.jpg")
+                cv2.imwrite(path, synthetic_image(width, height, seed + index))
+                self.images.append(path)
+        if not self.pages:
+            corpus = build_corpus(os.path.join(workdir, 'ocr'), languages=['eng'],
+                                  skews=[0.0, 4.0], noise_levels=[0.0, 20.0], scales=[1.0])
+            self.pages = [item['path'] for item in corpus]
+        self.catalog_body: Optional[bytes] = None
+
+    def build_catalog(self, base_url: str, size: int, timeout: float):
+        """Extract descriptors through the service itself and tile them up to `size` entries"""
+        pool = []
+        for path in self.images:
+            status, body = post_json(f"{base_url}/extract", {"image_path": path}, timeout)
+            if status == 200:
+                pool.append(json.loads(body)['descriptors'])
+        if not pool:
+            raise RuntimeError("Could not build the /compare catalog: /extract failed for every fixture")
+        catalog = [{"id": i, "descriptors": pool[i % len(pool)]} for i in range(size)]
+        self.catalog_body = json.dumps(catalog).encode()
+
+
+def post_json(url: str, payload: Dict[str, Any], timeout: float) -> Tuple[int, bytes]:
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    return _send(request, timeout)
+
+
+def _send(request: urllib.request.Request, timeout: float) -> Tuple[int, bytes]:
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def multipart(fields: Dict[str, str], file_field: str, path: str) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    with open(path, 'rb') as handle:
+        data = handle.read()
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+                 f'filename="{os.path.basename(path)}"\r\nContent-Type: {content_type}\r\n\r\n'.encode()
+                 + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Traffic:
+    """Builds one request of a given kind; each kind maps to a service route"""
+
+    ROUTES = {
+        'extract': '/extract',
+        'compare': '/compare',
+        'ocr_extract': '/ocr/extract',
+        'ocr_upload_auto': '/ocr/upload-extract-auto',
+        'health': '/health',
+    }
+
+    def __init__(self, base_url: str, fixtures: Fixtures, rng: random.Random, ocr_time_budget: Optional[float]):
+        self.base_url = base_url
+        self.fixtures = fixtures
+        self.rng = rng
+        self.ocr_time_budget = ocr_time_budget
+        self.lock = threading.Lock()
+
+    def _pick(self, items: List[str]) -> str:
+        with self.lock:
+            return self.rng.choice(items)
+
+    def build(self, kind: str) -> urllib.request.Request:
+        url = self.base_url + self.ROUTES[kind]
+        if kind == 'health':
+            return urllib.request.Request(url)
+        if kind == 'extract':
+            body = json.dumps({"image_path": self._pick(self.fixtures.images)}).encode()
+            return urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+        if kind == 'compare':
+            # Splice the pre-serialized catalog instead of re-encoding it per request
+            head = json.dumps({"query_image_path": self._pick(self.fixtures.images)})[:-1].encode()
+            body = head + b', "stored_descriptors": ' + self.fixtures.catalog_body + b'}'
+            return urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+        if kind == 'ocr_extract':
+            payload = {"image_path": self._pick(self.fixtures.pages), "language": "eng"}
+            if self.ocr_time_budget:
+                payload["time_budget"] = self.ocr_time_budget
+            return urllib.request.Request(url, data=json.dumps(payload).encode(),
+                                          headers={'Content-Type': 'application/json'})
+        fields = {"time_budget": str(self.ocr_time_budget)} if self.ocr_time_budget else {}
+        body, content_type = multipart(fields, 'image', self._pick(self.fixtures.pages))
+        return urllib.request.Request(url, data=body, headers={'Content-Type': content_type})
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in Traffic.ROUTES:
+            raise SystemExit(f"Unknown traffic kind '{name}' (choose from {', '.join(Traffic.ROUTES)})")
+        mix[name] = float(weight or 1)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def find_server_process(pidfile: Optional[str], port: int) -> Optional[psutil.Process]:
+    """The gunicorn master: from its pidfile, else the process listening on the port"""
+    if pidfile and os.path.exists(pidfile):
+        try:
+            with open(pidfile) as handle:
+                return psutil.Process(int(handle.read().strip()))
+        except (ValueError, psutil.Error):
+            pass
+    try:
+        listeners = {conn.pid for conn in psutil.net_connections(kind='inet')
+                     if conn.status == psutil.CONN_LISTEN and conn.laddr and conn.laddr.port == port and conn.pid}
+    except psutil.AccessDenied:
+        return None
+    for pid in sorted(listeners):
+        try:
+            proc = psutil.Process(pid)
+            # Workers inherit the listening socket; report from the master
+            parent = proc.parent()
+            return parent if parent and parent.pid in listeners else proc
+        except psutil.NoSuchProcess:
+            continue
+    return None
+
+
+class RssSampler:
+    """Samples RSS of the server master and its workers on a background thread"""
+
+    def __init__(self, master: Optional[psutil.Process], interval: float):
+        self.master = master
+        self.interval = interval
+        self.samples: List[Dict[str, Any]] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+        self._origin = time.perf_counter()
+
+    def start(self):
+        if self.master is not None:
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            workers = {}
+            try:
+                for proc in [self.master] + self.master.children():
+                    try:
+                        workers[str(proc.pid)] = round(proc.memory_info().rss / 1024 / 1024, 1)
+                    except psutil.Error:
+                        continue
+            except psutil.Error:
+                return
+            self.samples.append({"t": round(time.perf_counter() - self._origin, 2), "rss_mb": workers})
+            self._stop.wait(self.interval)
+
+    def summary(self) -> Dict[str, Any]:
+        per_pid: Dict[str, List[float]] = {}
+        for sample in self.samples:
+            for pid, rss in sample['rss_mb'].items():
+                per_pid.setdefault(pid, []).append(rss)
+        master = str(self.master.pid) if self.master else None
+        return {
+            "master_pid": master,
+            "processes": {pid: {"first_mb": values[0], "last_mb": values[-1], "max_mb": max(values),
+                                "samples": len(values)} for pid, values in per_pid.items()},
+            "max_worker_mb": max((max(v) for pid, v in per_pid.items() if pid != master), default=None),
+            "max_total_mb": max((sum(s['rss_mb'].values()) for s in self.samples), default=None),
+            "timeline": self.samples
+        }
+
+
+def run_step(traffic: Traffic, mix: Dict[str, float], rate: float, duration: float, arrivals: str,
+             timeout: float, max_in_flight: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """Offer `rate` requests/s for `duration` seconds; returns one record per request"""
+    kinds, weights = list(mix), list(mix.values())
+    records: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+
+    def fire(kind: str, scheduled: float):
+        outcome, status = 'ok', None
+        try:
+            status, _ = _send(traffic.build(kind), timeout)
+            if status >= 500:
+                outcome = 'timeout' if status in (502, 504) else 'error'
+            elif status >= 400:
+                outcome = 'error'
+        except (socket.timeout, TimeoutError):
+            outcome = 'timeout'
+        except urllib.error.URLError as e:
+            outcome = 'timeout' if isinstance(e.reason, (socket.timeout, TimeoutError)) else 'connection_error'
+        except (ConnectionError, OSError):
+            # A worker killed by gunicorn's timeout drops the connection
+            outcome = 'connection_error'
+        finished = time.perf_counter()
+        with lock:
+            records.append({"kind": kind, "outcome": outcome, "status": status,
+                            "scheduled": scheduled, "latency": finished - scheduled, "finished": finished})
+
+    executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='load')
+    start = time.perf_counter()
+    scheduled = start
+    dropped = 0
+    in_flight = []
+    while True:
+        gap = rng.expovariate(rate) if arrivals == 'poisson' else 1.0 / rate
+        scheduled += gap
+        if scheduled - start >= duration:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        in_flight = [f for f in in_flight if not f.done()]
+        if len(in_flight) >= max_in_flight:
+            # Client saturated: count as dropped instead of silently slowing the arrival rate
+            dropped += 1
+            continue
+        in_flight.append(executor.submit(fire, rng.choices(kinds, weights)[0], scheduled))
+    executor.shutdown(wait=True)
+    for _ in range(dropped):
+        records.append({"kind": None, "outcome": "dropped", "status": None})
+    return records
+
+
+def summarize_step(records: List[Dict[str, Any]], rate: float, duration: float) -> List[Dict[str, Any]]:
+    results = []
+    sent = [r for r in records if r['kind'] is not None]
+    # Requests still in flight when the step ends stretch the measurement window
+    elapsed = max(duration, max((r['finished'] for r in sent), default=0) -
+                  min((r['scheduled'] for r in sent), default=0))
+    groups = {'all': sent}
+    for record in sent:
+        groups.setdefault(record['kind'], []).append(record)
+    for kind, group in groups.items():
+        if not group:
+            continue
+        latencies = [r['latency'] for r in group]
+        ok = [r for r in group if r['outcome'] == 'ok']
+        stats = summarize(latencies)
+        ms = sorted(latency * 1000.0 for latency in latencies)
+        stats['p99_ms'] = round(ms[min(len(ms) - 1, int(round(0.99 * (len(ms) - 1))))], 4)
+        stats.update({
+            "id": f"load/{rate:g}/{kind}",
+            "group": "load",
+            "route": Traffic.ROUTES.get(kind, kind),
+            "offered_rps": rate,
+            "requests": len(group),
+            "throughput_rps": round(len(ok) / elapsed, 3),
+            "error_rate": round(sum(r['outcome'] in ('error', 'connection_error') for r in group) / len(group), 4),
+            "timeout_rate": round(sum(r['outcome'] == 'timeout' for r in group) / len(group), 4),
+            "status_codes": dict(sorted((str(s), sum(r['status'] == s for r in group))
+                                        for s in {r['status'] for r in group}))
+        })
+        if kind == 'all':
+            stats['dropped'] = sum(r['outcome'] == 'dropped' for r in records)
+            stats['mean_latency_ok_ms'] = round(statistics.fmean(r['latency'] for r in ok) * 1000, 4) if ok else None
+        results.append(stats)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=f"http://127.0.0.1:{os.getenv('OPENCV_PORT', 5001)}")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"kind=weight,... (default: {DEFAULT_MIX})")
+    parser.add_argument('--rates', default='2', help='Comma-separated arrival rates (requests/s), run in order')
+    parser.add_argument('--duration', type=float, default=60.0, help='Seconds per rate step')
+    parser.add_argument('--arrivals', choices=['poisson', 'uniform'], default='poisson')
+    parser.add_argument('--catalog-size', type=int, default=100, help='Entries sent with every /compare request')
+    parser.add_argument('--ocr-time-budget', type=float, help='time_budget sent with OCR requests')
+    parser.add_argument('--fixtures', help='Directory of real images (default: synthetic images and OCR pages)')
+    parser.add_argument('--timeout', type=float, default=float(os.getenv('REQUEST_TIMEOUT', 30)) + 5,
+                        help='Client-side timeout per request (seconds)')
+    parser.add_argument('--max-in-flight', type=int, default=256,
+                        help='Client concurrency cap; arrivals beyond it are reported as dropped')
+    parser.add_argument('--pidfile', default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                          'opencv-service.pid'),
+                        help='gunicorn pidfile, used to find the workers for RSS sampling')
+    parser.add_argument('--rss-interval', type=float, default=1.0, help='Seconds between RSS samples')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--output', '-o', help='Write the JSON report to this file (default: stdout)')
+    parser.add_argument('--baseline', help='Compare against a previously saved JSON report')
+    parser.add_argument('--threshold', type=float, default=0.25)
+    parser.add_argument('--min-ms', type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    base_url = args.url.rstrip('/')
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    try:
+        status, body = _send(urllib.request.Request(f"{base_url}/info"), 10)
+        server_info = json.loads(body) if status == 200 else {}
+    except OSError as e:
+        progress(f"Service not reachable at {base_url}: {e}")
+        return 2
+
+    report = {
+        "suite": "load",
+        "created_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "environment": environment(),
+        "config": {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        "server": server_info.get('config', {}),
+        "results": [],
+        "rss": []
+    }
+    report['config']['mix'] = mix
+    master = find_server_process(args.pidfile, urlsplit(base_url).port or 80)
+    if master is None:
+        progress("Server process not found locally; RSS will not be sampled")
+
+    with tempfile.TemporaryDirectory(prefix='loadtest_') as workdir:
+        fixtures = Fixtures(workdir, args.fixtures, args.seed)
+        if 'compare' in mix:
+            progress(f"Building /compare catalog ({args.catalog_size} entries)")
+            fixtures.build_catalog(base_url, args.catalog_size, args.timeout)
+        traffic = Traffic(base_url, fixtures, rng, args.ocr_time_budget)
+        for rate in [float(r) for r in args.rates.split(',') if r.strip()]:
+            progress(f"Offering {rate:g} req/s for {args.duration:g}s")
+            sampler = RssSampler(master, args.rss_interval)
+            sampler.start()
+            records = run_step(traffic, mix, rate, args.duration, args.arrivals, args.timeout,
+                               args.max_in_flight, rng)
+            sampler.stop()
+            step = summarize_step(records, rate, args.duration)
+            report['results'] += step
+            report['rss'].append(dict(sampler.summary(), offered_rps=rate))
+            overall = step[0] if step else {}
+            progress(f"  throughput {overall.get('throughput_rps')} req/s, p95 {overall.get('p95_ms')} ms, "
+                     f"errors {overall.get('error_rate')}, timeouts {overall.get('timeout_rate')}")
+
+    return finish(report, args, higher_is_worse={"p95_ms": True, "error_rate": True, "timeout_rate": True})
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+OCR benchmark corpus
+Renders the ground-truth passages in ocr_corpus/texts.json into page images at
+several skews, noise levels and resolutions. Generation is deterministic, so the
+corpus is rebuilt identically on any machine instead of shipping the images.
+
+    python benchmarks/ocr_corpus.py --out /tmp/ocr_corpus
+"""
+
+import argparse
+import json
+import os
+import sys
+import zlib
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+import common  # noqa: F401  (puts the service directory on sys.path)
+import cv2  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ocr_corpus')
+TEXTS_FILE = os.path.join(CORPUS_DIR, 'texts.json')
+
+FONT_CANDIDATES = [
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSans.ttf',
+    '/Library/Fonts/Arial.ttf',
+    '/System/Library/Fonts/Supplemental/Arial.ttf',
+    'C:\\Windows\\Fonts\\arial.ttf',
+]
+
+DEFAULT_SKEWS = [0.0, 4.0, 90.0]
+DEFAULT_NOISE = [0.0, 20.0]
+DEFAULT_SCALES = [1.0, 0.5]
+
+
+def load_texts() -> Dict[str, List[str]]:
+    with open(TEXTS_FILE, encoding='utf-8') as handle:
+        return json.load(handle)
+
+
+def find_font(path: Optional[str] = None, size: int = 32):
+    for candidate in ([path] if path else []) + FONT_CANDIDATES:
+        if candidate and os.path.exists(candidate):
+            return ImageFont.truetype(candidate, size), candidate
+    return ImageFont.load_default(), None
+
+
+def render_page(text: str, font, margin: int = 60, line_spacing: int = 18) -> np.ndarray:
+    """Render text black on white at the font's native size; returns grayscale"""
+    probe = ImageDraw.Draw(Image.new('L', (10, 10), 255))
+    box = probe.multiline_textbbox((0, 0), text, font=font, spacing=line_spacing)
+    width, height = box[2] - box[0] + 2 * margin, box[3] - box[1] + 2 * margin
+    page = Image.new('L', (width, height), 255)
+    ImageDraw.Draw(page).multiline_text((margin - box[0], margin - box[1]), text, fill=0,
+                                        font=font, spacing=line_spacing)
+    return np.array(page)
+
+
+def degrade(page: np.ndarray, skew: float, noise: float, scale: float, seed: int) -> np.ndarray:
+    img = page
+    if skew:
+        height, width = img.shape
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), skew, 1.0)
+        cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+        new_w, new_h = int(height * sin + width * cos), int(height * cos + width * sin)
+        matrix[0, 2] += new_w / 2 - width / 2
+        matrix[1, 2] += new_h / 2 - height / 2
+        img = cv2.warpAffine(img, matrix, (new_w, new_h), flags=cv2.INTER_LINEAR, borderValue=255)
+    if scale != 1.0:
+        img = cv2.resize(img, None, fx=scale, fy=scale,
+                         interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC)
+    if noise:
+        rng = np.random.default_rng(seed)
+        img = cv2.GaussianBlur(img, (3, 3), 0)
+        img = np.clip(img.astype(np.float32) + rng.normal(0, noise, img.shape), 0, 255).astype(np.uint8)
+    return img
+
+
+def build_corpus(out_dir: str, languages: Optional[List[str]] = None, skews=None, noise_levels=None,
+                 scales=None, font_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Write the corpus images to out_dir and return the manifest (also saved as manifest.json)"""
+    skews = DEFAULT_SKEWS if skews is None else skews
+    noise_levels = DEFAULT_NOISE if noise_levels is None else noise_levels
+    scales = DEFAULT_SCALES if scales is None else scales
+    os.makedirs(out_dir, exist_ok=True)
+    font, font_file = find_font(font_path)
+    texts = load_texts()
+    manifest = []
+    for language, passages in sorted(texts.items()):
+        if languages and language not in languages:
+            continue
+        for passage_index, text in enumerate(passages):
+            page = render_page(text, font)
+            for skew in skews:
+                for noise in noise_levels:
+                    for scale in scales:
+                        name = f"{language}-{passage_index}-skew{skew:g}-noise{noise:g}-scale{scale:g}"
+                        path = os.path.join(out_dir, name + '.png')
+                        if not os.path.exists(path):
+                            cv2.imwrite(path, degrade(page, skew, noise, scale, zlib.crc32(name.encode())))
+                        manifest.append({
+                            "id": name, "path": path, "language": language, "text": text,
+                            "skew": skew, "noise": noise, "scale": scale
+                        })
+    with open(os.path.join(out_dir, 'manifest.json'), 'w', encoding='utf-8') as handle:
+        json.dump({"font": font_file, "items": manifest}, handle, indent=2, ensure_ascii=False)
+    return manifest
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', required=True, help='Directory for the rendered images')
+    parser.add_argument('--font', help='TrueType font to render with (default: DejaVu Sans / Arial)')
+    args = parser.parse_args(argv)
+    manifest = build_corpus(args.out, font_path=args.font)
+    print(f"Wrote {len(manifest)} images to {args.out}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,415 @@
+"""
+Server-side descriptor catalog
+Media entries kept in the service and synced incrementally from the Node app:
+versioned upserts and deletes, a change feed, a bulk load from an export file
+at startup, and an append-only journal shared by all gunicorn workers so every
+worker sees a change within one request. The perceptual-hash BK-tree and the
+retrieval index are updated per entry, never rebuilt for a single change.
+
+Entry versions are per entry (the row's update counter), so the change feed
+pages on a separate sequence instead: every applied change gets the next
+number, assigned by the journal writer under the journal lock and stored
+with the record, so all workers agree on it.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import compact
+import phash
+from phash import BKTree
+from retrieval import retrieval_index
+
+logger = logging.getLogger(__name__)
+
+# JSON lines (or a JSON list) of {"id", "version", "descriptors", ...} loaded at startup
+EXPORT_FILE = os.getenv('CATALOG_EXPORT_FILE', '')
+# Changes are appended here and replayed by every worker (set it whenever gunicorn runs more
+# than one worker); empty keeps changes in the worker that received them
+JOURNAL_FILE = os.path.abspath(os.environ['CATALOG_JOURNAL']) if os.getenv('CATALOG_JOURNAL') else ''
+# The journal is rewritten as the current state once it holds this many records more than
+# twice the catalog's ids (superseded versions), so it stays proportional to the catalog
+JOURNAL_COMPACT_RECORDS = int(os.getenv('CATALOG_JOURNAL_COMPACT_RECORDS', 1000))
+
+# The BK-tree keeps replaced/deleted hashes until they outnumber live ones
+STALE_REBUILD_RATIO = 1.0
+
+
+class CatalogError(ValueError):
+    pass
+
+
+def _normalize(record: Dict[str, Any], op: str) -> Dict[str, Any]:
+    """Validated journal record; descriptors and keypoints are packed"""
+    if 'id' not in record:
+        raise CatalogError("Entry is missing id")
+    version = record.get('version')
+    if not isinstance(version, int) or isinstance(version, bool):
+        raise CatalogError(f"Entry {record['id']} needs an integer version")
+    normalized = {"op": op, "id": record['id'], "version": version}
+    if op == 'delete':
+        return normalized
+    if not record.get('descriptors'):
+        raise CatalogError(f"Entry {record['id']} has no descriptors")
+    descriptors = compact.descriptor_array(record['descriptors'])
+    normalized["descriptors"] = compact.pack_descriptors(descriptors)
+    keypoints = compact.keypoint_array(record.get('keypoints'))
+    if keypoints is not None and len(keypoints) == len(descriptors):
+        normalized["keypoints"] = compact.pack_points(keypoints)
+    if phash.parse_hash(record.get('phash')) is not None:
+        normalized["phash"] = phash.to_hex(phash.parse_hash(record['phash']))
+    return normalized
+
+
+class Catalog:
+    def __init__(self, journal_file: str = '', retrieval_index=None):
+        self.journal_file = journal_file
+        self.retrieval_index = retrieval_index
+        self._lock = threading.RLock()
+        # (id, version) -> visual words of records being submitted, encoded outside the lock
+        self._encoded: Dict[Tuple[Any, int], Tuple[np.ndarray, np.ndarray]] = {}
+        self._reset()
+
+    def _reset(self):
+        self._entries: Dict[Any, Dict[str, Any]] = {}
+        # id -> (version, deleted); deletes stay as tombstones for the change feed
+        self._versions: Dict[Any, Tuple[int, bool]] = {}
+        # id -> change sequence of its latest applied change; _seq is the highest assigned
+        self._sequence: Dict[Any, int] = {}
+        self._seq = 0
+        self._tree = BKTree()
+        self._stale_hashes = 0
+        self._snapshot: Optional[List[Dict[str, Any]]] = None
+        self._journal_offset = 0
+        self._journal_inode = None
+        self._journal_records = 0
+        self._journal_skipped = 0
+        # Export the state was loaded from, and its versions (to leave them out of a compacted journal)
+        self._export_file = ''
+        self._export_versions: Dict[Any, int] = {}
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self._entries)
+
+    # Applying changes
+
+    def _apply(self, record: Dict[str, Any]) -> bool:
+        """
+        Apply one normalized record unless an equal or newer version is already
+        known. Journal records carry their change sequence; others get the next one.
+        """
+        entry_id = record['id']
+        seq = record.get('seq')
+        if seq is not None:
+            self._seq = max(self._seq, seq)
+        known = self._versions.get(entry_id)
+        if known is not None and record['version'] <= known[0]:
+            return False
+        if seq is None:
+            self._seq += 1
+            seq = self._seq
+        self._sequence[entry_id] = seq
+        previous = self._entries.pop(entry_id, None)
+        if previous is not None and previous.get('phash'):
+            self._stale_hashes += 1
+        if record['op'] == 'delete':
+            if self.retrieval_index is not None:
+                self.retrieval_index.remove(entry_id)
+            self._versions[entry_id] = (record['version'], True)
+        else:
+            entry = {
+                "id": entry_id,
+                "version": record['version'],
+                "descriptors": compact.descriptor_array(record['descriptors']),
+                "keypoints": compact.keypoint_array(record.get('keypoints')),
+                "phash": record.get('phash')
+            }
+            self._entries[entry_id] = entry
+            if entry['phash']:
+                self._tree.add(int(entry['phash'], 16), (entry_id, int(entry['phash'], 16)))
+            if self.retrieval_index is not None:
+                words = self._encoded.pop((entry_id, record['version']), None)
+                if words is None:
+                    words = self.retrieval_index.vocabulary.encode(entry['descriptors'])
+                self.retrieval_index.add(entry_id, *words)
+            self._versions[entry_id] = (record['version'], False)
+        self._snapshot = None
+        if self._stale_hashes > STALE_REBUILD_RATIO * max(len(self._entries), 1):
+            self._rebuild_tree()
+        return True
+
+    def _rebuild_tree(self):
+        self._tree = BKTree()
+        for entry_id, entry in self._entries.items():
+            if entry['phash']:
+                self._tree.add(int(entry['phash'], 16), (entry_id, int(entry['phash'], 16)))
+        self._stale_hashes = 0
+
+    def load_export(self, path: str) -> int:
+        """Bulk load an export file as the base state (not journaled)"""
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        if text.lstrip().startswith('['):
+            records = json.loads(text)
+        else:
+            records = [json.loads(line) for line in text.splitlines() if line.strip()]
+        loaded = 0
+        with self._lock:
+            self._export_file = path
+            for record in records:
+                try:
+                    normalized = _normalize(record, 'delete' if record.get('deleted') else 'upsert')
+                except CatalogError as e:
+                    logger.warning("Skipping catalog export record: %s", e)
+                    continue
+                self._export_versions[normalized['id']] = normalized['version']
+                loaded += self._apply(normalized)
+        return loaded
+
+    # Journal shared between workers
+
+    def refresh(self):
+        """Apply journal records written (by any worker) since the last refresh"""
+        if not self.journal_file:
+            return
+        try:
+            stat = os.stat(self.journal_file)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._journal_inode is not None and (stat.st_ino != self._journal_inode
+                                                    or stat.st_size < self._journal_offset):
+                # Journal was compacted or replaced: reload the export and replay it
+                self._reload_export()
+            if stat.st_size == self._journal_offset:
+                return
+            with open(self.journal_file, 'rb') as f:
+                f.seek(self._journal_offset)
+                data = f.read(stat.st_size - self._journal_offset)
+            # A record still being written has no newline yet; leave it for the next refresh
+            complete = data[:data.rfind(b'\n') + 1]
+            position = self._journal_offset
+            for line in complete.splitlines(keepends=True):
+                if line.strip():
+                    try:
+                        self._apply(json.loads(line))
+                        self._journal_records += 1
+                    except (ValueError, KeyError, TypeError) as e:
+                        # Torn by a worker killed mid-append; the rest of the journal is still good
+                        self._journal_skipped += 1
+                        logger.warning("Skipping unreadable catalog journal record at byte %s: %s", position, e)
+                position += len(line)
+            self._journal_offset += len(complete)
+            self._journal_inode = stat.st_ino
+
+    def _reload_export(self):
+        export_file = self._export_file
+        if self.retrieval_index is not None:
+            for entry_id in list(self._entries):
+                self.retrieval_index.remove(entry_id)
+        self._reset()
+        if export_file:
+            self.load_export(export_file)
+
+    @contextmanager
+    def _journal_lock(self):
+        """The journal opened for appending and exclusively locked; reopened if it was replaced meanwhile"""
+        while True:
+            fd = os.open(self.journal_file, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    replaced = os.stat(self.journal_file).st_ino != os.fstat(fd).st_ino
+                except FileNotFoundError:
+                    replaced = True
+                if not replaced:
+                    yield fd
+                    return
+            finally:
+                os.close(fd)
+
+    def _needs_compaction(self) -> bool:
+        return self._journal_records > 2 * len(self._versions) + JOURNAL_COMPACT_RECORDS
+
+    def _write(self, records: List[Dict[str, Any]]):
+        """Append records under the journal lock, numbered after everything already in the journal"""
+        with self._journal_lock() as fd:
+            # Nobody else appends while we hold the lock: catch up, then number after the last record
+            self.refresh()
+            records = [dict(record, seq=self._seq + number) for number, record in enumerate(records, 1)]
+            self._append(fd, records)
+            if self._needs_compaction():
+                kept = self._compact()
+                logger.info("Catalog journal compacted to %s records", kept)
+
+    def _append(self, fd: int, records: List[Dict[str, Any]]):
+        data = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records).encode('utf-8')
+        size = os.fstat(fd).st_size
+        if size and os.pread(fd, 1, size - 1) != b'\n':
+            # A writer was killed mid-record: end its fragment so ours starts on a line of its own
+            data = b'\n' + data
+        # One write per batch, so a kill leaves at most one torn line
+        written = os.write(fd, data)
+        if written != len(data):
+            raise OSError(f"Short write to {self.journal_file} ({written} of {len(data)} bytes)")
+
+    def compact_journal(self) -> int:
+        """
+        Rewrite the journal as the current state, under the journal lock;
+        workers that held the old journal notice the new file and replay it
+        """
+        if not self.journal_file or not os.path.exists(self.journal_file):
+            return 0
+        with self._journal_lock():
+            return self._compact()
+
+    def _compact(self) -> int:
+        # The caller holds the journal lock, so no record is appended to the file being replaced
+        self.refresh()
+        with self._lock:
+            records = []
+            for entry_id, (version, deleted) in self._versions.items():
+                if self._export_versions.get(entry_id) == version:
+                    continue
+                if deleted:
+                    records.append({"op": "delete", "id": entry_id, "version": version})
+                else:
+                    entry = self._entries[entry_id]
+                    records.append(self._record(entry))
+                records[-1]["seq"] = self._sequence[entry_id]
+            records.sort(key=lambda record: record['seq'])
+            temporary = f"{self.journal_file}.tmp"
+            with open(temporary, 'w', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records))
+            os.replace(temporary, self.journal_file)
+            stat = os.stat(self.journal_file)
+            self._journal_offset, self._journal_inode = stat.st_size, stat.st_ino
+            self._journal_records = len(records)
+        return len(records)
+
+    @staticmethod
+    def _record(entry: Dict[str, Any]) -> Dict[str, Any]:
+        record = {"op": "upsert", "id": entry['id'], "version": entry['version'],
+                  "descriptors": compact.pack_descriptors(entry['descriptors'])}
+        if entry['keypoints'] is not None:
+            record["keypoints"] = compact.pack_points(entry['keypoints'])
+        if entry['phash']:
+            record["phash"] = entry['phash']
+        return record
+
+    # Public API
+
+    def upsert(self, records: List[Dict[str, Any]]) -> Dict[str, int]:
+        return self._submit([_normalize(record, 'upsert') for record in records])
+
+    def delete(self, records: List[Dict[str, Any]]) -> Dict[str, int]:
+        return self._submit([_normalize(record, 'delete') for record in records])
+
+    def _encode(self, records: List[Dict[str, Any]]) -> Dict[Tuple[Any, int], Tuple[np.ndarray, np.ndarray]]:
+        if self.retrieval_index is None:
+            return {}
+        return {(record['id'], record['version']):
+                self.retrieval_index.vocabulary.encode(compact.descriptor_array(record['descriptors']))
+                for record in records if record['op'] == 'upsert'}
+
+    def _submit(self, records: List[Dict[str, Any]]) -> Dict[str, int]:
+        # Visual words are computed before taking the lock, so other requests don't wait on them
+        encoded = self._encode(records)
+        with self._lock:
+            self._encoded.update(encoded)
+            try:
+                if self.journal_file:
+                    before = {record['id']: self._versions.get(record['id']) for record in records}
+                    self._write(records)
+                    self.refresh()
+                    applied = sum(1 for record in records
+                                  if self._versions.get(record['id']) != before[record['id']]
+                                  and self._versions[record['id']][0] == record['version'])
+                else:
+                    applied = sum(self._apply(record) for record in records)
+            finally:
+                # Words of ignored (stale) records
+                for key in encoded:
+                    self._encoded.pop(key, None)
+        return {"applied": applied, "ignored": len(records) - applied}
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Current entries, as a list that later changes do not modify"""
+        self.refresh()
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = list(self._entries.values())
+            return self._snapshot
+
+    def search_hash(self, value: int, max_distance: int) -> List[Tuple[int, Tuple[Any, int]]]:
+        with self._lock:
+            return self._tree.search(value, max_distance)
+
+    def changes(self, since: int = 0, limit: int = 1000) -> Dict[str, Any]:
+        """
+        Entries changed after change sequence `since`, oldest change first,
+        including deletions. Pass next_since back to get the following page.
+        """
+        self.refresh()
+        with self._lock:
+            changed = sorted((self._sequence[entry_id], entry_id, version, deleted)
+                             for entry_id, (version, deleted) in self._versions.items()
+                             if self._sequence[entry_id] > since)
+            latest = max((version for version, _ in self._versions.values()), default=0)
+            latest_seq = self._seq
+        page = changed[:limit]
+        return {
+            "changes": [{"id": entry_id, "version": version, "deleted": deleted, "seq": seq}
+                        for seq, entry_id, version, deleted in page],
+            "has_more": len(changed) > limit,
+            "next_since": page[-1][0] if page else since,
+            "latest_version": latest,
+            "latest_seq": latest_seq
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        self.refresh()
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "tombstones": sum(1 for _, deleted in self._versions.values() if deleted),
+                "latest_version": max((version for version, _ in self._versions.values()), default=0),
+                "latest_seq": self._seq,
+                "descriptor_bytes": sum(entry['descriptors'].nbytes for entry in self._entries.values()),
+                "journal_file": self.journal_file or None,
+                "journal_bytes": self._journal_offset,
+                "journal_skipped": self._journal_skipped
+            }
+
+
+def load_catalog(retrieval_index=None) -> Catalog:
+    """Catalog configured by the environment: export file, then the journal on top"""
+    catalog = Catalog(JOURNAL_FILE, retrieval_index)
+    if EXPORT_FILE:
+        try:
+            loaded = catalog.load_export(EXPORT_FILE)
+            logger.info("Catalog export loaded: %s entries from %s", loaded, EXPORT_FILE)
+        except (OSError, ValueError) as e:
+            logger.error("Could not load catalog export %s: %s", EXPORT_FILE, e)
+    try:
+        catalog.refresh()
+    except OSError as e:
+        logger.error("Could not read catalog journal %s: %s", catalog.journal_file, e)
+    if catalog.journal_file and catalog._needs_compaction():
+        kept = catalog.compact_journal()
+        logger.info("Catalog journal compacted to %s records", kept)
+    elif not catalog.journal_file and int(os.getenv('GUNICORN_WORKERS', 1)) > 1:
+        logger.warning("CATALOG_JOURNAL is not set: catalog changes only reach the worker that received them")
+    return catalog
+
+
+# Global catalog instance
+media_catalog = load_catalog(retrieval_index)
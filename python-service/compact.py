@@ -0,0 +1,85 @@
+"""
+Compact catalog entries
+Keypoint-budgeted extraction (adaptive non-maximal suppression keeps the
+strongest keypoints that are also spread over the image) and packed storage:
+descriptors as base64 raw bytes and keypoints as base64 uint16 x/y pairs
+instead of JSON integer lists.
+"""
+
+import base64
+import os
+from typing import Any, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# Keypoints kept per image by /extract in index mode
+INDEX_MAX_KEYPOINTS = int(os.getenv('INDEX_MAX_KEYPOINTS', 200))
+
+DESCRIPTOR_BYTES = 32
+# A keypoint is only suppressed by neighbours clearly stronger than itself
+ANMS_ROBUSTNESS = 0.9
+
+
+def select_keypoints(keypoints: Sequence[cv2.KeyPoint], descriptors: np.ndarray,
+                     budget: int) -> Tuple[List[cv2.KeyPoint], np.ndarray]:
+    """
+    Adaptive non-maximal suppression: rank keypoints by the distance to the
+    nearest clearly stronger keypoint and keep the `budget` with the largest
+    radius, so the survivors are strong locally and cover the whole image.
+    """
+    if budget <= 0 or len(keypoints) <= budget:
+        return list(keypoints), descriptors
+    points = np.float32([kp.pt for kp in keypoints])
+    responses = np.float32([kp.response for kp in keypoints])
+    squared = ((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2)
+    stronger = responses[None, :] * ANMS_ROBUSTNESS > responses[:, None]
+    radius = np.where(stronger, squared, np.inf).min(axis=1)
+    # Ties (e.g. the strongest points, radius inf) keep the stronger first
+    order = np.lexsort((-responses, -radius))[:budget]
+    order.sort()
+    return [keypoints[i] for i in order], descriptors[order]
+
+
+def pack_descriptors(descriptors: np.ndarray) -> str:
+    return base64.b64encode(np.ascontiguousarray(descriptors, dtype=np.uint8).tobytes()).decode('ascii')
+
+
+def pack_keypoints(keypoints: Sequence[cv2.KeyPoint]) -> str:
+    return pack_points(np.float32([kp.pt for kp in keypoints]))
+
+
+def pack_points(points: np.ndarray) -> str:
+    """(n, 2) coordinates as base64 little-endian uint16 pairs (whole pixels)"""
+    packed = np.clip(np.rint(points), 0, 65535).astype('<u2')
+    return base64.b64encode(packed.tobytes()).decode('ascii')
+
+
+def descriptor_array(value: Any) -> np.ndarray:
+    """Descriptors of a catalog entry, packed (base64) or as JSON integer lists"""
+    if isinstance(value, str):
+        return np.frombuffer(base64.b64decode(value), dtype=np.uint8).reshape(-1, DESCRIPTOR_BYTES)
+    return np.asarray(value, dtype=np.uint8)
+
+
+def keypoint_array(value: Any) -> Optional[np.ndarray]:
+    """(n, 2) keypoint coordinates of a catalog entry, packed (base64) or as [x, y] lists"""
+    if isinstance(value, str):
+        return np.frombuffer(base64.b64decode(value), dtype='<u2').reshape(-1, 2).astype(np.float32)
+    if isinstance(value, np.ndarray):
+        return value
+    if isinstance(value, list) and value:
+        return np.array(value, dtype=np.float32).reshape(-1, 2)
+    return None
+
+
+def descriptor_count(value: Any) -> int:
+    if isinstance(value, str):
+        # 4 base64 characters per 3 bytes
+        return len(value) * 3 // 4 // DESCRIPTOR_BYTES
+    return len(value)
+
+
+def footprint(descriptors: np.ndarray, keypoints: Optional[Sequence[Any]] = None) -> int:
+    """Raw storage bytes of an entry: 32 per descriptor plus 4 per keypoint"""
+    return len(descriptors) * DESCRIPTOR_BYTES + (len(keypoints) * 4 if keypoints is not None else 0)
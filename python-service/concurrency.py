@@ -0,0 +1,166 @@
+"""
+Threading policy
+Every gunicorn worker gets an equal share of the machine's CPUs (affinity and
+cgroup quota included) and all thread pools in the worker are sized from it:
+OpenCV's internal pool (cv2.setNumThreads), the shared pool that fans out
+GIL-releasing OpenCV stages such as knnMatch over catalog entries, parallel
+document pages, and Tesseract's OpenMP threads (OMP_THREAD_LIMIT, inherited
+by the tesseract subprocesses). With the default of 2 x CPUs + 1 workers the
+share is one thread, so requests run single-threaded and the workers
+themselves fill the cores; fewer, wider workers trade throughput for latency.
+The effective settings are reported in /info.
+"""
+
+import contextvars
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, TypeVar
+
+import cv2
+
+from profiler import worker_profiler
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+def available_cpus() -> int:
+    """CPUs this process may use: the affinity mask, capped by a cgroup CPU quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = None
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            limit, period = f.read().split()[:2]
+        if limit != 'max':
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                limit = int(f.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = int(f.read())
+            if limit > 0 and period > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return max(1, cpus)
+
+
+CPUS = available_cpus()
+# Processes sharing the CPUs; gunicorn.conf.py exports its effective worker count (dev server: 1)
+WORKER_PROCESSES = max(1, int(os.getenv('GUNICORN_WORKERS', 1)))
+# Busy threads each worker may run at once
+THREADS_PER_WORKER = max(1, CPUS // WORKER_PROCESSES)
+# OpenCV's internal parallel_for threads (cv2.setNumThreads)
+OPENCV_THREADS = max(1, int(os.getenv('OPENCV_THREADS', THREADS_PER_WORKER)))
+# Shared pool for OpenCV stages fanned out per request (1 runs them inline)
+OPENCV_POOL_THREADS = max(1, int(os.getenv('OPENCV_POOL_THREADS', THREADS_PER_WORKER)))
+# Pages of a document recognized in parallel per request
+OCR_PAGE_WORKERS = max(1, int(os.getenv('OCR_PAGE_WORKERS', min(4, THREADS_PER_WORKER))))
+# OpenMP threads per tesseract process; more than 1 only pays off with CPUs to spare
+OMP_THREAD_LIMIT = max(1, int(os.getenv('OMP_THREAD_LIMIT', 1)))
+# Smaller batches aren't worth handing to the pool
+PARALLEL_MIN_ITEMS = 8
+
+
+class ThreadPolicy:
+    """Thread counts for this worker and the shared pool for OpenCV-bound stages"""
+
+    def __init__(self, cpus: int = CPUS, workers: int = WORKER_PROCESSES, opencv_threads: int = OPENCV_THREADS,
+                 pool_threads: int = OPENCV_POOL_THREADS, page_workers: int = OCR_PAGE_WORKERS,
+                 omp_thread_limit: int = OMP_THREAD_LIMIT):
+        self.cpus = cpus
+        self.workers = workers
+        self.opencv_threads = opencv_threads
+        self.pool_threads = pool_threads
+        self.page_workers = page_workers
+        self.omp_thread_limit = omp_thread_limit
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def threads_per_worker(self) -> int:
+        """Busy threads one worker can have: OpenCV or pool threads, or tesseract pages x OpenMP threads"""
+        return max(self.opencv_threads, self.pool_threads, self.page_workers * self.omp_thread_limit)
+
+    def apply(self):
+        """Set OpenCV's thread count and the tesseract thread limit for this process"""
+        cv2.setNumThreads(self.opencv_threads)
+        os.environ['OMP_THREAD_LIMIT'] = str(self.omp_thread_limit)
+        # Single-threaded workers are sized by GUNICORN_WORKERS alone
+        if self.threads_per_worker() > 1 and self.workers * self.threads_per_worker() > self.cpus:
+            logger.warning("%s workers x %s threads exceed %s CPUs; lower OPENCV_THREADS, OPENCV_POOL_THREADS "
+                           "or OCR_PAGE_WORKERS", self.workers, self.threads_per_worker(), self.cpus)
+
+    def worker_forked(self):
+        """Called from gunicorn's post_fork hook: pool threads don't survive fork"""
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        cv2.setNumThreads(self.opencv_threads)
+
+    def _mark_pool_thread(self):
+        self._local.in_pool = True
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(self.pool_threads, thread_name_prefix='opencv',
+                                                initializer=self._mark_pool_thread)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def map(self, fn: Callable[[T], R], items: Iterable[T]) -> List[R]:
+        """
+        [fn(item) for item in items], split into one contiguous chunk per pool
+        thread. fn should spend its time in GIL-releasing OpenCV calls. Small
+        batches, a single-thread pool, calls made from a pool thread and
+        calls during a cprofile session run inline.
+        """
+        items = list(items)
+        if (self.pool_threads <= 1 or len(items) < PARALLEL_MIN_ITEMS or getattr(self._local, 'in_pool', False)
+                or worker_profiler.single_threaded()):
+            return [fn(item) for item in items]
+        size = math.ceil(len(items) / self.pool_threads)
+
+        def run_chunk(chunk: List[T]) -> List[R]:
+            with worker_profiler.sampled_thread():
+                return [fn(item) for item in chunk]
+
+        pool = self._executor()
+        # Each chunk gets its own copy of the context: request id and trace carry over
+        futures = [pool.submit(contextvars.copy_context().run, run_chunk, items[i:i + size])
+                   for i in range(0, len(items), size)]
+        results: List[R] = []
+        for future in futures:
+            results.extend(future.result())
+        return results
+
+    def settings(self) -> Dict[str, Any]:
+        return {
+            "cpus": self.cpus,
+            "workers": self.workers,
+            "opencv_threads": cv2.getNumThreads(),
+            "opencv_pool_threads": self.pool_threads,
+            "ocr_page_workers": self.page_workers,
+            "omp_thread_limit": self.omp_thread_limit,
+            "threads_per_worker": self.threads_per_worker(),
+            "total_threads": self.workers * self.threads_per_worker()
+        }
+
+
+# Global policy of this process
+thread_policy = ThreadPolicy()
@@ -0,0 +1,217 @@
+"""
+Multi-page documents
+Multi-frame TIFF/GIF/WebP files and PDFs are OCR'd page by page. Pages are
+decoded lazily, one at a time, and PDF pages are rasterized locally at the
+requested DPI with pypdfium2. Each page is written to a scratch file and
+recognized through the regular OCR pipeline on a bounded thread pool
+(Tesseract runs as a subprocess, so pages really run in parallel). At most
+OCR_PAGE_WORKERS pages are decoded ahead of the one being returned, so
+memory stays at a few pages however long the document is. Results come back
+in page order as they finish, so they can be streamed, and a running
+DocumentSummary gives the aggregate text and word-weighted confidence.
+"""
+
+import contextvars
+import logging
+import math
+import os
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from concurrency import OCR_PAGE_WORKERS
+from metrics import stage_timer
+from tracing import span
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+logger = logging.getLogger(__name__)
+
+# Rasterization resolution for PDF pages (300 suits Tesseract; scans carry their own resolution)
+DOCUMENT_DPI = int(os.getenv('DOCUMENT_DPI', 300))
+MIN_DPI, MAX_DPI = 72, 600
+# Pages per request; longer documents are OCR'd in first_page/last_page ranges
+DOCUMENT_MAX_PAGES = int(os.getenv('DOCUMENT_MAX_PAGES', 100))
+# A rasterized PDF page larger than this is rendered at a lower DPI, a larger image page is downscaled
+MAX_PAGE_PIXELS = 40_000_000
+
+DOCUMENT_EXTENSIONS = {'.pdf', '.tif', '.tiff', '.gif', '.webp', '.png', '.jpg', '.jpeg', '.bmp'}
+# Between page texts in the aggregate text
+PAGE_SEPARATOR = '\n\n'
+
+
+class DocumentError(ValueError):
+    pass
+
+
+class Document:
+    """Pages of a PDF or (multi-frame) image, decoded on demand as grayscale arrays"""
+
+    def __init__(self, path: str, dpi: int = DOCUMENT_DPI):
+        self.dpi = min(max(int(dpi), MIN_DPI), MAX_DPI)
+        self._pdf = None
+        self._image = None
+        with open(path, 'rb') as f:
+            self.kind = 'pdf' if f.read(5) == b'%PDF-' else 'image'
+        if self.kind == 'pdf':
+            if pdfium is None:
+                raise DocumentError("PDF documents need pypdfium2 (pip install pypdfium2)")
+            try:
+                self._pdf = pdfium.PdfDocument(path)
+            except pdfium.PdfiumError as e:
+                raise DocumentError(f"Could not open PDF: {str(e)}")
+            self.page_count = len(self._pdf)
+        else:
+            try:
+                self._image = Image.open(path)
+            except (OSError, Image.DecompressionBombError) as e:
+                raise DocumentError(f"Could not open document: {str(e)}")
+            self.page_count = getattr(self._image, 'n_frames', 1)
+
+    def render(self, index: int) -> np.ndarray:
+        """Page index (0-based) as a grayscale array"""
+        if self._pdf is not None:
+            page = self._pdf[index]
+            try:
+                width, height = page.get_size()
+                scale = self.dpi / 72
+                pixels = width * height * scale * scale
+                if pixels > MAX_PAGE_PIXELS:
+                    scale *= (MAX_PAGE_PIXELS / pixels) ** 0.5
+                bitmap = page.render(scale=scale, grayscale=True)
+                return bitmap.to_numpy().reshape(bitmap.height, bitmap.width).copy()
+            finally:
+                page.close()
+        self._image.seek(index)
+        frame = self._image
+        pixels = frame.width * frame.height
+        if pixels > MAX_PAGE_PIXELS:
+            factor = math.ceil((pixels / MAX_PAGE_PIXELS) ** 0.5)
+            # reduce() doesn't take bilevel, palette or 16-bit frames
+            if frame.mode not in ('L', 'LA', 'RGB', 'RGBA', 'CMYK', 'YCbCr', 'I', 'F'):
+                frame = frame.convert('L')
+            frame = frame.reduce(factor)
+        return np.asarray(frame.convert('L'))
+
+    def close(self):
+        if self._pdf is not None:
+            self._pdf.close()
+        if self._image is not None:
+            self._image.close()
+
+
+class DocumentSummary:
+    """Aggregate of page results: text, word-weighted confidence and counts"""
+
+    def __init__(self, page_count: int, first_page: int, last_page: int):
+        self.page_count = page_count
+        self.first_page = first_page
+        self.last_page = last_page
+        self.texts: List[str] = []
+        self.pages_processed = 0
+        self.pages_failed = 0
+        self.words = 0
+        self.weighted_confidence = 0.0
+
+    def add(self, page: Dict[str, Any]):
+        if not page.get('success'):
+            self.pages_failed += 1
+            return
+        self.pages_processed += 1
+        text = page.get('text', '')
+        if text:
+            self.texts.append(text)
+        words = page.get('word_count', len(text.split()))
+        self.words += words
+        self.weighted_confidence += page.get('confidence', 0.0) * words
+
+    def to_dict(self) -> Dict[str, Any]:
+        text = PAGE_SEPARATOR.join(self.texts)
+        return {
+            "success": self.pages_processed > 0,
+            "page_count": self.page_count,
+            "first_page": self.first_page,
+            "last_page": self.last_page,
+            "pages_processed": self.pages_processed,
+            "pages_failed": self.pages_failed,
+            "text": text,
+            "confidence": self.weighted_confidence / self.words if self.words else 0.0,
+            "word_count": self.words,
+            "character_count": len(text)
+        }
+
+
+def page_range(page_count: int, first_page: Any = None, last_page: Any = None) -> tuple:
+    """Validated 1-based (first, last) page numbers"""
+    try:
+        first = int(first_page) if first_page not in (None, '') else 1
+        last = int(last_page) if last_page not in (None, '') else min(page_count, first + DOCUMENT_MAX_PAGES - 1)
+    except (TypeError, ValueError):
+        raise DocumentError("first_page and last_page must be page numbers")
+    if not 1 <= first <= last <= page_count:
+        raise DocumentError(f"Page range {first}-{last} is outside the document (1-{page_count})")
+    if last - first + 1 > DOCUMENT_MAX_PAGES:
+        raise DocumentError(f"At most {DOCUMENT_MAX_PAGES} pages per request; use first_page/last_page")
+    return first, last
+
+
+def _run_page(ocr_page: Callable[[str, int], Dict[str, Any]], path: str, number: int) -> Dict[str, Any]:
+    try:
+        with span('page', page=number):
+            result = ocr_page(path, number)
+    except Exception as e:
+        logger.error("OCR failed for page %s: %s", number, e, exc_info=True)
+        result = {"success": False, "error": str(e), "text": "", "confidence": 0.0}
+    result["page"] = number
+    return result
+
+
+def ocr_pages(document: Document, ocr_page: Callable[[str, int], Dict[str, Any]], first_page: int,
+              last_page: int, workers: int = OCR_PAGE_WORKERS) -> Iterator[Dict[str, Any]]:
+    """
+    ocr_page(page_image_path, page_number) for each page, in parallel, yielding
+    results in page order. Pages are decoded only when a worker is about to be
+    free, so at most `workers` pages wait on disk at a time.
+    """
+    workdir = tempfile.mkdtemp(prefix='archivart-document-')
+    pool = ThreadPoolExecutor(max(1, workers), thread_name_prefix='ocr-page')
+    pending = deque()
+    next_page = first_page
+    try:
+        while pending or next_page <= last_page:
+            while next_page <= last_page and len(pending) < workers:
+                path = os.path.join(workdir, f"page-{next_page}.png")
+                try:
+                    with stage_timer('page_decode'):
+                        gray = document.render(next_page - 1)
+                        cv2.imwrite(path, gray, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+                    del gray
+                    # Each task gets its own copy: request id and trace carry over to the pool thread
+                    future = pool.submit(contextvars.copy_context().run, _run_page, ocr_page, path, next_page)
+                except Exception as e:
+                    logger.error("Could not decode page %s: %s", next_page, e)
+                    future = None
+                    error = {"success": False, "error": f"Could not decode page: {str(e)}", "text": "",
+                             "confidence": 0.0, "page": next_page}
+                pending.append((path, future, None if future else error))
+                next_page += 1
+            path, future, error = pending.popleft()
+            try:
+                result = future.result() if future is not None else error
+            finally:
+                if os.path.exists(path):
+                    os.unlink(path)
+            yield result
+    finally:
+        # Also reached when a streaming client disconnects: drop pages not started yet
+        pool.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,30 @@
+"""
+Private working directories
+Caches that workers share through the filesystem (the image store, request
+coalescing results) default to fixed names under the system temp directory,
+which any local user can create first. Their contents are trusted (paths are
+opened, results loaded), so the directory must belong to the service user
+and be closed to everyone else.
+"""
+
+import os
+import stat
+
+
+def private_directory(path: str) -> str:
+    """
+    Create path (0700) or check an existing one: a real directory owned by
+    this user that nobody else can write to. Group/other read access is
+    removed. Raises PermissionError when the directory can't be trusted.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"{path} is not a directory")
+    if info.st_uid != os.getuid():
+        raise PermissionError(f"{path} is owned by uid {info.st_uid}, not {os.getuid()}")
+    if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"{path} is writable by other users")
+    if info.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
@@ -2,6 +2,18 @@
 
 import multiprocessing
 import os
+import shutil
+import tempfile
+
+# Prometheus multiprocess mode: workers write metric samples to this directory
+# and /metrics aggregates them. Must be set before the app (and prometheus_client)
+# is imported, which happens after this file is loaded.
+os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'opencv-service-metrics')
+)
+# The preloaded app writes its first samples before on_starting runs
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
 
 # Server socket
 bind = f"{os.getenv('OPENCV_HOST', '0.0.0.0')}:{os.getenv('OPENCV_PORT', 5001)}"
@@ -9,13 +21,16 @@ backlog = 2048
 
 # Worker processes
 workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# The app sizes OpenCV and Tesseract threads from its share of the CPUs (concurrency.py)
+os.environ['GUNICORN_WORKERS'] = str(workers)
 worker_class = 'sync'
 worker_connections = 1000
 timeout = int(os.getenv('REQUEST_TIMEOUT', 30))
 keepalive = 2
 
-# Restart workers after this many requests, to prevent memory leaks
-max_requests = 1000
+# Workers are recycled by memory growth (lifecycle.py, post_request hook below);
+# a request-count limit is only a backstop and is off by default
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
 max_requests_jitter = 100
 
 # Preload app for better performance
@@ -44,9 +59,6 @@ tmp_upload_dir = None
 # Worker timeout for graceful shutdown
 graceful_timeout = 30
 
-# Maximum number of pending connections
-max_requests_jitter = 100
-
 # Worker process recycling
 worker_tmp_dir = '/dev/shm'  # Use shared memory for better performance
 
@@ -56,3 +68,43 @@ raw_env = [
     'ENABLE_METRICS=true',
     'LOG_LEVEL=INFO'
 ]
+
+
+# Server hooks
+def on_starting(server):
+    """Start every master process with an empty metrics directory"""
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def post_fork(server, worker):
+    """Warm this worker's engines and caches before it accepts requests"""
+    import startup
+    startup.worker_forked()
+    if server.cfg.preload_app:
+        from concurrency import thread_policy
+        thread_policy.worker_forked()
+        import app
+        app.warm_up_worker()
+
+
+def post_worker_init(worker):
+    """Worker is about to accept; closes its fork-to-ready timing"""
+    import startup
+    from lifecycle import worker_lifecycle
+    startup.worker_ready()
+    worker_lifecycle.worker_ready()
+
+
+def post_request(worker, req, environ, resp):
+    """Exit after this request if the worker's memory is over its limits"""
+    from lifecycle import worker_lifecycle
+    if worker_lifecycle.after_request():
+        worker.alive = False
+
+
+def child_exit(server, worker):
+    """Drop live gauges of exited workers from the aggregated metrics"""
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
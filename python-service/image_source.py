@@ -0,0 +1,317 @@
+"""
+Image sources
+Endpoints can name an image by media key (the S3 key the Node app stored it
+under) instead of a local image_path. A key resolves to a local file: from a
+shared directory as is, or from S3 (or an S3-compatible store such as MinIO)
+through a content-addressed blob store shared by all workers. A cached key
+costs a stat; a miss is downloaded once with parallel range reads over a
+pooled connection and stored under the SHA-256 of its content. Media keys
+are treated as immutable (the Node app uploads every new file to a new key).
+"""
+
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from filesystem import private_directory
+from metrics import record_cache, stage_timer
+
+logger = logging.getLogger(__name__)
+
+# s3, directory, or empty (media keys disabled, image_path only)
+IMAGE_SOURCE = os.getenv('IMAGE_SOURCE', '').lower()
+# Shared directory (NFS/EFS mount) media keys are relative to, for IMAGE_SOURCE=directory
+IMAGE_SOURCE_DIR = os.getenv('IMAGE_SOURCE_DIR', '')
+# Blob store for S3 downloads; shared by the workers, so keep it on local disk
+IMAGE_STORE_DIR = os.getenv('IMAGE_STORE_DIR', os.path.join(tempfile.gettempdir(), 'archivart-image-store'))
+IMAGE_STORE_MAX_MB = int(os.getenv('IMAGE_STORE_MAX_MB', 2048))
+
+S3_BUCKET = os.getenv('S3_BUCKET', os.getenv('AWS_S3_BUCKET', ''))
+# MinIO or another S3-compatible endpoint; empty for AWS
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL', '')
+S3_REGION = os.getenv('AWS_REGION', 'us-east-1')
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', 16))
+# Objects larger than one chunk are fetched as parallel range reads
+S3_RANGE_CHUNK_MB = int(os.getenv('S3_RANGE_CHUNK_MB', 8))
+S3_DOWNLOAD_THREADS = int(os.getenv('S3_DOWNLOAD_THREADS', 4))
+
+# Largest image a media key may resolve to (the app's MAX_FILE_SIZE)
+MAX_IMAGE_BYTES = int(os.getenv('MAX_FILE_SIZE', 50 * 1024 * 1024))
+# Eviction scans the store at most this often per process (seconds)
+EVICTION_INTERVAL = 60.0
+# Blob file names: SHA-256 of the content plus the key's extension
+BLOB_NAME = re.compile(r'^[0-9a-f]{64}(\.\w{1,7})?$')
+
+
+class ImageSourceError(Exception):
+    """Resolving a media key failed; status is the HTTP status to answer with"""
+    status = 502
+
+
+class InvalidMediaKey(ImageSourceError):
+    status = 400
+
+
+class ImageNotFound(ImageSourceError):
+    status = 404
+
+
+class ImageTooLarge(ImageSourceError):
+    status = 413
+
+
+def _check_key(key: str) -> str:
+    if not isinstance(key, str) or not key or key.startswith('/') or '\x00' in key \
+            or '..' in key.split('/'):
+        raise InvalidMediaKey(f"Invalid media key: {key!r}")
+    return key
+
+
+class DirectoryBackend:
+    """Media keys as paths under a shared directory; files are used in place"""
+
+    def __init__(self, root: str):
+        self.root = os.path.realpath(root)
+
+    def local_path(self, key: str) -> str:
+        path = os.path.realpath(os.path.join(self.root, _check_key(key)))
+        # Symlinks must not lead out of the root either
+        if not path.startswith(self.root + os.sep):
+            raise InvalidMediaKey(f"Invalid media key: {key!r}")
+        if not os.path.isfile(path):
+            raise ImageNotFound(f"No image for media key {key}")
+        return path
+
+
+class S3Backend:
+    """S3 or S3-compatible object store, with one pooled client per process"""
+
+    def __init__(self, bucket: str, endpoint_url: str = '', region: str = S3_REGION,
+                 max_pool_connections: int = S3_MAX_POOL_CONNECTIONS,
+                 chunk_bytes: int = S3_RANGE_CHUNK_MB * 1024 * 1024, download_threads: int = S3_DOWNLOAD_THREADS):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url or None
+        self.region = region
+        self.max_pool_connections = max_pool_connections
+        self.chunk_bytes = chunk_bytes
+        self.download_threads = download_threads
+        self._client = None
+        self._client_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # botocore connections must not be shared with a forked worker: build per process
+        if self._client is None or self._client_pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._client_pid != os.getpid():
+                    import boto3
+                    from botocore.config import Config as BotoConfig
+                    self._client = boto3.client(
+                        's3', endpoint_url=self.endpoint_url, region_name=self.region,
+                        config=BotoConfig(max_pool_connections=self.max_pool_connections,
+                                          retries={'max_attempts': 3, 'mode': 'standard'}))
+                    self._client_pid = os.getpid()
+        return self._client
+
+    def _not_found(self, error) -> bool:
+        code = str(getattr(error, 'response', {}).get('Error', {}).get('Code', ''))
+        return code in ('404', 'NoSuchKey', 'NotFound')
+
+    def head(self, key: str) -> Tuple[int, str]:
+        """(size, etag) of an object"""
+        from botocore.exceptions import BotoCoreError, ClientError
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if self._not_found(e):
+                raise ImageNotFound(f"No image for media key {key}")
+            raise ImageSourceError(f"Object store error for {key}: {str(e)}")
+        except BotoCoreError as e:
+            raise ImageSourceError(f"Object store error for {key}: {str(e)}")
+        return int(response['ContentLength']), response.get('ETag', '').strip('"')
+
+    def read_range(self, key: str, start: int, end: int, etag: str = '') -> bytes:
+        """Bytes [start, end] (inclusive) of an object; etag pins the object version"""
+        from botocore.exceptions import BotoCoreError, ClientError
+        kwargs = {"Bucket": self.bucket, "Key": key, "Range": f"bytes={start}-{end}"}
+        if etag:
+            kwargs["IfMatch"] = etag
+        try:
+            response = self.client.get_object(**kwargs)
+            return response['Body'].read()
+        except ClientError as e:
+            if self._not_found(e):
+                raise ImageNotFound(f"No image for media key {key}")
+            raise ImageSourceError(f"Object store error for {key}: {str(e)}")
+        except BotoCoreError as e:
+            raise ImageSourceError(f"Object store error for {key}: {str(e)}")
+
+    def download(self, key: str, fd: int, max_bytes: int = MAX_IMAGE_BYTES) -> int:
+        """Write an object to an open file descriptor; returns its size"""
+        size, etag = self.head(_check_key(key))
+        if size > max_bytes:
+            raise ImageTooLarge(f"Image for media key {key} is {size} bytes (max: {max_bytes})")
+        ranges = [(start, min(start + self.chunk_bytes, size) - 1) for start in range(0, size, self.chunk_bytes)]
+
+        def fetch(byte_range):
+            data = self.read_range(key, byte_range[0], byte_range[1], etag)
+            os.pwrite(fd, data, byte_range[0])
+            return len(data)
+
+        if len(ranges) <= 1 or self.download_threads <= 1:
+            written = sum(map(fetch, ranges))
+        else:
+            with ThreadPoolExecutor(min(self.download_threads, len(ranges))) as pool:
+                written = sum(pool.map(fetch, ranges))
+        if written != size:
+            raise ImageSourceError(f"Short read for media key {key}: {written} of {size} bytes")
+        return size
+
+
+class BlobStore:
+    """
+    Content-addressed files: blobs/<sha256> holds the bytes, keys/<sha1 of key>
+    names the blob a media key resolved to. Least recently used blobs are
+    evicted once the store exceeds max_bytes.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = private_directory(root)
+        self.max_bytes = max_bytes
+        self._last_eviction = 0.0
+        for directory in ('blobs', 'keys', 'tmp'):
+            os.makedirs(os.path.join(root, directory), exist_ok=True)
+
+    def _key_file(self, key: str) -> str:
+        return os.path.join(self.root, 'keys', hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def _blob_path(self, digest: str, extension: str) -> str:
+        return os.path.join(self.root, 'blobs', digest + extension)
+
+    def lookup(self, key: str) -> Optional[str]:
+        try:
+            with open(self._key_file(key), encoding='utf-8') as f:
+                blob = f.read().strip()
+            if not BLOB_NAME.match(blob):
+                logger.warning("Ignoring image store key file with blob name %r", blob[:80])
+                return None
+            path = os.path.join(self.root, 'blobs', blob)
+            # Access time for LRU eviction (atime is often disabled on mounts)
+            os.utime(path)
+            return path
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, key: str, write) -> str:
+        """Store the bytes write(fd) produces for key; returns the blob path"""
+        temporary = os.path.join(self.root, 'tmp', uuid.uuid4().hex)
+        fd = os.open(temporary, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            write(fd)
+            os.lseek(fd, 0, os.SEEK_SET)
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: os.read(fd, 1 << 20), b''):
+                digest.update(chunk)
+        except BaseException:
+            os.close(fd)
+            os.unlink(temporary)
+            raise
+        os.close(fd)
+        # The key's extension is kept so format sniffing by name still works
+        extension = os.path.splitext(key)[1].lower()
+        blob = digest.hexdigest() + (extension if BLOB_NAME.match('0' * 64 + extension) else '')
+        path = os.path.join(self.root, 'blobs', blob)
+        # Identical content under another key (or from a concurrent worker) is stored once
+        os.replace(temporary, path)
+        key_temporary = f"{temporary}.key"
+        with open(key_temporary, 'w', encoding='utf-8') as f:
+            f.write(blob)
+        os.replace(key_temporary, self._key_file(key))
+        self.evict()
+        return path
+
+    def evict(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_eviction < EVICTION_INTERVAL:
+            return
+        self._last_eviction = now
+        blobs = []
+        total = 0
+        with os.scandir(os.path.join(self.root, 'blobs')) as entries:
+            for entry in entries:
+                stat = entry.stat()
+                blobs.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        # Down to 90% so the next few downloads don't trigger another scan
+        target = self.max_bytes * 0.9
+        removed = 0
+        for _, size, path in sorted(blobs):
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        logger.info("Image store evicted %s blobs, %sMB kept", removed, total // (1024 * 1024))
+
+
+class ImageSource:
+    """Resolves media keys to local image paths"""
+
+    def __init__(self, backend, store: Optional[BlobStore] = None):
+        self.backend = backend
+        self.store = store
+
+    @property
+    def kind(self) -> str:
+        return 'directory' if isinstance(self.backend, DirectoryBackend) else 's3'
+
+    def resolve(self, key: str) -> str:
+        if isinstance(self.backend, DirectoryBackend):
+            return self.backend.local_path(key)
+        _check_key(key)
+        path = self.store.lookup(key)
+        record_cache('image_store', path is not None)
+        if path is not None:
+            return path
+        with stage_timer('image_fetch'):
+            path = self.store.put(key, lambda fd: self.backend.download(key, fd))
+        logger.info("Fetched media key %s into the image store", key)
+        return path
+
+
+def load_image_source() -> Optional[ImageSource]:
+    """Image source configured by the environment, or None"""
+    if IMAGE_SOURCE == 'directory' and IMAGE_SOURCE_DIR:
+        return ImageSource(DirectoryBackend(IMAGE_SOURCE_DIR))
+    if IMAGE_SOURCE == 's3' and S3_BUCKET:
+        try:
+            import boto3  # noqa: F401
+        except ImportError:
+            logger.error("IMAGE_SOURCE=s3 needs boto3 (pip install boto3); media keys are disabled")
+            return None
+        try:
+            store = BlobStore(IMAGE_STORE_DIR, IMAGE_STORE_MAX_MB * 1024 * 1024)
+        except OSError as e:
+            logger.error("Image store %s is not usable, media keys are disabled: %s", IMAGE_STORE_DIR, e)
+            return None
+        return ImageSource(S3Backend(S3_BUCKET, S3_ENDPOINT_URL), store)
+    if IMAGE_SOURCE:
+        logger.error("IMAGE_SOURCE=%s is not configured (IMAGE_SOURCE_DIR or S3_BUCKET missing)", IMAGE_SOURCE)
+    return None
+
+
+# Global image source (None unless IMAGE_SOURCE is configured)
+image_source = load_image_source()
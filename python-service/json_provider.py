@@ -0,0 +1,75 @@
+"""
+JSON provider for Flask responses and request bodies
+orjson (when installed) encodes and parses several times faster than the
+stdlib and serializes NumPy arrays natively, so descriptors, keypoints and
+BoW vectors go out without .tolist(). Without orjson the stdlib provider is
+used, with the same NumPy support.
+"""
+
+import logging
+import os
+from typing import Any
+
+import numpy as np
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# auto (orjson when installed), orjson or stdlib
+JSON_PROVIDER = os.getenv('JSON_PROVIDER', 'auto').lower()
+
+
+def _default(obj: Any) -> Any:
+    # Arrays orjson can't take natively (non-contiguous, object dtype) and NumPy scalars
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return DefaultJSONProvider.default(obj)
+
+
+class NumpyJSONProvider(DefaultJSONProvider):
+    """Flask's stdlib provider, plus NumPy arrays and scalars"""
+    name = 'stdlib'
+    default = staticmethod(_default)
+
+
+class ORJSONProvider(JSONProvider):
+    name = 'orjson'
+    options = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def encode(self, obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=self.options)
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return self.encode(obj).decode('utf-8')
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        # orjson's bytes go out as they are, without a round trip through str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encode(obj), mimetype='application/json')
+
+
+def provider_class(choice: str = JSON_PROVIDER) -> type:
+    if choice == 'stdlib':
+        return NumpyJSONProvider
+    if orjson is None:
+        if choice == 'orjson':
+            logger.warning("JSON_PROVIDER=orjson but orjson is not installed, using the stdlib provider")
+        return NumpyJSONProvider
+    return ORJSONProvider
+
+
+def init_app(app, choice: str = JSON_PROVIDER) -> str:
+    """Install the configured provider on the app; returns its name"""
+    app.json = provider_class(choice)(app)
+    logger.info("JSON provider: %s", app.json.name)
+    return app.json.name
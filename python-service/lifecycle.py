@@ -0,0 +1,149 @@
+"""
+Worker lifecycle
+Workers are recycled when their memory grows rather than after a fixed number
+of requests, so warm caches, engines and mapped catalogs survive as long as
+nothing leaks. Anonymous resident memory (RSS minus file-backed pages, so
+mapped catalog and index files don't count) is sampled after each request; a
+worker restarts once it passes WORKER_MAX_RSS_MB or has grown by
+WORKER_MAX_GROWTH_MB since it was ready. Recycles are staggered through a
+lock file shared by the workers, so a fleet that grows together doesn't
+restart together; past WORKER_HARD_RSS_MB a worker restarts regardless.
+"""
+
+import fcntl
+import logging
+import os
+import random
+import tempfile
+import time
+from typing import Any, Dict, Optional
+
+from metrics import record_worker_recycle, set_worker_memory
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Recycle above this anonymous RSS (0 disables)
+WORKER_MAX_RSS_MB = int(os.getenv('WORKER_MAX_RSS_MB', 1024))
+# Recycle after growing this much past the warmed-up baseline (0 disables)
+WORKER_MAX_GROWTH_MB = int(os.getenv('WORKER_MAX_GROWTH_MB', 512))
+# Recycle immediately, without waiting for a stagger slot (0 disables)
+WORKER_HARD_RSS_MB = int(os.getenv('WORKER_HARD_RSS_MB', 1536))
+# Minimum seconds between two staggered recycles across all workers
+WORKER_RECYCLE_STAGGER = float(os.getenv('WORKER_RECYCLE_STAGGER', 30))
+# Sample memory every N requests
+WORKER_MEMORY_SAMPLE_EVERY = max(1, int(os.getenv('WORKER_MEMORY_SAMPLE_EVERY', 1)))
+# Each worker's soft limits are lowered by up to this fraction, so they aren't all reached at once
+THRESHOLD_JITTER = 0.1
+
+RECYCLE_LOCK_FILE = os.getenv('WORKER_RECYCLE_LOCK',
+                              os.path.join(tempfile.gettempdir(), 'archivart-worker-recycle'))
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def anonymous_rss() -> int:
+    """Resident memory of this process not backed by files, in bytes"""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            fields = f.read().split()
+        return (int(fields[1]) - int(fields[2])) * _PAGE_SIZE
+    except OSError:
+        # No procfs (macOS development): plain RSS
+        import psutil
+        return psutil.Process().memory_info().rss
+
+
+class WorkerLifecycle:
+    """Recycle decisions for the current worker process"""
+
+    def __init__(self, max_rss: int = WORKER_MAX_RSS_MB * MB, max_growth: int = WORKER_MAX_GROWTH_MB * MB,
+                 hard_rss: int = WORKER_HARD_RSS_MB * MB, stagger: float = WORKER_RECYCLE_STAGGER,
+                 sample_every: int = WORKER_MEMORY_SAMPLE_EVERY, lock_file: str = RECYCLE_LOCK_FILE):
+        self.max_rss = max_rss
+        self.max_growth = max_growth
+        self.hard_rss = hard_rss
+        self.stagger = stagger
+        self.sample_every = sample_every
+        self.lock_file = lock_file
+        self.baseline: Optional[int] = None
+        self.rss = 0
+        self.requests = 0
+        self.pending: Optional[str] = None
+        self._scale = 1.0
+
+    def worker_ready(self):
+        """Take the baseline once the worker is warm (post_worker_init)"""
+        self.rss = self.baseline = anonymous_rss()
+        self.requests = 0
+        self.pending = None
+        self._scale = 1.0 - random.Random(os.getpid()).random() * THRESHOLD_JITTER
+        set_worker_memory(self.rss)
+
+    def _reason(self) -> Optional[str]:
+        if self.hard_rss and self.rss > self.hard_rss:
+            return 'hard_rss'
+        if self.max_rss and self.rss > self.max_rss * self._scale:
+            return 'rss'
+        if self.max_growth and self.baseline is not None and self.rss - self.baseline > self.max_growth * self._scale:
+            return 'growth'
+        return None
+
+    def _claim_slot(self) -> bool:
+        """True if no other worker recycled within the stagger window"""
+        if self.stagger <= 0:
+            return True
+        try:
+            fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            logger.warning("Recycle lock %s unavailable, recycling unstaggered: %s", self.lock_file, e)
+            return True
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                last = float(os.pread(fd, 32, 0) or 0)
+            except ValueError:
+                last = 0.0
+            now = time.time()
+            if now - last < self.stagger:
+                return False
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, f"{now:.3f}".encode('ascii'), 0)
+            return True
+        finally:
+            os.close(fd)
+
+    def after_request(self) -> Optional[str]:
+        """Sample memory; returns the recycle reason when this worker should exit now"""
+        self.requests += 1
+        if self.requests % self.sample_every:
+            return None
+        self.rss = anonymous_rss()
+        set_worker_memory(self.rss)
+        reason = self._reason()
+        if reason is None:
+            self.pending = None
+            return None
+        if reason != 'hard_rss' and not self._claim_slot():
+            # Another worker just recycled; try again after a later request
+            if self.pending is None:
+                logger.info("Worker %s over its %s limit, waiting for a recycle slot", os.getpid(), reason)
+            self.pending = reason
+            return None
+        record_worker_recycle(reason)
+        logger.info("Recycling worker %s (%s): %sMB anonymous RSS, %sMB at start, %s requests", os.getpid(),
+                    reason, self.rss // MB, (self.baseline or 0) // MB, self.requests)
+        return reason
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rss_mb": round(anonymous_rss() / MB, 1),
+            "baseline_mb": round(self.baseline / MB, 1) if self.baseline is not None else None,
+            "requests": self.requests,
+            "pending_recycle": self.pending
+        }
+
+
+# Global lifecycle of this worker
+worker_lifecycle = WorkerLifecycle()
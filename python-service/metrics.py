@@ -0,0 +1,236 @@
+"""
+Metrics Module for the OpenCV Feature Matching / OCR Service
+Prometheus counters and latency histograms, aggregated across gunicorn workers
+
+When PROMETHEUS_MULTIPROC_DIR is set (gunicorn.conf.py does this), every worker
+writes its samples to memory-mapped files in that directory and /metrics merges
+them, so the numbers no longer depend on which worker served the scrape.
+"""
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+    generate_latest, CONTENT_TYPE_LATEST, multiprocess
+)
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv('ENABLE_METRICS', 'true').lower() == 'true'
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+# Buckets cover both sub-millisecond stages (matching one pair) and long OCR requests
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+REQUESTS_TOTAL = Counter(
+    'opencv_service_requests_total', 'Requests handled, by endpoint and outcome',
+    ['endpoint', 'outcome'])
+REQUEST_LATENCY = Histogram(
+    'opencv_service_request_duration_seconds', 'Request latency by endpoint and HTTP status',
+    ['endpoint', 'status'], buckets=LATENCY_BUCKETS)
+STAGE_LATENCY = Histogram(
+    'opencv_service_stage_duration_seconds', 'Pipeline stage latency '
+    '(decode, preprocess, rotation, language_detection, tesseract_*, orb_detect, matching)',
+    ['stage'], buckets=LATENCY_BUCKETS)
+FEATURES_EXTRACTED = Counter(
+    'opencv_service_features_extracted_total', 'ORB descriptors extracted')
+MATCHES_PERFORMED = Counter(
+    'opencv_service_matches_total', 'Descriptor set comparisons performed')
+CACHE_REQUESTS = Counter(
+    'opencv_service_cache_requests_total', 'Cache lookups by cache and result (hit/miss)',
+    ['cache', 'result'])
+QUEUE_DEPTH = Gauge(
+    'opencv_service_queue_depth', 'Items waiting in internal queues, summed over live workers',
+    ['queue'], multiprocess_mode='livesum')
+IN_FLIGHT = Gauge(
+    'opencv_service_requests_in_flight', 'Requests currently being processed, summed over live workers',
+    multiprocess_mode='livesum')
+WORKER_STARTUP = Histogram(
+    'opencv_service_worker_startup_seconds', 'Worker start-up phases, from fork '
+    '(warm: post-fork warm-up, ready: accepting requests, first_request: first response sent)',
+    ['phase'], buckets=LATENCY_BUCKETS)
+WORKER_RECYCLES = Counter(
+    'opencv_service_worker_recycles_total', 'Workers recycled for memory, by reason (rss, growth, hard_rss)',
+    ['reason'])
+WORKER_MEMORY = Gauge(
+    'opencv_service_worker_memory_bytes', 'Anonymous resident memory of each live worker',
+    multiprocess_mode='liveall')
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Record the duration of a pipeline stage in the stage latency histogram and the request trace"""
+    with span(stage):
+        if not ENABLED:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            STAGE_LATENCY.labels(stage=stage).observe(time.perf_counter() - start)
+
+
+def observe_stage(stage: str, seconds: float):
+    """Record an already measured stage duration"""
+    if ENABLED:
+        STAGE_LATENCY.labels(stage=stage).observe(seconds)
+
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup; hit ratio is hits / (hits + misses) per cache"""
+    if ENABLED:
+        CACHE_REQUESTS.labels(cache=cache, result='hit' if hit else 'miss').inc()
+
+
+def record_worker_startup(phase: str, seconds: float):
+    if ENABLED:
+        WORKER_STARTUP.labels(phase=phase).observe(seconds)
+
+
+def record_worker_recycle(reason: str):
+    if ENABLED:
+        WORKER_RECYCLES.labels(reason=reason).inc()
+
+
+def set_worker_memory(rss: int):
+    if ENABLED:
+        WORKER_MEMORY.set(rss)
+
+
+def set_queue_depth(queue: str, depth: int):
+    if ENABLED:
+        QUEUE_DEPTH.labels(queue=queue).set(depth)
+
+
+def collector_registry():
+    """Registry that sees every worker in multiprocess mode, or this process otherwise"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render_prometheus() -> bytes:
+    return generate_latest(collector_registry())
+
+
+def mark_process_dead(pid: int):
+    """Drop a dead worker's live gauges (called from gunicorn's child_exit hook)"""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
+
+
+class Metrics:
+    """
+    Service-level counters backed by the Prometheus metrics above.
+
+    Keeps the interface the endpoints already use and a JSON summary for /health
+    and /metrics?format=json, computed from the aggregated registry so it reports
+    the whole service rather than the worker that answered.
+    """
+
+    # Process CPU is sampled at most this often; cpu_percent() needs an interval
+    # between calls to mean anything
+    CPU_SAMPLE_INTERVAL = 5.0
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+        self._process = None
+        self._process_pid = None
+        self._cpu_percent = 0.0
+        self._cpu_sampled_at = 0.0
+
+    def increment_requests(self, success=True, endpoint: str = 'unknown'):
+        REQUESTS_TOTAL.labels(endpoint=endpoint, outcome='success' if success else 'error').inc()
+
+    def increment_features(self, count):
+        FEATURES_EXTRACTED.inc(count)
+
+    def increment_matches(self):
+        MATCHES_PERFORMED.inc()
+
+    def _process_stats(self) -> Dict[str, float]:
+        with self.lock:
+            # psutil.Process caches its pid, so rebuild it after a fork
+            if self._process is None or self._process_pid != os.getpid():
+                # Only /health and /metrics?format=json need it, so imported on first use
+                import psutil
+                self._process = psutil.Process()
+                self._process_pid = os.getpid()
+                self._process.cpu_percent(None)
+            now = time.time()
+            if now - self._cpu_sampled_at >= self.CPU_SAMPLE_INTERVAL:
+                self._cpu_percent = self._process.cpu_percent(None)
+                self._cpu_sampled_at = now
+            return {
+                'memory_usage_mb': self._process.memory_info().rss / 1024 / 1024,
+                'cpu_percent': self._cpu_percent
+            }
+
+    def _sample_totals(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for metric in collector_registry().collect():
+            for sample in metric.samples:
+                if sample.name == 'opencv_service_requests_total':
+                    key = f"requests_{sample.labels.get('outcome')}"
+                elif sample.name in ('opencv_service_features_extracted_total', 'opencv_service_matches_total'):
+                    key = sample.name
+                else:
+                    continue
+                totals[key] = totals.get(key, 0.0) + sample.value
+        return totals
+
+    def get_stats(self) -> Dict[str, Any]:
+        totals = self._sample_totals()
+        success = int(totals.get('requests_success', 0))
+        error = int(totals.get('requests_error', 0))
+        total = success + error
+        stats = {
+            'uptime_seconds': time.time() - self.start_time,
+            'requests_total': total,
+            'requests_success': success,
+            'requests_error': error,
+            'success_rate': success / max(total, 1),
+            'features_extracted': int(totals.get('opencv_service_features_extracted_total', 0)),
+            'matches_performed': int(totals.get('opencv_service_matches_total', 0)),
+            'aggregated_across_workers': bool(MULTIPROC_DIR),
+            'worker_pid': os.getpid()
+        }
+        stats.update(self._process_stats())
+        return stats
+
+
+def instrument_app(app):
+    """Register Flask hooks recording per-endpoint latency and in-flight requests"""
+    from flask import g, request
+
+    @app.before_request
+    def _metrics_start_request():
+        g.metrics_start = time.perf_counter()
+        IN_FLIGHT.inc()
+        g.metrics_in_flight = True
+
+    @app.after_request
+    def _metrics_record_request(response):
+        start = g.get('metrics_start')
+        if start is not None:
+            endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            REQUEST_LATENCY.labels(endpoint=endpoint, status=str(response.status_code)).observe(
+                time.perf_counter() - start)
+        return response
+
+    @app.teardown_request
+    def _metrics_end_request(exc):
+        if g.pop('metrics_in_flight', False):
+            IN_FLIGHT.dec()
@@ -0,0 +1,86 @@
+"""
+OCR response shaping
+Clients choose what an OCR response carries: `fields` selects top-level keys,
+Tesseract's raw_data (a dozen parallel lists per word) is only included on
+request, and word boxes come as objects (default), parallel arrays or packed
+little-endian int32 in base64.
+"""
+
+import base64
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional
+
+import numpy as np
+
+BOX_ENCODINGS = ('objects', 'columns', 'packed')
+# Integer box attributes, in packed row order
+BOX_NUMBERS = ('confidence', 'left', 'top', 'width', 'height')
+# Kept whatever `fields` selects, so failures stay recognizable
+ALWAYS_INCLUDED = ('success', 'error')
+
+
+class ResponseOptionsError(ValueError):
+    pass
+
+
+class ResponseOptions(NamedTuple):
+    fields: Optional[FrozenSet[str]] = None
+    raw_data: bool = False
+    box_encoding: str = 'objects'
+
+
+def _flag(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.lower() == 'true'
+    return bool(value)
+
+
+def parse_options(params: Any) -> ResponseOptions:
+    """Options from a JSON body or form; `fields` is a list or comma-separated string"""
+    fields = params.get('fields')
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    if fields is not None and not isinstance(fields, list):
+        raise ResponseOptionsError("fields must be a list or a comma-separated string")
+    box_encoding = params.get('box_encoding') or 'objects'
+    if box_encoding not in BOX_ENCODINGS:
+        raise ResponseOptionsError(f"box_encoding must be one of: {', '.join(BOX_ENCODINGS)}")
+    selected = frozenset(fields) if fields else None
+    # Selecting raw_data by name also asks for it
+    raw_data = _flag(params.get('raw_data', False)) or (selected is not None and 'raw_data' in selected)
+    return ResponseOptions(selected, raw_data, box_encoding)
+
+
+def box_columns(data: Dict[str, List[Any]]) -> Dict[str, List[Any]]:
+    """Words with confidence > 0 from Tesseract's image_to_data dict, as parallel lists"""
+    keep = [i for i, conf in enumerate(data['conf']) if int(conf) > 0]
+    columns = {'text': [data['text'][i] for i in keep],
+               'confidence': [int(data['conf'][i]) for i in keep]}
+    for name in BOX_NUMBERS[1:]:
+        values = data[name]
+        columns[name] = [int(values[i]) for i in keep]
+    return columns
+
+
+def encode_boxes(columns: Dict[str, List[Any]], encoding: str = 'objects') -> Any:
+    if encoding == 'columns':
+        return columns
+    if encoding == 'packed':
+        rows = np.array([columns[name] for name in BOX_NUMBERS], dtype='<i4').T
+        return {
+            "fields": list(BOX_NUMBERS),
+            "count": len(columns['text']),
+            "data": base64.b64encode(np.ascontiguousarray(rows).tobytes()).decode('ascii'),
+            "text": columns['text']
+        }
+    names = ('text',) + BOX_NUMBERS
+    return [dict(zip(names, values)) for values in zip(*(columns[name] for name in names))]
+
+
+def shape(result: Dict[str, Any], options: ResponseOptions) -> Dict[str, Any]:
+    """Drop raw_data unless asked for, then keep only the selected fields"""
+    if not options.raw_data:
+        result.pop('raw_data', None)
+    if options.fields is not None:
+        result = {key: value for key, value in result.items()
+                  if key in options.fields or key in ALWAYS_INCLUDED}
+    return result
@@ -8,13 +8,96 @@ import numpy as np
 import pytesseract
 import logging
 import time
-import re
 from typing import Optional, Dict, Any, List
 from PIL import Image
 import os
 
+from metrics import stage_timer
+from preprocessing import preprocessor, rotation_matrix
+import ocr_response
+import postprocessing
+import startup
+import text_regions
+import tiling
+from structured_logging import debug_sampled
+from tracing import span, traced
+
 logger = logging.getLogger(__name__)
 
+# Columns of pytesseract's image_to_data dict
+TESSERACT_DATA_KEYS = ('level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+                       'left', 'top', 'width', 'height', 'conf', 'text')
+
+
+def _timed_out(error: Exception) -> bool:
+    """pytesseract kills the process and raises RuntimeError('Tesseract process timeout')"""
+    return isinstance(error, RuntimeError) and 'timeout' in str(error).lower()
+
+
+class Deadline:
+    """
+    Time budget for a single OCR request.
+
+    Optional pipeline stages (rotation sweep, language detection, alternative
+    configs, low-quality fallback) check the deadline before running and are
+    skipped or cheapened when they no longer fit, so the request returns the
+    best result found so far instead of being killed by the worker timeout.
+    """
+
+    def __init__(self, budget: Optional[float] = None):
+        self.budget = budget
+        self.start = time.monotonic()
+        self.skipped_stages: List[str] = []
+        self.reduced_stages: Dict[str, str] = {}
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def remaining(self) -> float:
+        if self.budget is None:
+            return float('inf')
+        return max(0.0, self.budget - self.elapsed())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def affordable_calls(self, call_estimate: float, reserve_calls: int = 0) -> int:
+        """How many Tesseract calls fit, keeping reserve_calls for the stages that follow"""
+        if self.budget is None:
+            return 2 ** 31
+        spare = self.remaining() - reserve_calls * call_estimate
+        return max(0, int(spare / max(call_estimate, 1e-3)))
+
+    def call_timeout(self, floor: float = 0.0) -> float:
+        """Tesseract subprocess timeout for the next call (0 means no timeout)"""
+        if self.budget is None:
+            return 0
+        return max(self.remaining(), floor, 0.1)
+
+    def skip(self, stage: str):
+        if stage not in self.skipped_stages:
+            logger.info("Deadline: skipping stage '%s' (%.2fs left)", stage, self.remaining())
+            self.skipped_stages.append(stage)
+
+    def reduce(self, stage: str, detail: str):
+        logger.info("Deadline: reducing stage '%s' to %s (%.2fs left)", stage, detail, self.remaining())
+        self.reduced_stages[stage] = detail
+
+    @property
+    def partial(self) -> bool:
+        return bool(self.skipped_stages or self.reduced_stages)
+
+    def annotate(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Attach partial-result flags to an OCR result dict"""
+        result["partial"] = self.partial
+        result["skipped_stages"] = list(self.skipped_stages)
+        if self.reduced_stages:
+            result["reduced_stages"] = dict(self.reduced_stages)
+        if self.budget is not None:
+            result["time_budget"] = self.budget
+        return result
+
+
 class OCRService:
     def __init__(self):
         """Initialize OCR service with Tesseract configuration"""
@@ -28,31 +111,168 @@ class OCRService:
             '--oem 3 --psm 8',  # Single word
             '--oem 3 --psm 13', # Raw line. Treat the image as a single text line
         ]
-        
-        # Try to detect Tesseract installation and available languages
-        try:
-            pytesseract.get_tesseract_version()
-            # Get actually available languages from Tesseract
-            available_langs = pytesseract.get_languages()
+        # Order in which alternative configs are tried when the time budget
+        # cannot cover all of them (most generally useful first)
+        self.config_priority = [
+            '--oem 3 --psm 6',
+            '--oem 3 --psm 3',
+            '--oem 3 --psm 13',
+            '--oem 3 --psm 8',
+        ]
+        # Rotation sweep angles tried when OSD and Hough lines find nothing
+        self.rotation_sweep_angles = [a for a in range(-45, 46, 5) if a != 0]
+        # Running estimate of one Tesseract call (seconds), used to plan stages
+        # against a deadline. Updated after every call.
+        self.tesseract_call_estimate = 1.0
+        # The primary recognition pass always gets at least this much time,
+        # even when optional stages have used up the budget
+        self.min_recognition_timeout = 2.0
+        # Preprocessing kernels with cached CLAHE/LUT and reusable work buffers
+        self.preprocessor = preprocessor
+
+        # Detect the Tesseract installation and available languages (cached
+        # across processes while the binary and tessdata are unchanged)
+        probe = startup.probe_tesseract(pytesseract.pytesseract.tesseract_cmd)
+        self.tesseract_version = probe['version']
+        if probe['available']:
+            available_langs = probe['languages']
             # Update supported languages with actually available ones
             self.supported_languages = [lang for lang in self.supported_languages if lang in available_langs]
-            logger.info(f"Tesseract OCR initialized successfully")
-            logger.info(f"Available languages: {available_langs}")
-            logger.info(f"Supported languages: {self.supported_languages}")
-        except Exception as e:
-            logger.error(f"Tesseract OCR not found or not properly installed: {str(e)}")
+            logger.info("Tesseract OCR initialized successfully")
+            logger.info("Available languages: %s", available_langs)
+            logger.info("Supported languages: %s", self.supported_languages)
+        else:
+            logger.error("Tesseract OCR not found or not properly installed: %s", probe['error'])
             logger.error("Please install Tesseract OCR: https://github.com/tesseract-ocr/tesseract")
-    
-    def detect_text_rotation(self, image: np.ndarray) -> float:
+
+    def _run_tesseract(self, method: str, image, deadline: Optional[Deadline] = None,
+                       timeout_floor: float = 0.0, **kwargs):
+        """
+        Call a pytesseract function bounded by the request deadline and update
+        the per-call cost estimate used for stage planning
+        """
+        start = time.monotonic()
+        try:
+            with stage_timer(f"tesseract_{method}"):
+                bands = self._tesseract_bands(method, image, kwargs)
+                if bands is None:
+                    return self._call_tesseract(method, image, deadline, timeout_floor, kwargs)
+                # Page too large for one Tesseract run within the memory budget:
+                # recognize it band by band and shift boxes back into page coordinates
+                parts = []
+                for top, bottom in bands:
+                    band = image.crop((0, top, image.width, bottom))
+                    parts.append((self._call_tesseract(method, band, deadline, timeout_floor, kwargs), 0, top))
+                return tiling.merge_tesseract_output(method, parts)
+        finally:
+            elapsed = time.monotonic() - start
+            self.tesseract_call_estimate = 0.8 * self.tesseract_call_estimate + 0.2 * elapsed
+
+    def _call_tesseract(self, method: str, image, deadline: Optional[Deadline], timeout_floor: float,
+                        kwargs: Dict[str, Any]):
+        if deadline is not None:
+            kwargs = dict(kwargs, timeout=deadline.call_timeout(timeout_floor))
+        return getattr(pytesseract, method)(image, **kwargs)
+
+    def _tesseract_bands(self, method: str, image, kwargs: Dict[str, Any]) -> Optional[List[tuple]]:
+        """Text bands to recognize separately, or None when the page fits the memory budget"""
+        if method == 'image_to_data':
+            if kwargs.get('output_type') != pytesseract.Output.DICT:
+                return None
+        elif method != 'image_to_string':
+            return None
+        if not isinstance(image, Image.Image) or image.mode != 'L':
+            return None
+        width, height = image.size
+        if not tiling.needs_tiling(width * height, tiling.TESSERACT_BYTES_PER_PIXEL):
+            return None
+        max_rows = tiling.rows_within_budget(width, tiling.TESSERACT_BYTES_PER_PIXEL)
+        bands = tiling.text_bands(np.asarray(image), max_rows)
+        return bands if len(bands) > 1 else None
+
+    def _plan_text_regions(self, pil_image) -> Optional[List[text_regions.TextRegion]]:
+        """Text regions to recognize separately, or None to recognize the whole page"""
+        try:
+            with stage_timer('text_regions'):
+                gray = np.asarray(pil_image if pil_image.mode == 'L' else pil_image.convert('L'))
+                regions = text_regions.plan(gray)
+        except Exception as e:
+            logger.debug("Text region detection failed: %s", e)
+            return None
+        if regions and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Recognizing %d text regions covering %.0f%% of the page",
+                         len(regions), 100 * text_regions.coverage(regions, gray.shape))
+        return regions
+
+    def _recognize(self, pil_image, language: str, config: str, deadline: Optional[Deadline],
+                   timeout_floor: float, regions: Optional[List[text_regions.TextRegion]] = None) -> tuple:
+        """(image_to_data dict, text) for the whole page, or assembled from the text regions"""
+        # A call cut off by the deadline keeps what was recognized before it
+        # (nothing at worst) and marks the result partial instead of failing it
+        if not regions:
+            try:
+                data = self._run_tesseract('image_to_data', pil_image, deadline, timeout_floor,
+                                           lang=language, config=config, output_type=pytesseract.Output.DICT)
+            except RuntimeError as e:
+                if deadline is None or not _timed_out(e):
+                    raise
+                deadline.skip('recognition')
+                return {key: [] for key in TESSERACT_DATA_KEYS}, ''
+            try:
+                text = self._run_tesseract('image_to_string', pil_image, deadline, timeout_floor,
+                                           lang=language, config=config)
+            except RuntimeError as e:
+                if deadline is None or not _timed_out(e):
+                    raise
+                # The word boxes are in; the text is rebuilt from them without Tesseract's layout
+                deadline.skip('text_layout')
+                text = text_regions.data_to_text(data)
+            return data, text
+
+        # One image_to_data call per region with a PSM suited to it; the text is
+        # rebuilt from the word boxes instead of a second pass per region
+        parts = []
+        for index, region in enumerate(regions):
+            if index > 0 and deadline is not None and deadline.affordable_calls(self.tesseract_call_estimate) < 1:
+                deadline.reduce('text_regions', f"{index}/{len(regions)} regions")
+                break
+            try:
+                with span('ocr_region', kind=region.kind):
+                    data = self._run_tesseract('image_to_data', pil_image.crop(region.box), deadline,
+                                               timeout_floor if index == 0 else 0.0, lang=language,
+                                               config=text_regions.region_config(config, region),
+                                               output_type=pytesseract.Output.DICT)
+            except RuntimeError as e:
+                if deadline is None or not _timed_out(e):
+                    raise
+                if parts:
+                    deadline.reduce('text_regions', f"{index}/{len(regions)} regions")
+                else:
+                    deadline.skip('recognition')
+                break
+            parts.append((data, region.left, region.top))
+        if not parts:
+            return {key: [] for key in TESSERACT_DATA_KEYS}, ''
+        data = tiling.merge_tesseract_output('image_to_data', parts)
+        return data, text_regions.data_to_text(data)
+
+    def detect_text_rotation(self, image: np.ndarray, deadline: Optional[Deadline] = None) -> float:
         """
         Detect the rotation angle of text in the image using multiple methods
         """
+        with stage_timer('rotation'):
+            return self._detect_text_rotation(image, deadline)
+
+    def _detect_text_rotation(self, image: np.ndarray, deadline: Optional[Deadline] = None) -> float:
         try:
             # Method 1: Try Tesseract's orientation detection
             try:
-                from PIL import Image
+                if deadline is not None and deadline.affordable_calls(self.tesseract_call_estimate, reserve_calls=2) < 1:
+                    deadline.skip('rotation_osd')
+                    raise RuntimeError("no time budget left for orientation detection")
                 pil_image = Image.fromarray(image)
-                osd = pytesseract.image_to_osd(pil_image, output_type=pytesseract.Output.DICT)
+                osd = self._run_tesseract('image_to_osd', pil_image, deadline,
+                                          output_type=pytesseract.Output.DICT)
                 if 'orientation' in osd:
                     orientation = osd['orientation']
                     # Convert Tesseract orientation to rotation angle
@@ -65,10 +285,10 @@ class OCRService:
                         rotation_angle = 270
                     
                     if rotation_angle != 0:
-                        logger.info(f"Tesseract detected orientation: {orientation} (rotation: {rotation_angle}°)")
+                        logger.debug("Tesseract detected orientation: %s (rotation: %d°)", orientation, rotation_angle)
                         return rotation_angle
             except Exception as e:
-                logger.debug(f"Tesseract orientation detection failed: {str(e)}")
+                logger.debug("Tesseract orientation detection failed: %s", e)
             
             # Method 2: Hough line transform with improved parameters
             try:
@@ -97,29 +317,44 @@ class OCRService:
                         if filtered_angles:
                             # Use median angle for robustness
                             median_angle = np.median(filtered_angles)
-                            logger.info(f"Hough lines detected text rotation angle: {median_angle:.2f} degrees")
+                            logger.debug("Hough lines detected text rotation angle: %.2f degrees", median_angle)
                             return median_angle
             except Exception as e:
-                logger.debug(f"Hough line detection failed: {str(e)}")
+                logger.debug("Hough line detection failed: %s", e)
             
             # Method 3: Try different rotation angles and find the best one
             try:
                 best_angle = 0
                 best_confidence = 0
-                
+
                 # Test rotation angles from -45 to 45 degrees in 5-degree steps
-                for test_angle in range(-45, 46, 5):
-                    if test_angle == 0:
-                        continue
-                    
+                test_angles = self.rotation_sweep_angles
+                if deadline is not None:
+                    # Use at most half of what is left, keeping enough budget for
+                    # language detection and recognition afterwards
+                    affordable = deadline.affordable_calls(self.tesseract_call_estimate, reserve_calls=2) // 2
+                    if affordable < 2:
+                        deadline.skip('rotation_sweep')
+                        test_angles = []
+                    elif affordable < len(test_angles):
+                        # Cheapen the sweep: evenly spaced subset of the angles
+                        indices = np.linspace(0, len(test_angles) - 1, affordable).round().astype(int)
+                        test_angles = [test_angles[i] for i in sorted(set(indices))]
+                        deadline.reduce('rotation_sweep', f"{len(test_angles)}/{len(self.rotation_sweep_angles)} angles")
+
+                for test_angle in test_angles:
+                    if deadline is not None and deadline.affordable_calls(self.tesseract_call_estimate, reserve_calls=2) < 1:
+                        deadline.reduce('rotation_sweep', f"stopped before {test_angle}°")
+                        break
+
                     # Rotate image
                     rotated = self.rotate_image(image, test_angle)
-                    
+
                     # Quick OCR test to get confidence
                     try:
-                        from PIL import Image
                         pil_rotated = Image.fromarray(rotated)
-                        data = pytesseract.image_to_data(pil_rotated, output_type=pytesseract.Output.DICT)
+                        data = self._run_tesseract('image_to_data', pil_rotated, deadline,
+                                                   output_type=pytesseract.Output.DICT)
                         
                         # Calculate average confidence
                         confidences = [int(conf) for conf in data['conf'] if int(conf) > 0]
@@ -132,16 +367,16 @@ class OCRService:
                         continue
                 
                 if best_confidence > 30:  # Only use if confidence is reasonable
-                    logger.info(f"Best rotation angle found: {best_angle}° (confidence: {best_confidence:.1f}%)")
+                    logger.debug("Best rotation angle found: %s° (confidence: %.1f%%)", best_angle, best_confidence)
                     return best_angle
                     
             except Exception as e:
-                logger.debug(f"Rotation testing failed: {str(e)}")
+                logger.debug("Rotation testing failed: %s", e)
             
             return 0.0
             
         except Exception as e:
-            logger.warning(f"Could not detect text rotation: {str(e)}")
+            logger.warning("Could not detect text rotation: %s", e)
             return 0.0
     
     def rotate_image(self, image: np.ndarray, angle: float) -> np.ndarray:
@@ -152,226 +387,133 @@ class OCRService:
             if abs(angle) < 1.0:  # Skip rotation for very small angles
                 return image
             
-            # Get image dimensions
-            height, width = image.shape[:2]
-            center = (width // 2, height // 2)
-            
-            # Create rotation matrix
-            rotation_matrix = cv2.getRotationMatrix2D(center, -angle, 1.0)
-            
-            # Calculate new dimensions to avoid cropping
-            cos_angle = abs(rotation_matrix[0, 0])
-            sin_angle = abs(rotation_matrix[0, 1])
-            new_width = int((height * sin_angle) + (width * cos_angle))
-            new_height = int((height * cos_angle) + (width * sin_angle))
-            
-            # Adjust rotation matrix for new dimensions
-            rotation_matrix[0, 2] += (new_width / 2) - center[0]
-            rotation_matrix[1, 2] += (new_height / 2) - center[1]
+            # Rotation matrix onto an enlarged canvas, to avoid cropping
+            matrix, (new_width, new_height) = rotation_matrix(image.shape, angle)
             
             # Rotate the image
-            rotated = cv2.warpAffine(image, rotation_matrix, (new_width, new_height), 
+            rotated = cv2.warpAffine(image, matrix, (new_width, new_height), 
                                    borderValue=(255, 255, 255) if len(image.shape) == 3 else 255)
             
-            logger.info(f"Rotated image by {angle:.2f} degrees")
+            debug_sampled(logger, 'rotate_image', "Rotated image by %.2f degrees", angle)
             return rotated
             
         except Exception as e:
-            logger.error(f"Error rotating image: {str(e)}")
+            logger.error("Error rotating image: %s", e)
             return image
 
-    def preprocess_image(self, image_path: str, enhance_contrast: bool = True, denoise: bool = True, 
-                        auto_rotate: bool = True, improve_readability: bool = False) -> Optional[np.ndarray]:
+    def preprocess_image(self, image_path: str, enhance_contrast: bool = True, denoise: bool = True,
+                        auto_rotate: bool = True, improve_readability: bool = False,
+                        deadline: Optional[Deadline] = None) -> Optional[np.ndarray]:
         """
         Preprocess image for better OCR results with advanced readability improvements
         """
         try:
+            size = self._image_size(image_path)
+            if size and tiling.needs_tiling(size[0] * size[1], tiling.PREPROCESS_BYTES_PER_PIXEL):
+                return self._preprocess_image_tiled(image_path, enhance_contrast, denoise, auto_rotate,
+                                                    improve_readability, deadline)
+
             # Read image
-            img = cv2.imread(image_path)
+            with stage_timer('decode'):
+                img = cv2.imread(image_path)
             if img is None:
-                logger.error(f"Could not read image: {image_path}")
+                logger.error("Could not read image: %s", image_path)
                 return None
             
             # Convert to grayscale
             gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            
+
             # Auto-rotate if requested
             if auto_rotate:
-                rotation_angle = self.detect_text_rotation(gray)
+                rotation_angle = self.detect_text_rotation(gray, deadline)
                 if abs(rotation_angle) > 1.0:  # Only rotate if angle is significant
                     gray = self.rotate_image(gray, rotation_angle)
-            
-            # Advanced readability improvements
-            if improve_readability:
-                gray = self.enhance_readability(gray)
-            
-            # Enhance contrast if requested
-            if enhance_contrast:
-                # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization)
-                clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-                gray = clahe.apply(gray)
-            
-            # Denoise if requested
-            if denoise:
-                gray = cv2.medianBlur(gray, 3)
-            
-            # Apply adaptive threshold for better text separation
-            if improve_readability:
-                # Use adaptive threshold for better handling of varying lighting
-                binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                             cv2.THRESH_BINARY, 11, 2)
-            else:
-                # Use Otsu's method for simple cases
-                _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            
-            return binary
-            
+
+            with stage_timer('preprocess'):
+                return self._filter_and_threshold(gray, enhance_contrast, denoise, improve_readability)
+
         except Exception as e:
-            logger.error(f"Error preprocessing image {image_path}: {str(e)}")
+            logger.error("Error preprocessing image %s: %s", image_path, e)
             return None
-    
+
+    def _image_size(self, image_path: str) -> Optional[tuple]:
+        """(width, height) from the image header, without decoding the pixels"""
+        try:
+            with Image.open(image_path) as img:
+                return img.size
+        except Exception:
+            return None
+
+    def _preprocess_image_tiled(self, image_path: str, enhance_contrast: bool, denoise: bool,
+                                auto_rotate: bool, improve_readability: bool,
+                                deadline: Optional[Deadline]) -> Optional[np.ndarray]:
+        """
+        preprocess_image for pages over the tiling memory budget: decode straight to
+        grayscale, detect rotation on a downscaled proxy and rotate + filter in strips
+        """
+        with stage_timer('decode'):
+            gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            logger.error("Could not read image: %s", image_path)
+            return None
+
+        rotation_angle = 0.0
+        if auto_rotate:
+            rotation_angle = self.detect_text_rotation(tiling.rotation_proxy(gray), deadline)
+            if abs(rotation_angle) <= 1.0:
+                rotation_angle = 0.0
+
+        if rotation_angle:
+            _, (width, height) = rotation_matrix(gray.shape, rotation_angle)
+        else:
+            height, width = gray.shape
+        # The input and the full-size output stay resident; strips get the rest of the budget
+        strip_rows = tiling.rows_within_budget(width, tiling.PREPROCESS_STRIP_BYTES_PER_PIXEL,
+                                               reserved=gray.nbytes + width * height)
+        logger.info("Tiled preprocessing: %dx%d in strips of %d rows, rotated by %.2f degrees",
+                    gray.shape[1], gray.shape[0], strip_rows, rotation_angle or 0.0)
+        with stage_timer('preprocess'):
+            return self.preprocessor.filter_and_threshold_strips(gray, enhance_contrast, denoise,
+                                                                 improve_readability, strip_rows,
+                                                                 rotation_angle)
+
+    def _filter_and_threshold(self, gray: np.ndarray, enhance_contrast: bool, denoise: bool,
+                              improve_readability: bool) -> np.ndarray:
+        """Contrast, denoise and binarization steps of preprocess_image (after rotation)"""
+        return self.preprocessor.filter_and_threshold(gray, enhance_contrast, denoise, improve_readability)
+
+    @traced()
     def enhance_readability(self, image: np.ndarray) -> np.ndarray:
         """
         Apply advanced image processing techniques to improve text readability
         """
         try:
-            # 1. Noise reduction with bilateral filter (preserves edges)
-            filtered = cv2.bilateralFilter(image, 9, 75, 75)
-            
-            # 2. Morphological operations to clean up text
-            # Remove small noise
-            kernel_noise = np.ones((2, 2), np.uint8)
-            filtered = cv2.morphologyEx(filtered, cv2.MORPH_OPEN, kernel_noise)
-            
-            # 3. Enhance text contrast
-            # Apply gamma correction for better contrast
-            gamma = 1.2
-            filtered = np.power(filtered / 255.0, gamma) * 255.0
-            filtered = np.uint8(filtered)
-            
-            # 4. Sharpen text edges
-            kernel_sharpen = np.array([[-1, -1, -1],
-                                     [-1,  9, -1],
-                                     [-1, -1, -1]])
-            sharpened = cv2.filter2D(filtered, -1, kernel_sharpen)
-            
-            # 5. Combine original and sharpened image
-            enhanced = cv2.addWeighted(filtered, 0.7, sharpened, 0.3, 0)
-            
-            # 6. Final cleanup - remove isolated pixels
-            kernel_cleanup = np.ones((3, 3), np.uint8)
-            enhanced = cv2.morphologyEx(enhanced, cv2.MORPH_CLOSE, kernel_cleanup)
-            
-            logger.info("Applied readability enhancements: noise reduction, contrast enhancement, edge sharpening")
+            # Bilateral denoise, opening, gamma, sharpening and closing (see preprocessing.py)
+            enhanced = self.preprocessor.enhance_readability(image)
+            debug_sampled(logger, 'readability', "Applied readability enhancements: noise reduction, "
+                          "contrast enhancement, edge sharpening")
             return enhanced
             
         except Exception as e:
-            logger.warning(f"Readability enhancement failed: {str(e)}")
+            logger.warning("Readability enhancement failed: %s", e)
             return image
     
-    def post_process_text(self, text: str) -> str:
+    @traced()
+    def post_process_text(self, text: str, language: Optional[str] = None) -> str:
         """
-        Post-process extracted text to improve readability and accuracy
+        Post-process extracted text to improve readability and accuracy, with
+        the language's precompiled rules (see postprocessing.py)
         """
         try:
-            if not text:
-                return text
-            
-            # 1. Remove excessive whitespace
-            text = ' '.join(text.split())
-            
-            # 2. Fix common OCR errors
-            text = self.fix_common_ocr_errors(text)
-            
-            # 3. Improve punctuation
-            text = self.improve_punctuation(text)
-            
-            # 4. Fix line breaks and formatting
-            text = self.fix_line_breaks(text)
-            
-            logger.info("Applied text post-processing for better readability")
-            return text.strip()
-            
+            return postprocessing.for_language(language).process(text)
         except Exception as e:
-            logger.warning(f"Text post-processing failed: {str(e)}")
+            logger.warning("Text post-processing failed: %s", e)
             return text
     
-    def fix_common_ocr_errors(self, text: str) -> str:
-        """
-        Fix common OCR character recognition errors
-        """
-        # Common OCR error mappings
-        ocr_fixes = {
-            # Numbers and letters confusion
-            '0': 'O',  # Zero to letter O (context-dependent)
-            '1': 'l',  # One to lowercase l (context-dependent)
-            '5': 'S',  # Five to letter S (context-dependent)
-            '8': 'B',  # Eight to letter B (context-dependent)
-            
-            # Common character confusions
-            'rn': 'm',  # rn often misread as m
-            'cl': 'd',  # cl often misread as d
-            'li': 'h',  # li often misread as h
-            
-            # Punctuation fixes
-            '|': 'l',   # Pipe to lowercase l
-            '`': "'",   # Backtick to apostrophe
-            '"': '"',   # Straight quotes to curly quotes
-            '"': '"',   # Straight quotes to curly quotes
-            ''': "'",   # Straight apostrophe to curly
-            ''': "'",   # Straight apostrophe to curly
-        }
-        
-        # Apply fixes (be careful with context)
-        for error, correction in ocr_fixes.items():
-            # Only replace if it makes sense in context
-            if error in text:
-                # Simple replacement for now - could be made more sophisticated
-                text = text.replace(error, correction)
-        
-        return text
-    
-    def improve_punctuation(self, text: str) -> str:
-        """
-        Improve punctuation and spacing
-        """
-        import re
-        
-        # Fix spacing around punctuation
-        text = re.sub(r'\s+([,.!?;:])', r'\1', text)  # Remove space before punctuation
-        text = re.sub(r'([,.!?;:])([A-Za-z])', r'\1 \2', text)  # Add space after punctuation
-        
-        # Fix multiple spaces
-        text = re.sub(r'\s+', ' ', text)
-        
-        # Fix capitalization after periods
-        sentences = text.split('. ')
-        if len(sentences) > 1:
-            sentences = [sentences[0]] + [s.capitalize() for s in sentences[1:]]
-            text = '. '.join(sentences)
-        
-        return text
-    
-    def fix_line_breaks(self, text: str) -> str:
-        """
-        Fix line breaks and paragraph formatting
-        """
-        # Replace multiple newlines with single newline
-        text = re.sub(r'\n+', '\n', text)
-        
-        # Remove trailing whitespace from lines
-        lines = text.split('\n')
-        lines = [line.rstrip() for line in lines]
-        text = '\n'.join(lines)
-        
-        # Remove empty lines at the beginning and end
-        text = text.strip()
-        
-        return text
-    
-    def extract_text_with_multiple_configs(self, image_path: str, language: str = None, 
+    def extract_text_with_multiple_configs(self, image_path: str, language: str = None,
                                           preprocess: bool = True, auto_rotate: bool = True,
-                                          improve_readability: bool = False, post_process: bool = True) -> Dict[str, Any]:
+                                          improve_readability: bool = False, post_process: bool = True,
+                                          deadline: Optional[Deadline] = None) -> Dict[str, Any]:
         """
         Extract text using multiple OCR configurations and return the best result
         """
@@ -393,13 +535,14 @@ class OCRService:
                 language = self.default_language
             
             if language not in self.supported_languages:
-                logger.warning(f"Language '{language}' not in supported languages, using default")
+                logger.warning("Language '%s' not in supported languages, using default", language)
                 language = self.default_language
             
             # Preprocess image if requested
             if preprocess:
-                processed_img = self.preprocess_image(image_path, auto_rotate=auto_rotate, 
-                                                    improve_readability=improve_readability)
+                processed_img = self.preprocess_image(image_path, auto_rotate=auto_rotate,
+                                                    improve_readability=improve_readability,
+                                                    deadline=deadline)
                 if processed_img is None:
                     return {
                         "success": False,
@@ -411,49 +554,75 @@ class OCRService:
                 pil_image = Image.fromarray(processed_img)
             else:
                 pil_image = Image.open(image_path)
-            
+
             best_result = None
             best_confidence = 0
-            
+
+            # On pages that are mostly pictures or margins, recognize only the text
+            # regions first; the alternative configs only run if that finds nothing
+            regions = self._plan_text_regions(pil_image)
+
+            # Each config costs two Tesseract calls; when the budget can't cover
+            # all of them, try the most useful ones first
+            configs = self.alternative_configs
+            if deadline is not None:
+                affordable = deadline.affordable_calls(self.tesseract_call_estimate) // 2
+                if affordable < len(configs):
+                    configs = self.config_priority[:max(affordable, 1)]
+                    deadline.reduce('alternative_configs', f"{len(configs)}/{len(self.alternative_configs)} configs")
+
             # Try each configuration
-            for config in self.alternative_configs:
+            for attempt, config in enumerate(configs):
+                if attempt > 0 and deadline is not None and \
+                        deadline.affordable_calls(self.tesseract_call_estimate) < 2:
+                    if best_result is not None:
+                        deadline.reduce('alternative_configs', f"{attempt}/{len(self.alternative_configs)} configs")
+                        break
+                    if deadline.expired():
+                        deadline.skip('alternative_configs')
+                        break
+                # The first attempt is the primary recognition pass and always runs
+                floor = self.min_recognition_timeout if attempt == 0 else 0.0
                 try:
-                    # Extract text with confidence scores
-                    data = pytesseract.image_to_data(pil_image, lang=language, config=config, output_type=pytesseract.Output.DICT)
-                    
-                    # Extract text
-                    text = pytesseract.image_to_string(pil_image, lang=language, config=config)
-                    
-                    # Post-process text for better readability
-                    if post_process:
-                        text = self.post_process_text(text)
-                    
-                    # Calculate average confidence
-                    confidences = [int(conf) for conf in data['conf'] if int(conf) > 0]
-                    avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
-                    
-                    # Check if this is the best result so far
-                    if avg_confidence > best_confidence and len(text.strip()) > 0:
-                        best_confidence = avg_confidence
-                        best_result = {
-                            "text": text.strip(),
-                            "confidence": avg_confidence,
-                            "config": config,
-                            "raw_data": data
-                        }
-                        
-                        logger.info(f"Better OCR result found with config '{config}': confidence {avg_confidence:.1f}%, text length {len(text)}")
-                
+                    with span('ocr_config', config=config):
+                        # Extract text with confidence scores
+                        data, text = self._recognize(pil_image, language, config, deadline, floor,
+                                                     regions if attempt == 0 else None)
+
+                        # Calculate average confidence
+                        confidences = [int(conf) for conf in data['conf'] if int(conf) > 0]
+                        avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+
+                        # Check if this is the best result so far
+                        if avg_confidence > best_confidence and len(text.strip()) > 0:
+                            best_confidence = avg_confidence
+                            best_result = {
+                                "text": text.strip(),
+                                "confidence": avg_confidence,
+                                "config": config,
+                                "raw_data": data,
+                                "text_regions": regions if attempt == 0 else None
+                            }
+
+                            debug_sampled(logger, 'ocr_config', "Better OCR result found with config '%s': "
+                                          "confidence %.1f%%, text length %d", config, avg_confidence, len(text))
+
                 except Exception as e:
-                    logger.debug(f"OCR failed with config '{config}': {str(e)}")
+                    logger.debug("OCR failed with config '%s': %s", config, e)
                     continue
+                if attempt == 0 and regions and best_result is not None:
+                    break
             
             processing_time = time.time() - start_time
             
             if best_result:
-                logger.info(f"Best OCR result: {len(best_result['text'])} characters, confidence: {best_result['confidence']:.1f}%, config: {best_result['config']}, time: {processing_time:.3f}s")
+                # Only the winning candidate is post-processed
+                if post_process:
+                    best_result['text'] = self.post_process_text(best_result['text'], language)
+                logger.info("Best OCR result: %d characters, confidence: %.1f%%, config: %s, time: %.3fs",
+                            len(best_result['text']), best_result['confidence'], best_result['config'], processing_time)
                 
-                return {
+                result = {
                     "success": True,
                     "text": best_result['text'],
                     "confidence": best_result['confidence'],
@@ -464,8 +633,11 @@ class OCRService:
                     "raw_data": best_result['raw_data'],
                     "config_used": best_result['config']
                 }
+                if best_result['text_regions']:
+                    result['text_regions'] = [r.to_dict() for r in best_result['text_regions']]
+                return result
             else:
-                logger.warning(f"No valid OCR results found for {image_path}")
+                logger.warning("No valid OCR results found for %s", image_path)
                 return {
                     "success": False,
                     "error": "No valid text could be extracted with any configuration",
@@ -476,7 +648,7 @@ class OCRService:
                 
         except Exception as e:
             processing_time = time.time() - start_time
-            logger.error(f"OCR error for {image_path}: {str(e)}", exc_info=True)
+            logger.error("OCR error for %s: %s", image_path, e, exc_info=True)
             return {
                 "success": False,
                 "error": str(e),
@@ -485,9 +657,10 @@ class OCRService:
                 "processing_time": processing_time
             }
 
-    def extract_text(self, image_path: str, language: str = None, 
+    def extract_text(self, image_path: str, language: str = None,
                     preprocess: bool = True, config: str = None, auto_rotate: bool = True,
-                    improve_readability: bool = False, post_process: bool = True) -> Dict[str, Any]:
+                    improve_readability: bool = False, post_process: bool = True,
+                    deadline: Optional[Deadline] = None) -> Dict[str, Any]:
         """
         Extract text from image using Tesseract OCR with advanced readability improvements
         
@@ -499,15 +672,16 @@ class OCRService:
             auto_rotate: Whether to automatically detect and correct text rotation
             improve_readability: Whether to apply advanced readability enhancements
             post_process: Whether to post-process extracted text for better readability
-            
+            deadline: Optional time budget; optional stages are skipped when it runs out
+
         Returns:
             Dictionary with extracted text and metadata
         """
         # If no specific config is provided, use multiple configs for better results
         if config is None:
-            logger.info(f"Using multiple OCR configurations for better results on {os.path.basename(image_path)}")
+            logger.debug("Using multiple OCR configurations for better results on %s", image_path)
             return self.extract_text_with_multiple_configs(
-                image_path, language, preprocess, auto_rotate, improve_readability, post_process
+                image_path, language, preprocess, auto_rotate, improve_readability, post_process, deadline
             )
         
         # Use single configuration as specified
@@ -529,13 +703,14 @@ class OCRService:
                 language = self.default_language
             
             if language not in self.supported_languages:
-                logger.warning(f"Language '{language}' not in supported languages, using default")
+                logger.warning("Language '%s' not in supported languages, using default", language)
                 language = self.default_language
             
             # Preprocess image if requested
             if preprocess:
-                processed_img = self.preprocess_image(image_path, auto_rotate=auto_rotate, 
-                                                    improve_readability=improve_readability)
+                processed_img = self.preprocess_image(image_path, auto_rotate=auto_rotate,
+                                                    improve_readability=improve_readability,
+                                                    deadline=deadline)
                 if processed_img is None:
                     return {
                         "success": False,
@@ -550,25 +725,25 @@ class OCRService:
                 # Use original image
                 pil_image = Image.open(image_path)
             
-            # Extract text with confidence scores
-            data = pytesseract.image_to_data(pil_image, lang=language, config=config, output_type=pytesseract.Output.DICT)
-            
-            # Extract text
-            text = pytesseract.image_to_string(pil_image, lang=language, config=config)
-            
+            # Extract text with confidence scores, by text region on sparse pages
+            regions = self._plan_text_regions(pil_image)
+            data, text = self._recognize(pil_image, language, config, deadline, self.min_recognition_timeout,
+                                         regions)
+
             # Post-process text for better readability
             if post_process:
-                text = self.post_process_text(text)
-            
+                text = self.post_process_text(text, language)
+
             # Calculate average confidence
             confidences = [int(conf) for conf in data['conf'] if int(conf) > 0]
             avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
             
             processing_time = time.time() - start_time
             
-            logger.info(f"OCR completed for {os.path.basename(image_path)}: {len(text)} characters, confidence: {avg_confidence:.1f}%, time: {processing_time:.3f}s")
+            logger.debug("OCR completed for %s: %d characters, confidence: %.1f%%, time: %.3fs",
+                         image_path, len(text), avg_confidence, processing_time)
             
-            return {
+            result = {
                 "success": True,
                 "text": text.strip(),
                 "confidence": avg_confidence,
@@ -579,10 +754,13 @@ class OCRService:
                 "raw_data": data,
                 "config_used": config
             }
+            if regions:
+                result['text_regions'] = [r.to_dict() for r in regions]
+            return result
             
         except Exception as e:
             processing_time = time.time() - start_time
-            logger.error(f"OCR error for {image_path}: {str(e)}", exc_info=True)
+            logger.error("OCR error for %s: %s", image_path, e, exc_info=True)
             return {
                 "success": False,
                 "error": str(e),
@@ -591,9 +769,10 @@ class OCRService:
                 "processing_time": processing_time
             }
     
-    def extract_text_with_boxes(self, image_path: str, language: str = None, 
+    def extract_text_with_boxes(self, image_path: str, language: str = None,
                                preprocess: bool = True, config: str = None, auto_rotate: bool = True,
-                               improve_readability: bool = False, post_process: bool = True) -> Dict[str, Any]:
+                               improve_readability: bool = False, post_process: bool = True,
+                               deadline: Optional[Deadline] = None, box_encoding: str = 'objects') -> Dict[str, Any]:
         """
         Extract text with bounding box information and advanced readability improvements
         
@@ -605,7 +784,10 @@ class OCRService:
             auto_rotate: Whether to automatically detect and correct text rotation
             improve_readability: Whether to apply advanced readability enhancements
             post_process: Whether to post-process extracted text for better readability
-        
+            deadline: Optional time budget; optional stages are skipped when it runs out
+            box_encoding: 'objects' (one dict per box), 'columns' (parallel lists) or
+                'packed' (base64 int32 rows, see ocr_response.py)
+
         Returns:
             Dictionary with text, bounding boxes, and metadata
         """
@@ -632,8 +814,9 @@ class OCRService:
             
             # Preprocess image if requested
             if preprocess:
-                processed_img = self.preprocess_image(image_path, auto_rotate=auto_rotate, 
-                                                    improve_readability=improve_readability)
+                processed_img = self.preprocess_image(image_path, auto_rotate=auto_rotate,
+                                                    improve_readability=improve_readability,
+                                                    deadline=deadline)
                 if processed_img is None:
                     return {
                         "success": False,
@@ -646,47 +829,43 @@ class OCRService:
             else:
                 pil_image = Image.open(image_path)
             
-            # Extract text with bounding boxes
-            data = pytesseract.image_to_data(pil_image, lang=language, config=config, output_type=pytesseract.Output.DICT)
-            
-            # Extract text
-            text = pytesseract.image_to_string(pil_image, lang=language, config=config)
+            # Extract text with bounding boxes (in page coordinates, also when
+            # recognized by text region)
+            regions = self._plan_text_regions(pil_image)
+            data, text = self._recognize(pil_image, language, config, deadline, self.min_recognition_timeout,
+                                         regions)
             
             # Post-process text for better readability
             if post_process:
-                text = self.post_process_text(text)
-            
-            # Process bounding boxes
-            boxes = []
-            n_boxes = len(data['level'])
-            for i in range(n_boxes):
-                if int(data['conf'][i]) > 0:  # Only include boxes with confidence > 0
-                    boxes.append({
-                        'text': data['text'][i],
-                        'confidence': int(data['conf'][i]),
-                        'left': data['left'][i],
-                        'top': data['top'][i],
-                        'width': data['width'][i],
-                        'height': data['height'][i]
-                    })
+                text = self.post_process_text(text, language)
+            
+            # Process bounding boxes (only those with confidence > 0)
+            columns = ocr_response.box_columns(data)
+            box_count = len(columns['text'])
             
             processing_time = time.time() - start_time
             
-            logger.info(f"OCR with boxes completed for {os.path.basename(image_path)}: {len(boxes)} text regions, time: {processing_time:.3f}s")
+            logger.debug("OCR with boxes completed for %s: %d text regions, time: %.3fs",
+                         image_path, box_count, processing_time)
             
-            return {
+            result = {
                 "success": True,
                 "text": text.strip(),
-                "boxes": boxes,
+                "boxes": ocr_response.encode_boxes(columns, box_encoding),
+                "box_count": box_count,
+                "box_encoding": box_encoding,
                 "language": language,
                 "word_count": len(text.split()),
                 "character_count": len(text),
                 "processing_time": processing_time
             }
+            if regions:
+                result['text_regions'] = [r.to_dict() for r in regions]
+            return result
             
         except Exception as e:
             processing_time = time.time() - start_time
-            logger.error(f"OCR with boxes error for {image_path}: {str(e)}", exc_info=True)
+            logger.error("OCR with boxes error for %s: %s", image_path, e, exc_info=True)
             return {
                 "success": False,
                 "error": str(e),
@@ -700,7 +879,7 @@ class OCRService:
         return self.supported_languages.copy()
     
     def detect_language(self, image_path: str, preprocess: bool = True, auto_rotate: bool = True,
-                       improve_readability: bool = False) -> str:
+                       improve_readability: bool = False, deadline: Optional[Deadline] = None) -> str:
         """
         Automatically detect the language of text in an image by trying all supported languages
         and selecting the one with the best confidence score.
@@ -710,17 +889,38 @@ class OCRService:
             preprocess: Whether to preprocess image for better results
             auto_rotate: Whether to automatically detect and correct text rotation
             improve_readability: Whether to apply advanced readability enhancements
-            
+            deadline: Optional time budget; fewer languages are tried when it runs low
+
         Returns:
             Best detected language code
         """
+        with stage_timer('language_detection'):
+            return self._detect_language(image_path, preprocess, auto_rotate, improve_readability, deadline)
+
+    def _detect_language(self, image_path: str, preprocess: bool, auto_rotate: bool,
+                         improve_readability: bool, deadline: Optional[Deadline]) -> str:
         try:
-            logger.info(f"Auto-detecting language for {os.path.basename(image_path)}")
-            
+            logger.debug("Auto-detecting language for %s", image_path)
+
+            # Each language costs two Tesseract calls. Keep enough budget for
+            # the recognition pass that follows detection.
+            languages = self.supported_languages
+            if deadline is not None:
+                affordable = deadline.affordable_calls(self.tesseract_call_estimate, reserve_calls=4) // 2
+                if affordable < 2:
+                    deadline.skip('language_detection')
+                    return self.default_language
+                if affordable < len(languages):
+                    # Default language first, then the rest in configured order
+                    ordered = [self.default_language] + [l for l in languages if l != self.default_language]
+                    languages = ordered[:affordable]
+                    deadline.reduce('language_detection', f"{len(languages)}/{len(self.supported_languages)} languages")
+
             # Preprocess image once if requested
             if preprocess:
-                processed_img = self.preprocess_image(image_path, auto_rotate=auto_rotate, 
-                                                    improve_readability=improve_readability)
+                processed_img = self.preprocess_image(image_path, auto_rotate=auto_rotate,
+                                                    improve_readability=improve_readability,
+                                                    deadline=deadline)
                 if processed_img is None:
                     logger.warning("Failed to preprocess image for language detection, using original")
                     pil_image = Image.open(image_path)
@@ -734,29 +934,36 @@ class OCRService:
             best_text_length = 0
             
             # Try each supported language
-            for language in self.supported_languages:
+            for tried, language in enumerate(languages):
+                if deadline is not None and \
+                        deadline.affordable_calls(self.tesseract_call_estimate, reserve_calls=2) < 2:
+                    if tried == 0:
+                        deadline.skip('language_detection')
+                    else:
+                        deadline.reduce('language_detection', f"{tried}/{len(self.supported_languages)} languages")
+                    break
                 try:
                     # Use a simple configuration for language detection
                     config = '--oem 3 --psm 6'
-                    
+
                     # Extract text with confidence scores
-                    data = pytesseract.image_to_data(pil_image, lang=language, config=config, 
-                                                   output_type=pytesseract.Output.DICT)
+                    data = self._run_tesseract('image_to_data', pil_image, deadline, lang=language, config=config,
+                                               output_type=pytesseract.Output.DICT)
                     
                     # Calculate average confidence and text length
                     confidences = [int(conf) for conf in data['conf'] if int(conf) > 0]
                     avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
                     
                     # Extract text to check length
-                    text = pytesseract.image_to_string(pil_image, lang=language, config=config)
+                    text = self._run_tesseract('image_to_string', pil_image, deadline, lang=language, config=config)
                     text_length = len(text.strip())
                     
                     # Score based on confidence and text length
                     # Prefer languages that produce more text with good confidence
                     score = avg_confidence * (1 + text_length / 100)  # Boost score for longer text
                     
-                    logger.debug(f"Language '{language}': confidence={avg_confidence:.1f}%, "
-                               f"text_length={text_length}, score={score:.1f}")
+                    debug_sampled(logger, 'language_detection', "Language '%s': confidence=%.1f%%, "
+                                  "text_length=%d, score=%.1f", language, avg_confidence, text_length, score)
                     
                     # Update best language if this one is better
                     if score > best_confidence and text_length > 0:
@@ -765,21 +972,21 @@ class OCRService:
                         best_text_length = text_length
                         
                 except Exception as e:
-                    logger.debug(f"Language detection failed for '{language}': {str(e)}")
+                    logger.debug("Language detection failed for '%s': %s", language, e)
                     continue
             
-            logger.info(f"Auto-detected language: '{best_language}' (confidence score: {best_confidence:.1f}, "
-                       f"text length: {best_text_length})")
+            logger.info("Auto-detected language: '%s' (confidence score: %.1f, text length: %d)",
+                        best_language, best_confidence, best_text_length)
             
             return best_language
             
         except Exception as e:
-            logger.warning(f"Language auto-detection failed: {str(e)}, using default language")
+            logger.warning("Language auto-detection failed: %s, using default language", e)
             return self.default_language
 
-    def extract_text_auto_language(self, image_path: str, preprocess: bool = True, 
-                                  auto_rotate: bool = True, improve_readability: bool = False, 
-                                  post_process: bool = True) -> Dict[str, Any]:
+    def extract_text_auto_language(self, image_path: str, preprocess: bool = True,
+                                  auto_rotate: bool = True, improve_readability: bool = False,
+                                  post_process: bool = True, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
         """
         Extract text from image with automatic language detection
         
@@ -789,7 +996,9 @@ class OCRService:
             auto_rotate: Whether to automatically detect and correct text rotation
             improve_readability: Whether to apply advanced readability enhancements
             post_process: Whether to post-process extracted text for better readability
-            
+            deadline: Optional time budget; rotation sweep, language detection, alternative
+                configs and the low-quality fallback are skipped or cheapened when it runs low
+
         Returns:
             Dictionary with extracted text, detected language, and metadata
         """
@@ -805,19 +1014,24 @@ class OCRService:
                 return not result.get("success") or char_count < 20 or word_count < 3
 
             # Auto-detect language
-            detected_language = self.detect_language(image_path, preprocess, auto_rotate, improve_readability)
-            
+            detected_language = self.detect_language(image_path, preprocess, auto_rotate, improve_readability,
+                                                     deadline=deadline)
+
             # Extract text using the detected language
             result = self.extract_text(image_path, language=detected_language, preprocess=preprocess,
                                      auto_rotate=auto_rotate, improve_readability=improve_readability,
-                                     post_process=post_process)
+                                     post_process=post_process, deadline=deadline)
 
             # Safety fallback: if the auto pipeline returns abnormally short output,
             # retry with a less aggressive path that often performs better on dense documents.
-            if is_low_quality(result):
+            if is_low_quality(result) and deadline is not None and \
+                    deadline.affordable_calls(self.tesseract_call_estimate) < 2:
+                deadline.skip('low_quality_fallback')
+            elif is_low_quality(result):
                 logger.warning(
-                    f"Low-quality auto OCR output detected (chars={result.get('character_count', 0)}, "
-                    f"words={result.get('word_count', 0)}). Retrying with preprocess=False and default language."
+                    "Low-quality auto OCR output detected (chars=%s, words=%s). "
+                    "Retrying with preprocess=False and default language.",
+                    result.get('character_count', 0), result.get('word_count', 0)
                 )
                 fallback_result = self.extract_text(
                     image_path,
@@ -825,7 +1039,8 @@ class OCRService:
                     preprocess=False,
                     auto_rotate=auto_rotate,
                     improve_readability=False,
-                    post_process=post_process
+                    post_process=post_process,
+                    deadline=deadline
                 )
                 if fallback_result.get("success") and not is_low_quality(fallback_result):
                     fallback_result["detected_language"] = self.default_language
@@ -839,15 +1054,14 @@ class OCRService:
                     result["detected_language"] = detected_language
                 if "language_auto_detected" not in result:
                     result["language_auto_detected"] = True
-                logger.info(f"Text extracted using auto-detected language '{detected_language}': "
-                           f"{result.get('character_count', 0)} characters, "
-                           f"confidence: {result.get('confidence', 0):.1f}%")
+                logger.debug("Text extracted using auto-detected language '%s': %d characters, confidence: %.1f%%",
+                             detected_language, result.get('character_count', 0), result.get('confidence', 0))
             
             return result
             
         except Exception as e:
             processing_time = time.time() - start_time
-            logger.error(f"Auto-language OCR error for {image_path}: {str(e)}", exc_info=True)
+            logger.error("Auto-language OCR error for %s: %s", image_path, e, exc_info=True)
             return {
                 "success": False,
                 "error": str(e),
@@ -861,7 +1075,7 @@ class OCRService:
     def get_tesseract_info(self) -> Dict[str, Any]:
         """Get Tesseract version and configuration info"""
         try:
-            version = pytesseract.get_tesseract_version()
+            version = self.tesseract_version or pytesseract.get_tesseract_version()
             # Convert version object to string for JSON serialization
             version_str = str(version) if version else "Unknown"
             return {
@@ -0,0 +1,187 @@
+"""
+Perceptual hashing for /compare
+64-bit DCT perceptual hash (pHash) of an image and a BK-tree over Hamming
+distance, used to shortlist catalog entries before ORB matching.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Entries further than this (bits out of 64) from the query are not shortlisted
+MAX_DISTANCE = int(os.getenv('PHASH_MAX_DISTANCE', 12))
+# ORB matching runs on at most this many nearest entries before falling back
+SHORTLIST_SIZE = int(os.getenv('PHASH_SHORTLIST_SIZE', 25))
+# Built BK-trees kept for catalogs that are sent again unchanged
+INDEX_CACHE_SIZE = 4
+
+
+def compute_phash(gray: np.ndarray) -> int:
+    """
+    DCT perceptual hash: the 8x8 lowest frequencies of a 32x32 downscale,
+    one bit per coefficient above their median (DC term excluded from the median)
+    """
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    coefficients = cv2.dct(small)[:8, :8].ravel()
+    bits = coefficients > np.median(coefficients[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def to_hex(value: int) -> str:
+    return f"{value:016x}"
+
+
+def parse_hash(value: Any) -> Optional[int]:
+    """64-bit hash from a 16-digit hex string (as returned by /extract) or an int"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value if 0 <= value < 1 << 64 else None
+    if isinstance(value, str) and len(value) == 16:
+        try:
+            return int(value, 16)
+        except ValueError:
+            return None
+    return None
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """Burkhard-Keller tree: metric-space index answering 'all hashes within d bits' queries"""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value: int, item: Any):
+        self.size += 1
+        if self.root is None:
+            # node: [hash, items with that hash, {distance: child}]
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """(distance, item) for every item within max_distance, nearest first"""
+        results = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, item) for item in node[1])
+            # Triangle inequality: only children at |d - r| .. d + r can hold matches
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        results.sort(key=lambda result: result[0])
+        return results
+
+
+class PHashIndex:
+    """BK-trees for catalogs, cached by catalog content so a resent catalog is not re-indexed"""
+
+    def __init__(self, cache_size: int = INDEX_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, BKTree]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def tree_for(self, hashed: List[Tuple[int, int]]) -> BKTree:
+        """BK-tree over (position, hash) pairs of a catalog"""
+        key = hashlib.sha1(np.array(hashed, dtype=np.uint64).tobytes()).hexdigest()
+        with self._lock:
+            tree = self._cache.get(key)
+            if tree is not None:
+                self._cache.move_to_end(key)
+                return tree
+        tree = BKTree()
+        for position, value in hashed:
+            tree.add(value, position)
+        with self._lock:
+            self._cache[key] = tree
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tree
+
+    def shortlist(self, query_hash: Optional[int], entries: List[Dict[str, Any]],
+                  max_distance: int = MAX_DISTANCE, limit: int = SHORTLIST_SIZE,
+                  include_unhashed: bool = True, search: Optional[Callable] = None
+                  ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Split catalog entries into (candidates, remainder, info). Candidates are the
+        nearest hashed entries plus, with include_unhashed, every entry without a hash;
+        the remainder is only searched when the candidates do not produce a good
+        enough match.
+
+        search(query_hash, max_distance) queries a maintained BK-tree whose items
+        are (entry id, hash) instead of building one for the entries; items that no
+        longer match an entry's current hash are skipped.
+        """
+        hashed = []
+        unhashed = []
+        for position, entry in enumerate(entries):
+            value = parse_hash(entry.get('phash'))
+            if value is None:
+                unhashed.append(position)
+            else:
+                hashed.append((position, value))
+        info = {"catalog_size": len(entries), "hashed_entries": len(hashed)}
+        if query_hash is None or not hashed:
+            if not include_unhashed:
+                info["candidates"] = 0
+                return [], entries, info
+            info["candidates"] = len(entries)
+            return entries, [], info
+
+        if search is None:
+            nearest = self.tree_for(hashed).search(query_hash, max_distance)[:limit]
+        else:
+            nearest = self._nearest_by_id(search(query_hash, max_distance), entries, hashed, limit)
+        selected = [position for _, position in nearest]
+        if include_unhashed:
+            selected += unhashed
+        info.update({
+            "candidates": len(selected),
+            "nearest_distance": nearest[0][0] if nearest else None
+        })
+        chosen = set(selected)
+        candidates = [entries[position] for position in selected]
+        remainder = [entry for position, entry in enumerate(entries) if position not in chosen]
+        return candidates, remainder, info
+
+    @staticmethod
+    def _nearest_by_id(results: List[Tuple[int, Tuple[Any, int]]], entries: List[Dict[str, Any]],
+                       hashed: List[Tuple[int, int]], limit: int) -> List[Tuple[int, int]]:
+        """(distance, position) of current (id, hash) search results"""
+        current = {entries[position]['id']: (position, value) for position, value in hashed}
+        nearest = []
+        seen = set()
+        for distance, (entry_id, value) in results:
+            position, current_value = current.get(entry_id, (None, None))
+            if position is None or current_value != value or position in seen:
+                continue
+            seen.add(position)
+            nearest.append((distance, position))
+            if len(nearest) >= limit:
+                break
+        return nearest
+
+
+# Global index instance
+phash_index = PHashIndex()
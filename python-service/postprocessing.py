@@ -0,0 +1,133 @@
+"""
+OCR text post-processing
+Substitution rules are compiled once per language into a single alternation
+regex, so one linear pass over the text applies all of them: each match is
+dispatched to its rule by the name of the group that matched. Rules only fire
+in context (a digit inside a word, a period before a new sentence) instead of
+replacing every occurrence.
+"""
+
+import re
+from typing import Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Union
+
+LETTER = r'[^\W\d_]'
+# Character fixes only apply to Latin script (a Cyrillic word must not gain a Latin O)
+LATIN = r'[A-Za-zÀ-ÖØ-öø-ÿ]'
+UPPER = r'[A-ZÀ-ÖØ-Þ]'
+
+# Digits Tesseract confuses with letters: (uppercase, lowercase) reading
+DIGIT_LETTERS = {'0': ('O', 'o'), '1': ('I', 'l'), '5': ('S', 's'), '8': ('B', 'B')}
+
+# Words that end with a period without ending the sentence
+ABBREVIATIONS = {
+    'eng': {'e.g', 'i.e', 'etc', 'vs', 'Mr', 'Mrs', 'Ms', 'Dr', 'St', 'No', 'approx'},
+    'fra': {'M', 'Mme', 'Mlle', 'etc', 'p.ex', 'cf', 'env'},
+    'deu': {'z.B', 'd.h', 'bzw', 'ca', 'usw', 'Nr', 'Dr', 'vgl'},
+    'spa': {'Sr', 'Sra', 'Dr', 'etc', 'p.ej', 'aprox'},
+    'ita': {'Sig', 'Dott', 'ecc', 'es'},
+    'por': {'Sr', 'Sra', 'Dr', 'etc', 'ex'},
+}
+
+
+class Rule(NamedTuple):
+    name: str
+    # Must not contain capturing groups (use (?:...)); the engine names each rule's group
+    pattern: str
+    # Fixed text, or a function of the match
+    replacement: Union[str, Callable[[re.Match], str]]
+
+
+def _letter_for_digit(match: re.Match) -> str:
+    # Case follows the neighbouring letters: "F1LE" -> "FILE", "he1lo" -> "hello"
+    text, start, end = match.string, match.start(), match.end()
+    neighbours = text[max(start - 1, 0):start] + text[end:end + 1]
+    upper, lower = DIGIT_LETTERS[match.group()]
+    return lower if any(c.islower() for c in neighbours) else upper
+
+
+def _space_after(match: re.Match) -> str:
+    return match.group() + ' '
+
+
+def _sentence_start(abbreviations: FrozenSet[str]) -> Callable[[re.Match], str]:
+    def capitalize(match: re.Match) -> str:
+        # The word before ". ": abbreviations and initials don't end a sentence
+        before = match.string[max(match.start() - 10, 0):match.start()].rsplit(None, 1)
+        word = before[-1] if before else ''
+        if word in abbreviations or len(word) == 1:
+            return match.group()
+        return match.group().upper()
+    return capitalize
+
+
+def default_rules(language: str = 'eng', spaced_punctuation: str = '') -> List[Rule]:
+    """
+    Rules for Latin-script text. `spaced_punctuation` keeps the space OCR
+    found before those marks (French puts one before : ; ! ?).
+    """
+    closing = ''.join(c for c in ',.!?;:' if c not in spaced_punctuation)
+    abbreviations = frozenset(ABBREVIATIONS.get(language, ()))
+    return [
+        # Whitespace is a single space by the time rules run
+        Rule('space_before_punctuation', rf' (?=[{re.escape(closing)}])', ''),
+        Rule('sentence_start', rf'\. {LETTER}', _sentence_start(abbreviations)),
+        # Not in decimals, URLs ("example.com") or initialisms ("U.S.A")
+        Rule('space_after_period', rf'\.(?<!\b{LETTER}\.)(?={UPPER})', '. '),
+        Rule('space_after_punctuation', rf'[,;:!?](?={LATIN})', _space_after),
+        # A confusable digit between letters, or ending/starting a word of letters
+        Rule('digit_in_word', rf'[0158](?:(?<={LATIN}.)(?={LATIN})'
+                              rf'|(?<={LATIN}{{2}}.)(?![\w])'
+                              rf'|(?<![\w].)(?={LATIN}{{2}}))', _letter_for_digit),
+        # A pipe touching a letter is an l; table rules and separators stay
+        Rule('pipe_in_word', rf'\|(?:(?<={LATIN}.)|(?={LATIN}))', 'l'),
+        Rule('backtick', '`', "'"),
+    ]
+
+
+class PostProcessor:
+    """Compiled rule set: whitespace normalization plus one substitution pass"""
+
+    def __init__(self, rules: Iterable[Rule]):
+        self.rules = list(rules)
+        self.pattern = re.compile('|'.join(f'(?P<r{index}>{rule.pattern})'
+                                           for index, rule in enumerate(self.rules)))
+        self._dispatch = {f'r{index}': rule.replacement for index, rule in enumerate(self.rules)}
+
+    def _replace(self, match: re.Match) -> str:
+        replacement = self._dispatch[match.lastgroup]
+        return replacement if isinstance(replacement, str) else replacement(match)
+
+    def process(self, text: str) -> str:
+        if not text:
+            return text
+        # Runs of whitespace, line breaks included, become single spaces
+        text = ' '.join(text.split())
+        return self.pattern.sub(self._replace, text).strip()
+
+
+# Tesseract language -> rules; languages without an entry get the default rules
+LANGUAGE_RULES: Dict[str, List[Rule]] = {
+    'fra': default_rules('fra', spaced_punctuation=':;!?'),
+}
+
+_processors: Dict[str, PostProcessor] = {}
+
+
+def register(language: str, rules: Iterable[Rule]):
+    """Use `rules` for `language` (a Tesseract code such as 'deu')"""
+    LANGUAGE_RULES[language] = list(rules)
+    _processors.pop(language, None)
+
+
+def for_language(language: Optional[str] = None) -> PostProcessor:
+    """Compiled post-processor for a Tesseract language; 'eng+fra' uses the first one"""
+    language = (language or 'eng').split('+')[0]
+    processor = _processors.get(language)
+    if processor is None:
+        rules = LANGUAGE_RULES.get(language) or default_rules(language)
+        processor = _processors[language] = PostProcessor(rules)
+    return processor
+
+
+# Compiled at import so workers forked from the preloaded app share it
+default_postprocessor = for_language('eng')
@@ -0,0 +1,206 @@
+"""
+Preprocessing kernels for OCR
+Readability enhancement, contrast, denoise and binarization with precomputed
+lookup tables, cached CLAHE/kernels and reusable per-thread work buffers.
+Output is pixel-identical to the straightforward implementation. Pages over
+the tiling memory budget are processed in overlapping strips instead.
+"""
+
+import logging
+import math
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import tiling
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Work buffers kept per thread between requests; pages larger than this are
+# processed with temporary buffers instead
+BUFFER_POOL_BYTES = int(float(os.getenv('OCR_BUFFER_POOL_MB', 64)) * 1024 * 1024)
+
+
+class BufferPool:
+    """Named uint8 work buffers, reused while the shape matches and the pool fits its budget"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.buffers: Dict[str, np.ndarray] = {}
+
+    def get(self, name: str, shape: Tuple[int, ...]) -> np.ndarray:
+        buffer = self.buffers.get(name)
+        if buffer is not None and buffer.shape == shape:
+            return buffer
+        self.buffers.pop(name, None)
+        buffer = np.empty(shape, np.uint8)
+        if buffer.nbytes + self.nbytes() <= self.max_bytes:
+            self.buffers[name] = buffer
+        return buffer
+
+    def nbytes(self) -> int:
+        return sum(b.nbytes for b in self.buffers.values())
+
+    def clear(self):
+        self.buffers.clear()
+
+
+class Preprocessor:
+    def __init__(self, gamma: float = 1.2, clahe_clip_limit: float = 2.0,
+                 clahe_tile_grid: Tuple[int, int] = (8, 8), buffer_pool_bytes: int = BUFFER_POOL_BYTES):
+        self.clahe_clip_limit = clahe_clip_limit
+        self.clahe_tile_grid = clahe_tile_grid
+        self.buffer_pool_bytes = buffer_pool_bytes
+        # Same arithmetic as np.uint8(np.power(x / 255.0, gamma) * 255.0), done once for all 256 values
+        self.gamma_lut = np.power(np.arange(256) / 255.0, gamma) * 255.0
+        self.gamma_lut = self.gamma_lut.astype(np.uint8)
+        self.kernel_noise = np.ones((2, 2), np.uint8)
+        self.kernel_cleanup = np.ones((3, 3), np.uint8)
+        self.kernel_sharpen = np.array([[-1, -1, -1],
+                                        [-1,  9, -1],
+                                        [-1, -1, -1]], np.float32)
+        self._local = threading.local()
+
+    def _state(self):
+        """CLAHE objects are not shared between threads; each thread gets its own along with its buffers"""
+        state = self._local
+        if not hasattr(state, 'clahe'):
+            state.clahe = cv2.createCLAHE(clipLimit=self.clahe_clip_limit, tileGridSize=self.clahe_tile_grid)
+            state.buffers = BufferPool(self.buffer_pool_bytes)
+        return state
+
+    def enhance_readability(self, image: np.ndarray, dst: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Bilateral denoise, opening, gamma, sharpen blend and closing.
+        Intermediates live in two pooled buffers; the result goes to dst (or a new array).
+        """
+        buffers = self._state().buffers
+        a = buffers.get('a', image.shape)
+        b = buffers.get('b', image.shape)
+        # 1. Noise reduction with bilateral filter (preserves edges)
+        cv2.bilateralFilter(image, 9, 75, 75, dst=a)
+        # 2. Remove small noise
+        cv2.morphologyEx(a, cv2.MORPH_OPEN, self.kernel_noise, dst=b)
+        # 3. Gamma correction, in place through the lookup table
+        cv2.LUT(b, self.gamma_lut, dst=b)
+        # 4. Sharpen text edges and blend with the unsharpened image
+        cv2.filter2D(b, -1, self.kernel_sharpen, dst=a)
+        cv2.addWeighted(b, 0.7, a, 0.3, 0, dst=a)
+        # 5. Final cleanup - remove isolated pixels
+        if dst is None:
+            dst = np.empty_like(image)
+        cv2.morphologyEx(a, cv2.MORPH_CLOSE, self.kernel_cleanup, dst=dst)
+        return dst
+
+    def _filter(self, gray: np.ndarray, enhance_contrast: bool, denoise: bool, improve_readability: bool,
+                clahe) -> np.ndarray:
+        """Readability, CLAHE and median blur into pooled buffers; returns the filtered image"""
+        buffers = self._state().buffers
+        if improve_readability:
+            with span('enhance_readability'):
+                try:
+                    gray = self.enhance_readability(gray, dst=buffers.get('readable', gray.shape))
+                except cv2.error as e:
+                    logger.warning("Readability enhancement failed: %s", e)
+
+        if enhance_contrast:
+            gray = clahe.apply(gray, dst=buffers.get('a', gray.shape))
+
+        if denoise:
+            gray = cv2.medianBlur(gray, 3, dst=buffers.get('b', gray.shape))
+        return gray
+
+    def filter_and_threshold(self, gray: np.ndarray, enhance_contrast: bool = True, denoise: bool = True,
+                             improve_readability: bool = False) -> np.ndarray:
+        """
+        Readability, CLAHE, median blur and adaptive/Otsu binarization.
+        Only the returned binary image is newly allocated.
+        """
+        gray = self._filter(gray, enhance_contrast, denoise, improve_readability, self._state().clahe)
+
+        if improve_readability:
+            # Adaptive threshold handles varying lighting better
+            return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+        # Otsu's method for simple cases
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return binary
+
+    def _strip_clahe(self, tile_grid: Tuple[int, int]):
+        state = self._state()
+        if not hasattr(state, 'strip_clahe'):
+            state.strip_clahe = {}
+        cache = state.strip_clahe
+        if tile_grid not in cache:
+            cache[tile_grid] = cv2.createCLAHE(clipLimit=self.clahe_clip_limit, tileGridSize=tile_grid)
+        return cache[tile_grid]
+
+    def filter_and_threshold_strips(self, gray: np.ndarray, enhance_contrast: bool = True, denoise: bool = True,
+                                    improve_readability: bool = False, strip_rows: int = 1024,
+                                    angle: float = 0.0) -> np.ndarray:
+        """
+        Strip-wise variant of filter_and_threshold (optionally fused with rotation)
+        for pages too large to hold several full-size copies of.
+
+        Each output strip is warped from the source and filtered with enough
+        overlapping context rows that local filters match the whole-image result.
+        CLAHE keeps the whole-image tile size, and Otsu's threshold is taken over
+        the full filtered page, so output stays close to (not identical with)
+        filter_and_threshold. Memory: the input, the output and one strip.
+        """
+        if abs(angle) > 0:
+            matrix, (width, height) = rotation_matrix(gray.shape, angle)
+        else:
+            matrix, (height, width) = None, gray.shape[:2]
+        output = np.empty((height, width), np.uint8)
+
+        # Context rows: bilateral (4) + open/sharpen/close (3) + median (1) + adaptive block (5)
+        halo = 16
+        tile_rows, tile_cols = self.clahe_tile_grid[1], self.clahe_tile_grid[0]
+        clahe_tile_height = int(math.ceil(height / tile_rows))
+        if enhance_contrast:
+            # CLAHE interpolates between neighbouring tiles, so keep a full tile row around the strip
+            halo += clahe_tile_height
+            strip_rows = max(strip_rows, clahe_tile_height)
+
+        for src_start, src_end, core_start, core_end in tiling.strips(height, strip_rows, halo):
+            if matrix is not None:
+                shifted = matrix.copy()
+                shifted[1, 2] -= src_start
+                strip = cv2.warpAffine(gray, shifted, (width, src_end - src_start), borderValue=255)
+            else:
+                strip = gray[src_start:src_end]
+            grid = (tile_cols, max(1, int(round((src_end - src_start) / clahe_tile_height))))
+            filtered = self._filter(strip, enhance_contrast, denoise, improve_readability, self._strip_clahe(grid))
+            if improve_readability:
+                filtered = cv2.adaptiveThreshold(filtered, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                                 cv2.THRESH_BINARY, 11, 2)
+            output[core_start:core_end] = filtered[core_start - src_start:core_end - src_start]
+
+        if not improve_readability:
+            cv2.threshold(output, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=output)
+        return output
+
+
+def rotation_matrix(shape: Tuple[int, ...], angle: float) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Affine matrix rotating an image of `shape` by `angle` degrees onto an
+    enlarged canvas (so nothing is cropped), and the canvas (width, height)
+    """
+    height, width = shape[:2]
+    center = (width // 2, height // 2)
+    matrix = cv2.getRotationMatrix2D(center, -angle, 1.0)
+    cos_angle = abs(matrix[0, 0])
+    sin_angle = abs(matrix[0, 1])
+    new_width = int((height * sin_angle) + (width * cos_angle))
+    new_height = int((height * cos_angle) + (width * sin_angle))
+    matrix[0, 2] += (new_width / 2) - center[0]
+    matrix[1, 2] += (new_height / 2) - center[1]
+    return matrix, (new_width, new_height)
+
+
+# Global preprocessor instance
+preprocessor = Preprocessor()
@@ -0,0 +1,374 @@
+"""
+Profiler Module for the OpenCV Feature Matching / OCR Service
+On-demand profiling of a live worker, for N seconds or N requests
+
+Two modes:
+- sampling: a background thread samples the stacks of threads that are
+  serving requests (sys._current_frames) and produces collapsed stacks
+  (flamegraph.pl / speedscope input)
+- cprofile: cProfile is enabled around each request and produces pstats
+
+Work a request hands to the shared OpenCV pool (concurrency.py) is covered
+too: pool threads are sampled while they run a chunk, and during a cprofile
+session the pool runs inline on the request thread.
+
+The endpoints are only registered when PROFILER_TOKEN is set, only answer on
+the loopback interface and require the token in the X-Profiler-Token header.
+While no session is running, the request hooks cost one attribute check.
+"""
+
+import cProfile
+import hmac
+import io
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+# Functions always reported in the summary (per-function time for the OCR
+# pipeline and descriptor matching)
+FOCUS_FILES = ('ocr_service.py',)
+FOCUS_FUNCTIONS = ('match_features', 'extract_signature', 'compare')
+
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1', 'localhost')
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ':')
+
+
+class ProfilerSession:
+    """One profiling run on this worker"""
+
+    def __init__(self, mode: str, seconds: Optional[float], max_requests: Optional[int],
+                 interval: float):
+        self.mode = mode
+        self.seconds = seconds
+        self.max_requests = max_requests
+        self.interval = interval
+        self.started_at = time.time()
+        self.stopped_at: Optional[float] = None
+        self.requests_profiled = 0
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self.profile = cProfile.Profile() if mode == 'cprofile' else None
+
+    @property
+    def running(self) -> bool:
+        return self.stopped_at is None
+
+    def expired(self) -> bool:
+        if self.seconds is not None and time.time() - self.started_at >= self.seconds:
+            return True
+        return self.max_requests is not None and self.requests_profiled >= self.max_requests
+
+    def status(self) -> Dict[str, Any]:
+        end = self.stopped_at or time.time()
+        return {
+            "mode": self.mode,
+            "running": self.running,
+            "worker_pid": os.getpid(),
+            "started_at": self.started_at,
+            "duration_seconds": end - self.started_at,
+            "seconds_limit": self.seconds,
+            "requests_limit": self.max_requests,
+            "requests_profiled": self.requests_profiled,
+            "samples": self.samples if self.mode == 'sampling' else None
+        }
+
+
+class WorkerProfiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.session: Optional[ProfilerSession] = None
+        # Checked by the request hooks; False whenever no session is running
+        self.active = False
+        self._request_threads: set = set()
+        self._cprofile_lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    def start(self, mode: str = 'sampling', seconds: Optional[float] = 30.0,
+              max_requests: Optional[int] = None, interval: float = 0.005) -> ProfilerSession:
+        if mode not in ('sampling', 'cprofile'):
+            raise ValueError("mode must be 'sampling' or 'cprofile'")
+        with self.lock:
+            if self.session is not None and self.session.running:
+                raise RuntimeError("A profiling session is already running on this worker")
+            self.session = ProfilerSession(mode, seconds, max_requests, max(interval, 0.001))
+            self._stop_event.clear()
+            if mode == 'sampling':
+                self._sampler = threading.Thread(target=self._sample_loop, args=(self.session,),
+                                                 name='profiler-sampler', daemon=True)
+                self._sampler.start()
+            self.active = True
+        logger.info("Profiler started on worker %s: mode=%s, seconds=%s, requests=%s",
+                    os.getpid(), mode, seconds, max_requests)
+        return self.session
+
+    def stop(self) -> Optional[ProfilerSession]:
+        with self.lock:
+            session = self.session
+            if session is None or not session.running:
+                return session
+            self.active = False
+            self._stop_event.set()
+            session.stopped_at = time.time()
+        if self._sampler is not None and self._sampler is not threading.current_thread():
+            self._sampler.join(timeout=1.0)
+        logger.info("Profiler stopped on worker %s: %s requests, %s samples",
+                    os.getpid(), session.requests_profiled, session.samples)
+        return session
+
+    def _sample_loop(self, session: ProfilerSession):
+        own_ident = threading.get_ident()
+        while not self._stop_event.wait(session.interval):
+            if session.expired():
+                self.stop()
+                return
+            threads = self._request_threads.copy()
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is None or ident == own_ident:
+                    continue
+                stack: List[str] = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                session.stacks[';'.join(reversed(stack))] += 1
+                session.samples += 1
+
+    # Pool threads working for a request
+
+    def single_threaded(self) -> bool:
+        """True while a cprofile session runs: it only sees the request thread, so pools should run inline"""
+        session = self.session
+        return self.active and session is not None and session.mode == 'cprofile'
+
+    @contextmanager
+    def sampled_thread(self):
+        """Sample the current (pool) thread for the duration, while a sampling session runs"""
+        session = self.session
+        if not self.active or session is None or session.mode != 'sampling':
+            yield
+            return
+        ident = threading.get_ident()
+        self._request_threads.add(ident)
+        try:
+            yield
+        finally:
+            self._request_threads.discard(ident)
+
+    # Request hooks
+
+    def before_request(self):
+        session = self.session
+        if session.expired():
+            self.stop()
+            return False
+        if session.mode == 'sampling':
+            self._request_threads.add(threading.get_ident())
+            return True
+        # cProfile objects can only be active in one thread at a time
+        if not self._cprofile_lock.acquire(blocking=False):
+            return False
+        session.profile.enable()
+        return True
+
+    def after_request(self):
+        session = self.session
+        if session.mode == 'sampling':
+            self._request_threads.discard(threading.get_ident())
+        else:
+            session.profile.disable()
+            self._cprofile_lock.release()
+        session.requests_profiled += 1
+        if session.expired():
+            self.stop()
+
+    # Output
+
+    def collapsed(self) -> str:
+        session = self.session
+        if session is None or session.mode != 'sampling':
+            raise ValueError("Collapsed stacks are only available for sampling sessions")
+        return ''.join(f"{stack} {count}\n" for stack, count in session.stacks.most_common())
+
+    def pstats_bytes(self) -> bytes:
+        session = self.session
+        if session is None or session.mode != 'cprofile':
+            raise ValueError("pstats output is only available for cprofile sessions")
+        session.profile.create_stats()
+        return marshal.dumps(session.profile.stats)
+
+    def summary(self, limit: int = 30) -> Dict[str, Any]:
+        """Top functions plus the OCRService and matching functions"""
+        session = self.session
+        if session is None:
+            raise ValueError("No profiling session has been run on this worker")
+        if session.mode == 'cprofile':
+            functions = self._cprofile_functions(session)
+        else:
+            functions = self._sampling_functions(session)
+        functions.sort(key=lambda f: f['total_seconds'], reverse=True)
+        focus = [f for f in functions
+                 if f['file'] in FOCUS_FILES or f['function'] in FOCUS_FUNCTIONS]
+        return {
+            "session": session.status(),
+            "top_functions": functions[:limit],
+            "focus_functions": focus
+        }
+
+    def _cprofile_functions(self, session: ProfilerSession) -> List[Dict[str, Any]]:
+        stats = pstats.Stats(session.profile, stream=io.StringIO())
+        functions = []
+        for (filename, line, name), (cc, nc, tt, ct, _callers) in stats.stats.items():
+            functions.append({
+                "function": name,
+                "file": os.path.basename(filename),
+                "line": line,
+                "calls": nc,
+                "self_seconds": round(tt, 6),
+                "total_seconds": round(ct, 6)
+            })
+        return functions
+
+    def _sampling_functions(self, session: ProfilerSession) -> List[Dict[str, Any]]:
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for stack, count in session.stacks.items():
+            frames = stack.split(';')
+            self_counts[frames[-1]] += count
+            for label in set(frames):
+                total_counts[label] += count
+        functions = []
+        for label, total in total_counts.items():
+            name, _, location = label.partition(' (')
+            filename, _, line = location.rstrip(')').rpartition(':')
+            functions.append({
+                "function": name,
+                "file": filename,
+                "line": int(line) if line.isdigit() else None,
+                "samples": total,
+                "self_seconds": round(self_counts[label] * session.interval, 6),
+                "total_seconds": round(total * session.interval, 6)
+            })
+        return functions
+
+
+worker_profiler = WorkerProfiler()
+
+
+def init_app(app, token: Optional[str]):
+    """Register the profiler endpoints and request hooks (only when a token is configured)"""
+    from flask import g, request, jsonify, Response
+
+    if not token:
+        return
+
+    def _authorized() -> bool:
+        # Constant-time comparison: the token must not leak through response timing
+        return (request.remote_addr in LOOPBACK_ADDRESSES
+                and hmac.compare_digest(request.headers.get('X-Profiler-Token', '').encode(), token.encode()))
+
+    @app.before_request
+    def _profiler_before_request():
+        if worker_profiler.active and not request.path.startswith('/admin/profiler'):
+            g.profiler_started = worker_profiler.before_request()
+
+    @app.teardown_request
+    def _profiler_after_request(exc):
+        if g.pop('profiler_started', False):
+            worker_profiler.after_request()
+
+    def _int_or_none(value):
+        return int(value) if value not in (None, '') else None
+
+    def _float_or_none(value):
+        return float(value) if value not in (None, '') else None
+
+    @app.route('/admin/profiler/start', methods=['POST'])
+    def profiler_start():
+        """Start a profiling session on this worker"""
+        if not _authorized():
+            return jsonify({"success": False, "error": "Forbidden"}), 403
+        data = request.get_json(silent=True) or {}
+        try:
+            max_requests = _int_or_none(data.get('requests'))
+            seconds = _float_or_none(data.get('seconds'))
+            if seconds is None and max_requests is None:
+                seconds = 30.0
+            session = worker_profiler.start(
+                mode=data.get('mode', 'sampling'),
+                seconds=seconds,
+                max_requests=max_requests,
+                interval=float(data.get('interval_ms', 5)) / 1000.0
+            )
+            return jsonify({"success": True, "session": session.status()})
+        except (ValueError, TypeError) as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        except RuntimeError as e:
+            return jsonify({"success": False, "error": str(e)}), 409
+
+    @app.route('/admin/profiler/stop', methods=['POST'])
+    def profiler_stop():
+        """Stop the running profiling session on this worker"""
+        if not _authorized():
+            return jsonify({"success": False, "error": "Forbidden"}), 403
+        session = worker_profiler.stop()
+        if session is None:
+            return jsonify({"success": False, "error": "No profiling session"}), 404
+        return jsonify({"success": True, "session": session.status()})
+
+    @app.route('/admin/profiler/status', methods=['GET'])
+    def profiler_status():
+        """Status of the current or last profiling session on this worker"""
+        if not _authorized():
+            return jsonify({"success": False, "error": "Forbidden"}), 403
+        session = worker_profiler.session
+        return jsonify({"success": True, "worker_pid": os.getpid(),
+                        "session": session.status() if session else None})
+
+    @app.route('/admin/profiler/summary', methods=['GET'])
+    def profiler_summary():
+        """Per-function time of the last session (JSON)"""
+        if not _authorized():
+            return jsonify({"success": False, "error": "Forbidden"}), 403
+        try:
+            limit = int(request.args.get('limit', 30))
+            return jsonify({"success": True, **worker_profiler.summary(limit)})
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 404
+
+    @app.route('/admin/profiler/download', methods=['GET'])
+    def profiler_download():
+        """Download collapsed stacks (sampling) or a pstats file (cprofile)"""
+        if not _authorized():
+            return jsonify({"success": False, "error": "Forbidden"}), 403
+        session = worker_profiler.session
+        if session is None:
+            return jsonify({"success": False, "error": "No profiling session"}), 404
+        if session.running:
+            return jsonify({"success": False, "error": "Session still running; stop it first"}), 409
+        filename = f"profile-{os.getpid()}-{int(session.started_at)}"
+        try:
+            if session.mode == 'sampling':
+                return Response(worker_profiler.collapsed(), mimetype='text/plain',
+                                headers={"Content-Disposition": f"attachment; filename={filename}.collapsed"})
+            return Response(worker_profiler.pstats_bytes(), mimetype='application/octet-stream',
+                            headers={"Content-Disposition": f"attachment; filename={filename}.pstats"})
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+    logger.info("Profiler endpoints enabled at /admin/profiler/* (loopback only)")
@@ -0,0 +1,380 @@
+"""
+Coarse image retrieval for /compare
+Binary visual vocabulary (k-majority clustering of ORB descriptors), TF-IDF
+bag-of-visual-words encoding and an inverted-file index that shortlists
+catalog entries before ORB matching.
+
+Train a vocabulary and build an index from the command line:
+    python retrieval.py train --images /path/to/media -o vocabulary.npz
+    python retrieval.py index --vocabulary vocabulary.npz --catalog catalog.json -o index.npz
+
+--catalog takes a JSON list of {"id", "descriptors"} entries, as sent to /compare.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from compact import descriptor_array
+
+logger = logging.getLogger(__name__)
+
+# Vocabulary (.npz written by `retrieval.py train`); retrieval is disabled when unset
+VOCABULARY_PATH = os.getenv('RETRIEVAL_VOCABULARY', '')
+# Inverted index (.npz written by `retrieval.py index`), loaded at startup when present
+INDEX_PATH = os.getenv('RETRIEVAL_INDEX', '')
+# Entries with the highest TF-IDF score that are ORB-matched
+SHORTLIST_SIZE = int(os.getenv('RETRIEVAL_SHORTLIST_SIZE', 50))
+
+# Recently added entries are scored directly and merged into the inverted
+# file once there are this many of them
+MERGE_THRESHOLD = 1024
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')
+
+
+class Vocabulary:
+    """Visual words (binary ORB centroids) and their inverse document frequencies"""
+
+    def __init__(self, centers: np.ndarray, idf: np.ndarray):
+        self.centers = np.ascontiguousarray(centers, dtype=np.uint8)
+        self.idf = np.asarray(idf, dtype=np.float32)
+
+    @property
+    def size(self) -> int:
+        return len(self.centers)
+
+    def quantize(self, descriptors: np.ndarray) -> np.ndarray:
+        """Nearest visual word (Hamming distance) of every descriptor"""
+        matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+        matches = matcher.match(np.asarray(descriptors, dtype=np.uint8), self.centers)
+        words = np.empty(len(matches), np.int32)
+        for match in matches:
+            words[match.queryIdx] = match.trainIdx
+        return words
+
+    def encode(self, descriptors: Any) -> Tuple[np.ndarray, np.ndarray]:
+        """L2-normalized TF-IDF vector as (word ids, weights) of the words present"""
+        descriptors = np.asarray(descriptors, dtype=np.uint8)
+        if descriptors.size == 0:
+            return np.empty(0, np.int32), np.empty(0, np.float32)
+        counts = np.bincount(self.quantize(descriptors), minlength=self.size)
+        words = np.flatnonzero(counts).astype(np.int32)
+        weights = counts[words].astype(np.float32) / len(descriptors) * self.idf[words]
+        norm = float(np.linalg.norm(weights))
+        if norm > 0:
+            weights /= norm
+        return words, weights
+
+    def save(self, path: str):
+        np.savez(path, centers=self.centers, idf=self.idf)
+
+    @classmethod
+    def load(cls, path: str) -> 'Vocabulary':
+        with np.load(path) as data:
+            return cls(data['centers'], data['idf'])
+
+
+def train_vocabulary(descriptor_sets: List[np.ndarray], words: int = 1024, iterations: int = 10,
+                     sample: int = 200000, seed: int = 0) -> Vocabulary:
+    """
+    k-majority clustering: Hamming-distance k-means whose centroids are the
+    per-bit majority of their members. IDF comes from the training images.
+    """
+    rng = np.random.default_rng(seed)
+    descriptors = np.vstack([np.asarray(d, dtype=np.uint8) for d in descriptor_sets if len(d)])
+    if len(descriptors) > sample:
+        descriptors = descriptors[rng.choice(len(descriptors), sample, replace=False)]
+    words = min(words, len(descriptors))
+    centers = descriptors[rng.choice(len(descriptors), words, replace=False)].copy()
+    bits = np.unpackbits(descriptors, axis=1)
+
+    assignment = None
+    for iteration in range(iterations):
+        new_assignment = Vocabulary(centers, np.ones(words)).quantize(descriptors)
+        if assignment is not None and np.array_equal(new_assignment, assignment):
+            break
+        assignment = new_assignment
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=words)
+        used = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[used]
+        sums = np.add.reduceat(bits[order], starts, axis=0, dtype=np.int64)
+        centers[used] = np.packbits(sums * 2 > counts[used, None], axis=1)
+        # Empty clusters restart from a random descriptor
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centers[empty] = descriptors[rng.choice(len(descriptors), len(empty), replace=False)]
+        logger.info("Vocabulary iteration %s: %s empty clusters", iteration + 1, len(empty))
+
+    vocabulary = Vocabulary(centers, np.ones(words, np.float32))
+    document_frequency = np.zeros(words, np.int64)
+    for d in descriptor_sets:
+        if len(d):
+            document_frequency[np.unique(vocabulary.quantize(d))] += 1
+    documents = sum(1 for d in descriptor_sets if len(d))
+    vocabulary.idf = np.log((documents + 1.0) / (document_frequency + 1.0)).astype(np.float32)
+    return vocabulary
+
+
+class InvertedIndex:
+    """
+    TF-IDF inverted file over catalog entries, keyed by catalog id.
+
+    Entries live in rows: a word-major inverted file for the bulk of them and a
+    small list of recently added rows that are scored directly. Upserts and
+    deletes only touch that list and a liveness mask; the inverted file is
+    rebuilt once MERGE_THRESHOLD rows have accumulated. Queries score a
+    snapshot, so they do not wait for updates.
+    """
+
+    def __init__(self, vocabulary: Vocabulary):
+        self.vocabulary = vocabulary
+        self._lock = threading.Lock()
+        self._ids: List[Any] = []
+        self._row_of: Dict[Any, int] = {}
+        self._alive = np.zeros(0, bool)
+        self._vectors: List[Optional[Tuple[np.ndarray, np.ndarray]]] = []
+        # Inverted file over rows [0, _merged_rows): rows and weights grouped by word
+        self._merged_rows = 0
+        self._offsets = np.zeros(vocabulary.size + 1, np.int64)
+        self._posting_rows = np.zeros(0, np.int32)
+        self._posting_weights = np.zeros(0, np.float32)
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    def __contains__(self, entry_id: Any) -> bool:
+        return entry_id in self._row_of
+
+    def add(self, entry_id: Any, words: np.ndarray, weights: np.ndarray):
+        """Insert or replace an entry's vector"""
+        with self._lock:
+            self._remove(entry_id)
+            row = len(self._ids)
+            self._ids.append(entry_id)
+            self._vectors.append((np.asarray(words, np.int32), np.asarray(weights, np.float32)))
+            if row >= len(self._alive):
+                self._alive = np.concatenate([self._alive, np.zeros(max(row, 64), bool)])
+            self._alive[row] = True
+            self._row_of[entry_id] = row
+            if row + 1 - self._merged_rows >= MERGE_THRESHOLD:
+                self._merge()
+
+    def remove(self, entry_id: Any) -> bool:
+        with self._lock:
+            return self._remove(entry_id)
+
+    def _remove(self, entry_id: Any) -> bool:
+        row = self._row_of.pop(entry_id, None)
+        if row is None:
+            return False
+        self._alive[row] = False
+        self._vectors[row] = None
+        return True
+
+    def _merge(self):
+        """Rebuild the inverted file over live rows, renumbering them densely"""
+        live = [row for row in range(len(self._ids)) if self._alive[row]]
+        ids = [self._ids[row] for row in live]
+        vectors = [self._vectors[row] for row in live]
+        lengths = np.array([len(words) for words, _ in vectors], np.int64)
+        rows = np.repeat(np.arange(len(live), dtype=np.int32), lengths)
+        words = np.concatenate([w for w, _ in vectors]) if vectors else np.zeros(0, np.int32)
+        weights = np.concatenate([w for _, w in vectors]) if vectors else np.zeros(0, np.float32)
+        order = np.argsort(words, kind='stable')
+        counts = np.bincount(words, minlength=self.vocabulary.size)
+
+        self._ids = ids
+        self._vectors = vectors
+        self._row_of = {entry_id: row for row, entry_id in enumerate(ids)}
+        self._alive = np.ones(len(ids), bool)
+        self._merged_rows = len(ids)
+        self._offsets = np.concatenate(([0], np.cumsum(counts)))
+        self._posting_rows = rows[order]
+        self._posting_weights = weights[order]
+
+    def scores(self, words: np.ndarray, weights: np.ndarray) -> Tuple[Dict[Any, int], np.ndarray]:
+        """Cosine similarity of the query vector to every row; returns (row_of, scores)"""
+        with self._lock:
+            # add/remove grow and flip _alive in place: copy the rows that exist now
+            n = len(self._ids)
+            row_of, alive = self._row_of, self._alive[:n].copy()
+            merged_rows, offsets = self._merged_rows, self._offsets
+            posting_rows, posting_weights = self._posting_rows, self._posting_weights
+            recent = list(enumerate(self._vectors[merged_rows:n], merged_rows))
+
+        scores = np.zeros(n, np.float32)
+        words = np.asarray(words, np.int64)
+        starts, ends = offsets[words], offsets[words + 1]
+        lengths = ends - starts
+        total = int(lengths.sum())
+        if total:
+            # Positions of every posting of every query word, without a Python loop
+            positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+            contributions = posting_weights[positions] * np.repeat(np.asarray(weights, np.float32), lengths)
+            scores[:merged_rows] = np.bincount(posting_rows[positions], weights=contributions,
+                                               minlength=merged_rows)[:merged_rows]
+        if recent:
+            query = np.zeros(self.vocabulary.size, np.float32)
+            query[words] = weights
+            for row, vector in recent:
+                if vector is not None:
+                    scores[row] = float(query[vector[0]].dot(vector[1]))
+        scores[~alive] = 0.0
+        return row_of, scores
+
+    def shortlist(self, words: np.ndarray, weights: np.ndarray, entries: List[Dict[str, Any]],
+                  limit: int = SHORTLIST_SIZE) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Split catalog entries into (candidates, remainder, info): the `limit` indexed
+        entries scoring highest against the query, plus every entry the index does
+        not know. The remainder holds the other indexed entries.
+        """
+        row_of, scores = self.scores(words, weights)
+        indexed = []
+        unindexed = []
+        for position, entry in enumerate(entries):
+            row = row_of.get(entry.get('id'))
+            # row_of is live: entries added after the scores were taken count as unindexed
+            if row is None or row >= len(scores):
+                unindexed.append(position)
+            else:
+                indexed.append((position, row))
+        info = {"indexed_entries": len(indexed)}
+        if not indexed:
+            info["candidates"] = len(unindexed)
+            return entries, [], info
+
+        entry_scores = scores[[row for _, row in indexed]]
+        top = np.argsort(-entry_scores, kind='stable')[:limit]
+        selected = {indexed[i][0] for i in top}
+        info.update({
+            "candidates": len(top) + len(unindexed),
+            "top_score": round(float(entry_scores[top[0]]), 4)
+        })
+        candidates = [entries[indexed[i][0]] for i in top] + [entries[p] for p in unindexed]
+        remainder = [entries[position] for position, _ in indexed if position not in selected]
+        return candidates, remainder, info
+
+    def save(self, path: str):
+        with self._lock:
+            self._merge()
+            np.savez(path, ids=np.array(json.dumps(self._ids)), offsets=self._offsets,
+                     rows=self._posting_rows, weights=self._posting_weights,
+                     words=np.int32(self.vocabulary.size))
+
+    @classmethod
+    def load(cls, path: str, vocabulary: Vocabulary) -> 'InvertedIndex':
+        index = cls(vocabulary)
+        with np.load(path) as data:
+            if int(data['words']) != vocabulary.size:
+                raise ValueError(f"Index {path} was built for a {int(data['words'])}-word vocabulary, "
+                                 f"not {vocabulary.size}")
+            ids = json.loads(str(data['ids']))
+            offsets, rows, weights = data['offsets'], data['rows'], data['weights']
+        # Per-row vectors back from the word-major postings
+        words = np.repeat(np.arange(vocabulary.size, dtype=np.int32), np.diff(offsets))
+        order = np.argsort(rows, kind='stable')
+        bounds = np.searchsorted(rows[order], np.arange(len(ids) + 1))
+        index._ids = ids
+        index._vectors = [(words[order[bounds[r]:bounds[r + 1]]], weights[order[bounds[r]:bounds[r + 1]]])
+                          for r in range(len(ids))]
+        index._row_of = {entry_id: row for row, entry_id in enumerate(ids)}
+        index._alive = np.ones(len(ids), bool)
+        index._merged_rows = len(ids)
+        index._offsets, index._posting_rows, index._posting_weights = offsets, rows, weights
+        return index
+
+
+def load_index(vocabulary_path: str = VOCABULARY_PATH, index_path: str = INDEX_PATH) -> Optional[InvertedIndex]:
+    """Index configured by the environment, or None when retrieval is disabled"""
+    if not vocabulary_path:
+        return None
+    try:
+        vocabulary = Vocabulary.load(vocabulary_path)
+        if index_path and os.path.exists(index_path):
+            index = InvertedIndex.load(index_path, vocabulary)
+        else:
+            index = InvertedIndex(vocabulary)
+        logger.info("Retrieval index loaded: %s words, %s entries", vocabulary.size, len(index))
+        return index
+    except Exception as e:
+        logger.error("Could not load retrieval index: %s", e)
+        return None
+
+
+def _image_descriptors(directory: str, nfeatures: int) -> Iterable[Tuple[str, np.ndarray]]:
+    orb = cv2.ORB_create(nfeatures=nfeatures)
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        img = cv2.imread(os.path.join(directory, name), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            continue
+        _, descriptors = orb.detectAndCompute(img, None)
+        if descriptors is not None:
+            yield name, descriptors
+
+
+def _catalog_descriptors(path: str) -> Iterable[Tuple[Any, np.ndarray]]:
+    with open(path) as f:
+        for entry in json.load(f):
+            if entry.get('descriptors'):
+                yield entry['id'], descriptor_array(entry['descriptors'])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name in ('train', 'index'):
+        command = commands.add_parser(name)
+        source = command.add_mutually_exclusive_group(required=True)
+        source.add_argument('--images', help='Directory of images (ids are file names)')
+        source.add_argument('--catalog', help='JSON list of {"id", "descriptors"} entries')
+        command.add_argument('--orb-features', type=int, default=int(os.getenv('ORB_FEATURES', 500)))
+        command.add_argument('-o', '--output', required=True)
+    commands.choices['train'].add_argument('--words', type=int, default=1024, help='Vocabulary size')
+    commands.choices['train'].add_argument('--iterations', type=int, default=10)
+    commands.choices['train'].add_argument('--sample', type=int, default=200000,
+                                           help='Descriptors sampled for clustering')
+    commands.choices['train'].add_argument('--seed', type=int, default=0)
+    commands.choices['index'].add_argument('--vocabulary', required=True)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.images:
+        entries = _image_descriptors(args.images, args.orb_features)
+    else:
+        entries = _catalog_descriptors(args.catalog)
+
+    if args.command == 'train':
+        descriptor_sets = [descriptors for _, descriptors in entries]
+        if not descriptor_sets:
+            logger.error("No descriptors to train on")
+            return 1
+        vocabulary = train_vocabulary(descriptor_sets, args.words, args.iterations, args.sample, args.seed)
+        vocabulary.save(args.output)
+        logger.info("Vocabulary of %s words from %s images written to %s",
+                    vocabulary.size, len(descriptor_sets), args.output)
+    else:
+        index = InvertedIndex(Vocabulary.load(args.vocabulary))
+        for entry_id, descriptors in entries:
+            index.add(entry_id, *index.vocabulary.encode(descriptors))
+        index.save(args.output)
+        logger.info("Index of %s entries written to %s", len(index), args.output)
+    return 0
+
+
+# Global index instance (None unless RETRIEVAL_VOCABULARY is set)
+retrieval_index = load_index()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,272 @@
+"""
+Request coalescing
+Identical jobs that overlap (same image content, same options) run once: the
+first request computes while the others wait for it and share its result.
+Coordination goes through a lock file per job in a local directory, so it
+works across gunicorn workers as well as threads. A follower marks the lock
+file when it starts waiting; only then does the leader write its result next
+to the lock before releasing it, so a job nobody waits for costs no disk
+write. A follower waits at most until its own deadline, then reads that
+result instead of recomputing. A leader that fails (or a follower that
+started waiting just as the leader finished) leaves no result, and the next
+waiter computes it itself.
+
+Images are keyed by a SHA-256 of their content, so the same file uploaded to
+two temporary paths (admin UI and a background job) still coalesces. Digests
+are memoized per process by path, size and mtime.
+
+Results are stored as JSON with arrays kept beside it in an .npz container
+(loaded with allow_pickle=False), so nothing read back can run code. Results
+that don't fit that form (other types, non-string keys) are not shared.
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional, Tuple
+
+import numpy as np
+
+from filesystem import private_directory
+from metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+SINGLEFLIGHT_ENABLED = os.getenv('SINGLEFLIGHT', 'true').lower() == 'true'
+SINGLEFLIGHT_DIR = os.getenv('SINGLEFLIGHT_DIR', os.path.join(tempfile.gettempdir(), 'archivart-singleflight'))
+# Longest a follower waits for the leader before computing on its own (seconds); half the
+# request timeout, so a follower that gives up still has time to compute before the worker timeout
+SINGLEFLIGHT_WAIT = float(os.getenv('SINGLEFLIGHT_WAIT', float(os.getenv('REQUEST_TIMEOUT', 30)) / 2))
+# Result files and unlocked lock files idle this long are removed (seconds)
+FILE_TTL = 120.0
+CLEANUP_INTERVAL = 60.0
+# Digests remembered per process
+DIGEST_CACHE_SIZE = 256
+# Result files older than the wait start by more than this are from an earlier job (mtime granularity)
+MTIME_SLACK = 0.05
+# Stands in for an array in the JSON part of a result: {"__array__": index}
+ARRAY_MARKER = '__array__'
+
+
+def _file_fingerprint(path: str) -> Tuple[str, int, int, int]:
+    stat = os.stat(path)
+    return os.path.realpath(path), stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _to_json(value: Any, arrays: List[np.ndarray]) -> Any:
+    """JSON-compatible copy of a result, arrays moved to `arrays`; TypeError when it can't be shared"""
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            raise TypeError("object arrays are not shared")
+        arrays.append(value)
+        return {ARRAY_MARKER: len(arrays) - 1}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        if ARRAY_MARKER in value or not all(isinstance(key, str) for key in value):
+            raise TypeError("only string-keyed dicts are shared")
+        return {key: _to_json(item, arrays) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item, arrays) for item in value]
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    raise TypeError(f"{type(value).__name__} results are not shared")
+
+
+def _from_json(value: Any, arrays: List[np.ndarray]) -> Any:
+    if isinstance(value, dict):
+        if set(value) == {ARRAY_MARKER}:
+            return arrays[value[ARRAY_MARKER]]
+        return {key: _from_json(item, arrays) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_from_json(item, arrays) for item in value]
+    return value
+
+
+class SingleFlight:
+    """Runs each distinct (kind, content, options) job once among overlapping requests"""
+
+    def __init__(self, directory: str = SINGLEFLIGHT_DIR, wait: float = SINGLEFLIGHT_WAIT):
+        self.directory = directory
+        self.wait = wait
+        self._digests: 'OrderedDict[Tuple, str]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+        # Results read from here are trusted: refuse a directory another user could write to
+        private_directory(directory)
+
+    def content_digest(self, path: str) -> str:
+        fingerprint = _file_fingerprint(path)
+        with self._lock:
+            digest = self._digests.get(fingerprint)
+            if digest is not None:
+                self._digests.move_to_end(fingerprint)
+                return digest
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with self._lock:
+            self._digests[fingerprint] = digest
+            while len(self._digests) > DIGEST_CACHE_SIZE:
+                self._digests.popitem(last=False)
+        return digest
+
+    def job_key(self, kind: str, image_path: str, options: Any) -> Optional[str]:
+        try:
+            digest = self.content_digest(image_path)
+        except (OSError, TypeError):
+            # Missing or unreadable: the computation reports it, nothing to share
+            return None
+        encoded = json.dumps(options, sort_keys=True, default=str)
+        return hashlib.sha256(f"{kind}\0{digest}\0{encoded}".encode('utf-8')).hexdigest()
+
+    def _acquire(self, fd: int, give_up: float) -> bool:
+        """Wait for the job lock; False when the leader is still running at give_up (monotonic)"""
+        delay = 0.005
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= give_up:
+                    return False
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+
+    def _read_result(self, path: str, since: float) -> Optional[Tuple[Any]]:
+        try:
+            if os.stat(path).st_mtime < since - MTIME_SLACK:
+                return None
+            with np.load(path, allow_pickle=False) as stored:
+                arrays = [stored[f"a{index}"] for index in range(len(stored.files) - 1)]
+                result = json.loads(bytes(stored['result']).decode('utf-8'))
+            return (_from_json(result, arrays),)
+        except (OSError, EOFError, ValueError, KeyError, IndexError, zipfile.BadZipFile):
+            return None
+
+    def _write_result(self, path: str, result: Any):
+        temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            arrays: List[np.ndarray] = []
+            encoded = json.dumps(_to_json(result, arrays)).encode('utf-8')
+            with open(temporary, 'wb') as f:
+                np.savez(f, result=np.frombuffer(encoded, dtype=np.uint8),
+                         **{f"a{index}": array for index, array in enumerate(arrays)})
+            os.replace(temporary, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("Could not share result %s: %s", os.path.basename(path), e)
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _current(fd: int, path: str) -> bool:
+        """False when cleanup removed the lock file before we locked it"""
+        try:
+            return os.stat(path).st_ino == os.fstat(fd).st_ino
+        except FileNotFoundError:
+            return False
+
+    def run(self, kind: str, image_path: str, options: Any, compute: Callable[[], Any],
+            wait: Optional[float] = None) -> Any:
+        """
+        compute(), or the result of an identical job already in progress,
+        waiting for it at most `wait` seconds (and never longer than self.wait)
+        """
+        key = self.job_key(kind, image_path, options)
+        if key is None:
+            return compute()
+        wait = self.wait if wait is None else max(0.0, min(wait, self.wait))
+        give_up = time.monotonic() + wait
+        base = os.path.join(self.directory, key)
+        try:
+            while True:
+                fd = os.open(base + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        wait_start = time.time()
+                        # Asks the leader to share its result
+                        os.pwrite(fd, b'w', 0)
+                        if not self._acquire(fd, give_up):
+                            logger.warning("Gave up waiting for %s job %s after %.1fs, computing",
+                                           kind, key[:12], wait)
+                            record_cache('singleflight', False)
+                            return compute()
+                        shared = self._read_result(base + '.result', wait_start)
+                        if shared is not None:
+                            record_cache('singleflight', True)
+                            return shared[0]
+                    if not self._current(fd, base + '.lock'):
+                        # Another request may already lead on the file that replaced it
+                        continue
+                    record_cache('singleflight', False)
+                    # Keeps the lock file's mtime fresh while this job runs
+                    os.utime(fd)
+                    result = compute()
+                    if os.fstat(fd).st_size:
+                        # Waiters read the result once closing the lock file releases it
+                        self._write_result(base + '.result', result)
+                        os.ftruncate(fd, 0)
+                    return result
+                finally:
+                    os.close(fd)
+        finally:
+            self.cleanup()
+
+    def cleanup(self, force: bool = False):
+        now = time.time()
+        if not force and now - self._last_cleanup < CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = now
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if now - entry.stat().st_mtime <= FILE_TTL:
+                        continue
+                    if not entry.name.endswith('.lock'):
+                        os.unlink(entry.path)
+                        continue
+                    fd = os.open(entry.path, os.O_RDWR)
+                    try:
+                        # A job running longer than FILE_TTL still holds its lock: leave it
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        os.unlink(entry.path)
+                    finally:
+                        os.close(fd)
+                except (FileNotFoundError, BlockingIOError):
+                    pass
+
+
+def load_single_flight() -> Optional[SingleFlight]:
+    if not SINGLEFLIGHT_ENABLED:
+        return None
+    try:
+        return SingleFlight()
+    except OSError as e:
+        logger.error("Request coalescing disabled, %s is not usable: %s", SINGLEFLIGHT_DIR, e)
+        return None
+
+
+# Global coalescer (None when SINGLEFLIGHT=false)
+single_flight = load_single_flight()
+
+
+def coalesce(kind: str, image_path: str, options: Any, compute: Callable[[], Any],
+             wait: Optional[float] = None) -> Any:
+    """single_flight.run(), or compute() when coalescing is disabled"""
+    if single_flight is None:
+        return compute()
+    return single_flight.run(kind, image_path, options, compute, wait)
@@ -0,0 +1,162 @@
+"""
+Worker start-up
+Tesseract is probed once and the result cached in a file keyed by the binary
+(path, size, mtime) and its tessdata directory, so a restarted master or a
+worker importing the app itself doesn't spawn `tesseract --version` and
+`--list-langs` again. Per-process engines (OpenCV's thread pool and ORB
+buffers, preprocessing kernels, the catalog journal) are warmed in gunicorn's
+post_fork hook, and each worker records the time from fork to ready and to
+its first served request. Imports aren't deferred: with preload_app the
+master loads the app with OpenCV, NumPy and pytesseract before forking, and
+only psutil (used by the stats endpoints) is imported on first use.
+"""
+
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from filesystem import private_directory
+from metrics import record_worker_startup
+
+logger = logging.getLogger(__name__)
+
+# Probe results, reused while the tesseract binary and tessdata directory are unchanged; the
+# directory holding the file must be private to the service user (see filesystem.private_directory)
+PROBE_CACHE_FILE = os.getenv('TESSERACT_PROBE_CACHE',
+                             os.path.join(tempfile.gettempdir(), 'archivart-startup', 'tesseract-probe.json'))
+PROBE_TIMEOUT = 10
+
+# This process's start-up timeline (perf_counter seconds; None until reached)
+_timeline: Dict[str, Optional[float]] = {"forked": None, "ready": None, "first_request": None}
+_phases: Dict[str, float] = {}
+
+
+def _fingerprint(binary: str, tessdata: Optional[str]) -> Dict[str, Any]:
+    stat = os.stat(binary)
+    fingerprint = {"binary": binary, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                   "tessdata_prefix": os.getenv('TESSDATA_PREFIX', ''), "tessdata": tessdata}
+    # Installing or removing a language pack changes the directory's mtime
+    if tessdata and os.path.isdir(tessdata):
+        fingerprint["tessdata_mtime_ns"] = os.stat(tessdata).st_mtime_ns
+    return fingerprint
+
+
+def _run_probe(binary: str) -> Dict[str, Any]:
+    version = subprocess.run([binary, '--version'], capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    output = (version.stdout or version.stderr).strip()
+    match = re.search(r'tesseract\s+v?(\S+)', output)
+    listing = subprocess.run([binary, '--list-langs'], capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    lines = (listing.stdout or listing.stderr).strip().splitlines()
+    # 'List of available languages in "/usr/share/tesseract-ocr/5/tessdata/" (3):' (older: no path)
+    header = re.search(r'"(.+?)"', lines[0]) if lines else None
+    return {
+        "version": match.group(1) if match else output.split('\n')[0],
+        "languages": [line.strip() for line in lines[1:] if line.strip()],
+        "tessdata": header.group(1).rstrip('/') if header else None
+    }
+
+
+def probe_tesseract(tesseract_cmd: str = 'tesseract') -> Dict[str, Any]:
+    """
+    {"available", "version", "languages"} of the Tesseract install, from the
+    probe cache when its fingerprint still matches
+    """
+    binary = shutil.which(tesseract_cmd)
+    if binary is None:
+        return {"available": False, "version": None, "languages": [],
+                "error": f"{tesseract_cmd} is not installed or it's not in your PATH"}
+    binary = os.path.realpath(binary)
+    try:
+        # Anyone who can write the cache decides what /info reports, so only a private directory is used
+        private_directory(os.path.dirname(PROBE_CACHE_FILE))
+        cacheable = True
+    except OSError as e:
+        logger.warning("Not caching the Tesseract probe: %s", e)
+        cacheable = False
+    if cacheable:
+        try:
+            with open(PROBE_CACHE_FILE, encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('fingerprint') == _fingerprint(binary, cached['probe'].get('tessdata')):
+                return dict(cached['probe'], available=True)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    start = time.perf_counter()
+    try:
+        probe = _run_probe(binary)
+    except (OSError, subprocess.SubprocessError) as e:
+        return {"available": False, "version": None, "languages": [], "error": str(e)}
+    logger.info("Tesseract probed in %.3fs", time.perf_counter() - start)
+    if cacheable:
+        _write_cache({"fingerprint": _fingerprint(binary, probe['tessdata']), "probe": probe})
+    return dict(probe, available=True)
+
+
+def _write_cache(cached: Dict[str, Any]):
+    temporary = f"{PROBE_CACHE_FILE}.{uuid.uuid4().hex}.tmp"
+    try:
+        # 'x': never follow or reuse a file that's already there
+        with open(temporary, 'x', encoding='utf-8') as f:
+            json.dump(cached, f)
+        os.replace(temporary, PROBE_CACHE_FILE)
+    except OSError as e:
+        logger.warning("Could not write the Tesseract probe cache %s: %s", PROBE_CACHE_FILE, e)
+        try:
+            os.unlink(temporary)
+        except OSError:
+            pass
+
+
+def worker_forked():
+    """Called first thing in gunicorn's post_fork hook"""
+    _timeline.update(forked=time.perf_counter(), ready=None, first_request=None)
+    _phases.clear()
+
+
+def warm(steps: Dict[str, Callable[[], Any]]):
+    """Run warm-up steps, timing each; a failing step is logged and skipped"""
+    start = time.perf_counter()
+    for name, step in steps.items():
+        step_start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.warning("Warm-up step %s failed: %s", name, e)
+        _phases[f"warm_{name}"] = time.perf_counter() - step_start
+    _record('warm', time.perf_counter() - start)
+
+
+def worker_ready():
+    """Called from post_worker_init, right before the worker starts accepting"""
+    if _timeline['forked'] is not None:
+        _timeline['ready'] = time.perf_counter()
+        _record('ready', _timeline['ready'] - _timeline['forked'])
+
+
+def _record(phase: str, seconds: float):
+    _phases[phase] = seconds
+    record_worker_startup(phase, seconds)
+
+
+def init_app(app):
+    """Record the fork-to-first-served-request time of each worker"""
+
+    @app.after_request
+    def _startup_first_request(response):
+        if _timeline['forked'] is not None and _timeline['first_request'] is None:
+            _timeline['first_request'] = time.perf_counter()
+            _record('first_request', _timeline['first_request'] - _timeline['forked'])
+        return response
+
+
+def stats() -> Dict[str, float]:
+    """This worker's start-up phases in seconds (warm-up steps, ready, first_request)"""
+    return {phase: round(seconds, 4) for phase, seconds in _phases.items()}
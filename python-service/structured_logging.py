@@ -0,0 +1,209 @@
+"""
+Structured logging
+Log records are handed to a bounded queue on the calling thread and formatted
+and written by a background listener, so the request path never waits on the
+log file or stdout. Messages are formatted lazily (pass %-style arguments, not
+f-strings) and come out as one JSON object per line carrying the request id
+(X-Request-ID, or generated per request). When the queue is full, records are
+dropped and counted rather than blocking the request.
+
+Hot loops (OCR configurations, rotations, languages) log through
+debug_sampled(), which costs one level check unless DEBUG is on and then
+keeps one record in LOG_SAMPLE_EVERY per key.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+# json (one object per line) or text
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Empty: stdout only
+LOG_FILE = os.getenv('LOG_FILE', 'opencv_service.log')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+LOG_SAMPLE_EVERY = max(1, int(os.getenv('LOG_SAMPLE_EVERY', 20)))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+
+_request_id: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
+
+# LogRecord attributes; anything else on a record came from extra= and is emitted as a field
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'request_id'}
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, msg, request_id, pid, extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process
+        }
+        if getattr(record, 'request_id', None):
+            entry["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _RequestIdDefault(logging.Filter):
+    """Text formats reference %(request_id)s; records from other paths lack it"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, 'request_id', None) is None:
+            record.request_id = '-'
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records without formatting them; the request id is captured here,
+    on the logging thread. A full queue drops the record instead of blocking.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = _request_id.get()
+        if record.exc_info:
+            # Render the traceback now so the record doesn't keep frames (and their locals) alive
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _LogPipeline:
+    def __init__(self):
+        self.handler: Optional[NonBlockingQueueHandler] = None
+        self.listener: Optional[logging.handlers.QueueListener] = None
+        self.outputs: List[logging.Handler] = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+        self.listener = logging.handlers.QueueListener(self.handler.queue, *self.outputs,
+                                                       respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        with self.lock:
+            if self.listener is not None:
+                # Writes what is still queued, then joins the writer thread
+                self.listener.stop()
+                self.listener = None
+
+    def after_fork(self):
+        # The writer thread doesn't survive fork and the inherited queue's lock may be held
+        self.listener = None
+        self.lock = threading.Lock()
+        self.start()
+
+
+_pipeline = _LogPipeline()
+
+
+def configure(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT, log_file: str = LOG_FILE):
+    """Route the root logger through the queue to stdout (and log_file)"""
+    if _pipeline.handler is not None:
+        return
+    formatter = JSONFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT)
+    outputs: List[logging.Handler] = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        outputs.append(logging.FileHandler(log_file))
+    for output in outputs:
+        output.setFormatter(formatter)
+        if log_format != 'json':
+            output.addFilter(_RequestIdDefault())
+    _pipeline.outputs = outputs
+    _pipeline.handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _pipeline.start()
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(_pipeline.handler)
+    atexit.register(_pipeline.stop)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_pipeline.after_fork)
+
+
+_sample_counts: Dict[str, int] = {}
+# Hot loops log from request threads and the shared OpenCV pool at once
+_sample_lock = threading.Lock()
+
+
+def debug_sampled(logger: logging.Logger, key: str, msg: str, *args: Any):
+    """DEBUG record for a hot loop, keeping one in LOG_SAMPLE_EVERY per key"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    with _sample_lock:
+        count = _sample_counts.get(key, 0)
+        _sample_counts[key] = count + 1
+    if count % LOG_SAMPLE_EVERY == 0:
+        logger.debug(msg, *args, extra={"sampled": LOG_SAMPLE_EVERY} if LOG_SAMPLE_EVERY > 1 else None)
+
+
+def stats() -> Dict[str, Any]:
+    handler = _pipeline.handler
+    return {
+        "format": LOG_FORMAT,
+        "queued": handler.queue.qsize() if handler else 0,
+        "dropped": handler.dropped if handler else 0
+    }
+
+
+def init_app(app):
+    """Give every request an id (X-Request-ID or generated), logged with each record and echoed back"""
+    from flask import g, request
+
+    @app.before_request
+    def _logging_start_request():
+        request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+        g.request_id_token = _request_id.set(request_id[:64])
+
+    @app.after_request
+    def _logging_finish_request(response):
+        request_id = _request_id.get()
+        if request_id:
+            response.headers['X-Request-ID'] = request_id
+        return response
+
+    @app.teardown_request
+    def _logging_end_request(exc):
+        token = g.pop('request_id_token', None)
+        if token is not None:
+            try:
+                _request_id.reset(token)
+            except ValueError:
+                pass
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from catalog import Catalog
+
+DESCRIPTORS = np.random.default_rng(0).integers(0, 256, (20, 32), dtype=np.uint8).tolist()
+
+
+def entry(entry_id, version):
+    return {"id": entry_id, "version": version, "descriptors": DESCRIPTORS}
+
+
+@pytest.fixture(params=['memory', 'journal'])
+def catalogs(request, tmp_path):
+    """A catalog to write to and one to read the feed from (another worker, when journaled)"""
+    if request.param == 'memory':
+        catalog = Catalog()
+        return catalog, catalog
+    journal = str(tmp_path / 'journal.jsonl')
+    return Catalog(journal), Catalog(journal)
+
+
+def read_feed(catalog, since=0, limit=1):
+    ids = []
+    while True:
+        page = catalog.changes(since, limit)
+        ids.extend(change['id'] for change in page['changes'])
+        since = page['next_since']
+        if not page['has_more']:
+            return ids, since
+
+
+def test_change_after_a_higher_version_is_not_lost(catalogs):
+    writer, reader = catalogs
+    writer.upsert([entry('a', 7)])
+    cursor = reader.changes()['next_since']
+    writer.upsert([entry('b', 1)])
+
+    page = reader.changes(since=cursor)
+    assert [change['id'] for change in page['changes']] == ['b']
+    assert page['changes'][0]['version'] == 1
+
+
+def test_paging_does_not_skip_entries_with_the_same_version(catalogs):
+    writer, reader = catalogs
+    writer.upsert([entry('b', 1)])
+    writer.upsert([entry('c', 1), entry('d', 1)])
+    writer.upsert([entry('a', 7)])
+    writer.delete([{"id": 'c', "version": 2}])
+
+    ids, cursor = read_feed(reader, limit=1)
+    assert ids == ['b', 'd', 'a', 'c']
+    assert reader.changes(since=cursor)['changes'] == []
+
+
+def test_ignored_versions_are_not_changes(catalogs):
+    writer, reader = catalogs
+    writer.upsert([entry('a', 3)])
+    cursor = reader.changes()['next_since']
+    assert writer.upsert([entry('a', 2)]) == {"applied": 0, "ignored": 1}
+    assert reader.changes(since=cursor)['changes'] == []
+
+
+def test_sequence_survives_compaction(tmp_path):
+    journal = str(tmp_path / 'journal.jsonl')
+    writer = Catalog(journal)
+    writer.upsert([entry('a', 1), entry('b', 1)])
+    writer.upsert([entry('a', 2)])
+    before = writer.changes()
+    writer.compact_journal()
+
+    assert Catalog(journal).changes() == before
+
+
+def test_journal_is_compacted_as_it_grows(tmp_path, monkeypatch):
+    monkeypatch.setattr('catalog.JOURNAL_COMPACT_RECORDS', 5)
+    journal = str(tmp_path / 'journal.jsonl')
+    first, second = Catalog(journal), Catalog(journal)
+    for version in range(1, 41):
+        (first if version % 2 else second).upsert([entry('a', version), entry(f"id{version % 3}", version)])
+
+    with open(journal) as f:
+        assert len(f.readlines()) <= 2 * 4 + 5
+    # Appends that followed a compaction by the other catalog went to the new file
+    reader = Catalog(journal)
+    assert {e['id']: e['version'] for e in reader.entries()} == {'a': 40, 'id0': 39, 'id1': 40, 'id2': 38}
+    assert reader.changes() == first.changes() == second.changes()
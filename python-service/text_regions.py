@@ -0,0 +1,199 @@
+"""
+Text region detection for OCR
+Finds text lines and blocks on a downscaled page (morphological gradient plus
+connected components) so Tesseract only sees the parts of the page with text,
+each with a page segmentation mode that fits it.
+"""
+
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# off: always recognize the whole page; on: always recognize by region;
+# auto: by region when text covers a small part of the page (photos, margins)
+MODE = os.getenv('OCR_TEXT_REGIONS', 'auto').lower()
+# auto mode falls back to the whole page above this text coverage / region count,
+# where one Tesseract run is cheaper than many small ones
+AUTO_MAX_COVERAGE = float(os.getenv('OCR_TEXT_REGIONS_MAX_COVERAGE', 0.5))
+AUTO_MAX_REGIONS = int(os.getenv('OCR_TEXT_REGIONS_MAX_REGIONS', 12))
+
+# Detection runs on a copy no larger than this on its long side
+DETECTION_MAX_SIDE = 1000
+MAX_CANDIDATES = 1500
+
+LINE_PSM = 7   # Treat the image as a single text line
+BLOCK_PSM = 6  # Assume a single uniform block of text
+
+
+class TextRegion:
+    def __init__(self, left: int, top: int, width: int, height: int, lines: int = 1):
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        self.lines = lines
+
+    @property
+    def kind(self) -> str:
+        return 'line' if self.lines == 1 else 'block'
+
+    @property
+    def psm(self) -> int:
+        return LINE_PSM if self.lines == 1 else BLOCK_PSM
+
+    @property
+    def box(self) -> Tuple[int, int, int, int]:
+        """PIL crop box (left, upper, right, lower)"""
+        return self.left, self.top, self.left + self.width, self.top + self.height
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"left": self.left, "top": self.top, "width": self.width, "height": self.height,
+                "kind": self.kind, "psm": self.psm}
+
+
+def _character_height(ink: np.ndarray) -> float:
+    """Typical glyph height: median height of small connected components of the ink mask"""
+    count, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    heights = [h for _, _, w, h, area in stats[1:count] if 3 <= h <= ink.shape[0] * 0.1 and w <= 3 * h and area >= 4]
+    return float(np.median(heights)) if heights else 8.0
+
+
+def _merge_boxes(boxes: List[List[int]], mergeable) -> List[List[int]]:
+    """Union [x0, y0, x1, y1, n] boxes pairwise until no pair satisfies mergeable(a, b)"""
+    boxes = [list(b) for b in boxes]
+    merged = True
+    while merged:
+        merged = False
+        i = 0
+        while i < len(boxes):
+            j = i + 1
+            while j < len(boxes):
+                a, b = boxes[i], boxes[j]
+                if mergeable(a, b):
+                    boxes[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]), a[4] + b[4]]
+                    del boxes[j]
+                    merged = True
+                    # The box grew; earlier candidates may now touch it
+                    j = i + 1
+                else:
+                    j += 1
+            i += 1
+    return boxes
+
+
+def _line_boxes(gray: np.ndarray) -> List[List[int]]:
+    """Text-line boxes [x0, y0, x1, y1, 1] on a small grayscale image"""
+    _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    char_height = _character_height(ink)
+    # Character strokes give a strong gradient in every direction
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, edges = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Join characters and words of a line, but not neighbouring lines
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(3, int(round(char_height))), 1))
+    joined = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(joined, connectivity=8)
+
+    boxes = []
+    for x, y, w, h, _ in stats[1:count]:
+        if h < 4 or w < 8 or h > 4 * char_height:
+            continue
+        # Text is a thin layer of ink; photos and filled shapes are mostly ink or none
+        density = cv2.countNonZero(ink[y:y + h, x:x + w]) / float(w * h)
+        if density < 0.05 or density > 0.6:
+            continue
+        # Glyph strokes cross the middle row many times; blob outlines only a few
+        row = ink[y + h // 2, x:x + w] > 0
+        crossings = int(np.count_nonzero(row[1:] & ~row[:-1]))
+        if crossings < max(2, 0.4 * w / h):
+            continue
+        boxes.append([int(x), int(y), int(x + w), int(y + h), 1])
+    if len(boxes) > MAX_CANDIDATES:
+        # No usable line structure (noise, halftone); recognize the whole page instead
+        return []
+
+    def same_line(a, b):
+        overlap = min(a[3], b[3]) - max(a[1], b[1])
+        gap = max(a[0], b[0]) - min(a[2], b[2])
+        return overlap >= 0.5 * min(a[3] - a[1], b[3] - b[1]) and gap <= 1.5 * char_height
+
+    return _merge_boxes(boxes, same_line)
+
+
+def _group_blocks(lines: List[List[int]]) -> List[List[int]]:
+    """Merge lines that are stacked closely and overlap horizontally into blocks [x0, y0, x1, y1, lines]"""
+    def stacked(a, b):
+        line_height = max((a[3] - a[1]) / a[4], (b[3] - b[1]) / b[4])
+        vertical_gap = max(a[1], b[1]) - min(a[3], b[3])
+        return vertical_gap <= 1.0 * line_height and a[0] < b[2] and b[0] < a[2]
+
+    return _merge_boxes(lines, stacked)
+
+
+def detect_text_regions(gray: np.ndarray, max_side: int = DETECTION_MAX_SIDE) -> List[TextRegion]:
+    """
+    Text lines and blocks of a page, in reading order (top to bottom, then left
+    to right), in the coordinates of `gray`
+    """
+    height, width = gray.shape[:2]
+    scale = min(1.0, max_side / float(max(height, width)))
+    small = gray if scale == 1.0 else cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    regions = []
+    for x0, y0, x1, y1, n in _group_blocks(_line_boxes(small)):
+        # Back to full resolution, with a margin so glyph edges are not clipped
+        margin = max(2, int(round(0.3 * (y1 - y0) / n / scale)))
+        left = max(int(x0 / scale) - margin, 0)
+        top = max(int(y0 / scale) - margin, 0)
+        right = min(int(np.ceil(x1 / scale)) + margin, width)
+        bottom = min(int(np.ceil(y1 / scale)) + margin, height)
+        regions.append(TextRegion(left, top, right - left, bottom - top, n))
+    regions.sort(key=lambda r: (r.top, r.left))
+    return regions
+
+
+def coverage(regions: List[TextRegion], shape: Tuple[int, ...]) -> float:
+    """Fraction of the page covered by the regions"""
+    return sum(r.width * r.height for r in regions) / float(shape[0] * shape[1])
+
+
+def plan(gray: np.ndarray, mode: str = None) -> Optional[List[TextRegion]]:
+    """Regions to recognize separately, or None to recognize the whole page"""
+    mode = MODE if mode is None else mode
+    if mode == 'off':
+        return None
+    regions = detect_text_regions(gray)
+    if not regions:
+        # Nothing found; let Tesseract look at the whole page rather than return nothing
+        return None
+    if mode == 'auto' and (len(regions) > AUTO_MAX_REGIONS or coverage(regions, gray.shape) > AUTO_MAX_COVERAGE):
+        return None
+    return regions
+
+
+def region_config(config: Optional[str], region: TextRegion) -> str:
+    """The request's Tesseract config with the page segmentation mode chosen for the region"""
+    config = config or ''
+    if re.search(r'--psm\s+\d+', config):
+        return re.sub(r'--psm\s+\d+', f'--psm {region.psm}', config)
+    return f"{config} --psm {region.psm}".strip()
+
+
+def data_to_text(data: Dict[str, List[Any]]) -> str:
+    """Rebuild plain text from image_to_data output: words by line, blank line between blocks"""
+    lines: List[str] = []
+    current = None
+    for i, word in enumerate(data.get('text', [])):
+        if not str(word).strip():
+            continue
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        if current is not None and key[:2] != current[:2]:
+            lines.append('')
+        if key != current:
+            lines.append(str(word))
+            current = key
+        else:
+            lines[-1] += ' ' + str(word)
+    return '\n'.join(lines)
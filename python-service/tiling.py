@@ -0,0 +1,183 @@
+"""
+Tiled processing for very large scans
+Memory model, strip/band planning, Tesseract output merging and tiled ORB
+extraction, used when the whole-image code path would exceed the per-request
+memory budget.
+"""
+
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Per-request working-memory budget. Images whose whole-image processing is
+# estimated to exceed it are processed in strips/tiles. 0 disables tiling.
+MEMORY_BUDGET_MB = float(os.getenv('TILE_MEMORY_BUDGET_MB', 256))
+
+# Rough peak working set per input pixel of each whole-image code path
+# (BGR decode + grayscale + enlarged rotation canvas + filter buffers + binary)
+PREPROCESS_BYTES_PER_PIXEL = 12
+# Per strip pixel: warped strip + two filter buffers + readability output + threshold
+PREPROCESS_STRIP_BYTES_PER_PIXEL = 6
+# Tesseract subprocess (page image, thresholded copies, layout analysis)
+TESSERACT_BYTES_PER_PIXEL = 24
+# ORB image pyramid (~3.3x) plus FAST/Harris scratch buffers
+ORB_BYTES_PER_PIXEL = 10
+
+MIN_STRIP_ROWS = 256
+# Rotation is detected on a proxy no larger than this on its long side
+ROTATION_PROXY_MAX_SIDE = 2000
+
+
+def budget_bytes() -> int:
+    return int(MEMORY_BUDGET_MB * 1024 * 1024)
+
+
+def needs_tiling(pixels: int, bytes_per_pixel: float, budget: Optional[int] = None) -> bool:
+    budget = budget_bytes() if budget is None else budget
+    return budget > 0 and pixels * bytes_per_pixel > budget
+
+
+def rows_within_budget(width: int, bytes_per_pixel: float, budget: Optional[int] = None,
+                       reserved: int = 0) -> int:
+    """Rows of `width` pixels that fit in what is left of the budget after `reserved` bytes"""
+    budget = budget_bytes() if budget is None else budget
+    available = max(budget - reserved, 0)
+    return max(MIN_STRIP_ROWS, int(available // max(width * bytes_per_pixel, 1)))
+
+
+def strips(height: int, rows: int, halo: int) -> List[Tuple[int, int, int, int]]:
+    """
+    Overlapping horizontal strips covering `height` rows.
+    Returns (src_start, src_end, core_start, core_end): the strip is processed
+    with `halo` rows of context on each side and only its core is kept.
+    """
+    result = []
+    for core_start in range(0, height, rows):
+        core_end = min(core_start + rows, height)
+        result.append((max(core_start - halo, 0), min(core_end + halo, height), core_start, core_end))
+    return result
+
+
+def text_bands(binary: np.ndarray, max_rows: int, search: float = 0.25) -> List[Tuple[int, int]]:
+    """
+    Split a binarized page (dark text on white) into horizontal bands of at most
+    max_rows, cutting at the row with the least ink near the end of each band so
+    cuts fall between text lines.
+    """
+    height, width = binary.shape[:2]
+    if height <= max_rows:
+        return [(0, height)]
+    # Row sums without a full-size temporary
+    row_sums = cv2.reduce(binary, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel()
+    ink = width * 255 - row_sums
+    bands = []
+    start = 0
+    while height - start > max_rows:
+        window_start = start + int(max_rows * (1 - search))
+        window = ink[window_start:start + max_rows]
+        # Last minimum in the window, keeping bands as large as possible
+        cut = window_start + len(window) - 1 - int(np.argmin(window[::-1]))
+        bands.append((start, cut))
+        start = cut
+    bands.append((start, height))
+    return bands
+
+
+def merge_tesseract_output(method: str, parts: List[Tuple[Any, int, int]]) -> Any:
+    """Combine pytesseract results of (result, left, top) crops; boxes are shifted back into page coordinates"""
+    if method == 'image_to_string':
+        return '\n'.join(text.rstrip('\x0c').rstrip('\n') for text, _, _ in parts if text.strip())
+    merged: Dict[str, List[Any]] = {}
+    block_offset = 0
+    for data, left, top in parts:
+        if not merged:
+            merged = {key: [] for key in data}
+        max_block = 0
+        for key, values in data.items():
+            if key == 'top':
+                values = [value + top for value in values]
+            elif key == 'left':
+                values = [value + left for value in values]
+            elif key == 'block_num':
+                max_block = max(values, default=0)
+                # Keep block numbers unique across bands
+                values = [value + block_offset if value else value for value in values]
+            merged.setdefault(key, []).extend(values)
+        block_offset += max_block
+    return merged
+
+
+def rotation_proxy(gray: np.ndarray, max_side: int = ROTATION_PROXY_MAX_SIDE) -> np.ndarray:
+    """Downscaled copy for angle detection; angles do not depend on scale"""
+    scale = max_side / max(gray.shape[:2])
+    if scale >= 1.0:
+        return gray
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def orb_halo(orb) -> int:
+    """Context needed around a tile so keypoints on every pyramid level get full patches"""
+    return int(math.ceil(max(orb.getPatchSize(), orb.getEdgeThreshold())
+                         * orb.getScaleFactor() ** (orb.getNLevels() - 1)))
+
+
+def orb_level_quotas(orb) -> List[int]:
+    """nfeatures split over pyramid levels in proportion to level area, as ORB does"""
+    levels, nfeatures = orb.getNLevels(), orb.getMaxFeatures()
+    factor = 1.0 / orb.getScaleFactor()
+    per_level = nfeatures * (1 - factor) / (1 - factor ** levels)
+    quotas = []
+    for _ in range(levels - 1):
+        quotas.append(int(round(per_level)))
+        per_level *= factor
+    quotas.append(max(nfeatures - sum(quotas), 0))
+    return quotas
+
+
+def detect_and_compute_tiled(orb, img: np.ndarray, tile_side: int) -> Tuple[List[cv2.KeyPoint], Optional[np.ndarray]]:
+    """
+    ORB over a grid of overlapping tiles: detect per tile, keep the strongest
+    keypoints over the whole image with ORB's per-level quotas, then compute
+    descriptors tile by tile. Tiles are views, so only one tile's pyramid is
+    alive at a time.
+    """
+    height, width = img.shape[:2]
+    halo = orb_halo(orb)
+    tiles = []
+    for y in range(0, height, tile_side):
+        for x in range(0, width, tile_side):
+            tiles.append((max(x - halo, 0), max(y - halo, 0), min(x + tile_side + halo, width),
+                          min(y + tile_side + halo, height), x, y, min(x + tile_side, width), min(y + tile_side, height)))
+
+    candidates = []
+    for tile_index, (x0, y0, x1, y1, cx0, cy0, cx1, cy1) in enumerate(tiles):
+        for kp in orb.detect(img[y0:y1, x0:x1], None):
+            px, py = kp.pt[0] + x0, kp.pt[1] + y0
+            # Each keypoint belongs to the tile whose core contains it
+            if cx0 <= px < cx1 and cy0 <= py < cy1:
+                candidates.append((kp.response, tile_index, kp))
+    selected = []
+    for level, quota in enumerate(orb_level_quotas(orb)):
+        # Like ORB itself: a per-pyramid-level share of nfeatures, strongest first
+        level_candidates = sorted((c for c in candidates if c[2].octave == level), key=lambda c: c[0], reverse=True)
+        selected.extend(level_candidates[:quota])
+
+    by_tile: Dict[int, List[cv2.KeyPoint]] = {}
+    for _, tile_index, kp in selected:
+        by_tile.setdefault(tile_index, []).append(kp)
+    keypoints, descriptors = [], []
+    for tile_index, tile_keypoints in sorted(by_tile.items()):
+        x0, y0, x1, y1 = tiles[tile_index][:4]
+        tile_keypoints, tile_descriptors = orb.compute(img[y0:y1, x0:x1], tile_keypoints)
+        if tile_descriptors is None:
+            continue
+        for kp in tile_keypoints:
+            kp.pt = (kp.pt[0] + x0, kp.pt[1] + y0)
+        keypoints.extend(tile_keypoints)
+        descriptors.append(tile_descriptors)
+    if not descriptors:
+        return keypoints, None
+    return keypoints, np.vstack(descriptors)
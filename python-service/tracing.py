@@ -0,0 +1,280 @@
+"""
+Tracing Module for the OpenCV Feature Matching / OCR Service
+Lightweight per-request spans with stage timing breakdown
+
+A trace is started for a request only when it is asked for (timings=true) or
+an exporter is sampling it. Outside an active trace, span() returns a shared
+no-op context, so instrumented code pays one context variable lookup.
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional, Dict, Any, List, Callable
+
+from structured_logging import current_request_id
+
+logger = logging.getLogger(__name__)
+
+_current_trace: ContextVar[Optional['Trace']] = ContextVar('current_trace', default=None)
+
+# Exporters receive each finished (sampled) trace as a dict
+_exporters: List[Callable[[Dict[str, Any]], None]] = []
+
+# Index and append of a new span must not interleave between threads
+_spans_lock = threading.Lock()
+
+_TOKEN_UNSAFE = re.compile(r'[^A-Za-z0-9!#$%&\'*+.^_`|~-]')
+
+
+class Trace:
+    """Spans recorded for one request"""
+
+    def __init__(self, name: str, trace_id: Optional[str] = None):
+        self.name = name
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.spans: List[Dict[str, Any]] = []
+        # Open span indices per thread; spans started in a pool thread (document pages) nest there
+        self._stacks: Dict[int, List[int]] = {}
+        self.exported = False
+
+    def _stack(self) -> List[int]:
+        return self._stacks.setdefault(threading.get_ident(), [])
+
+    def finish(self) -> 'Trace':
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.start
+        return self
+
+    def stage_totals(self) -> Dict[str, float]:
+        """Total milliseconds per span name (repeated spans are summed)"""
+        totals: Dict[str, float] = {}
+        for span_record in self.spans:
+            if span_record['duration_ms'] is not None:
+                totals[span_record['name']] = totals.get(span_record['name'], 0.0) + span_record['duration_ms']
+        return {name: round(ms, 3) for name, ms in totals.items()}
+
+    def server_timing(self) -> str:
+        """Server-Timing header value with one entry per stage"""
+        entries = [f"{_TOKEN_UNSAFE.sub('_', name)};dur={ms:.1f}" for name, ms in self.stage_totals().items()]
+        total = self.duration if self.duration is not None else time.perf_counter() - self.start
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ', '.join(entries)
+
+    def to_dict(self) -> Dict[str, Any]:
+        total = self.duration if self.duration is not None else time.perf_counter() - self.start
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "timestamp": self.wall_start,
+            "total_ms": round(total * 1000, 3),
+            "stages": self.stage_totals(),
+            "spans": self.spans
+        }
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'attrs', 'index', 'start')
+
+    def __init__(self, trace: Trace, name: str, attrs: Optional[Dict[str, Any]]):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        trace = self.trace
+        stack = trace._stack()
+        self.start = time.perf_counter()
+        record = {
+            "name": self.name,
+            "parent": stack[-1] if stack else None,
+            "start_ms": round((self.start - trace.start) * 1000, 3),
+            "duration_ms": None
+        }
+        if self.attrs:
+            record["attrs"] = self.attrs
+        with _spans_lock:
+            self.index = len(trace.spans)
+            trace.spans.append(record)
+        stack.append(self.index)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        trace = self.trace
+        trace.spans[self.index]["duration_ms"] = round((time.perf_counter() - self.start) * 1000, 3)
+        if exc_type is not None:
+            trace.spans[self.index]["error"] = exc_type.__name__
+        stack = trace._stack()
+        if stack and stack[-1] == self.index:
+            stack.pop()
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attrs):
+    """Context manager recording a (nested) span in the current trace, if any"""
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP_SPAN
+    return _Span(trace, name, attrs)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator recording each call of the function as a span"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def start_trace(name: str, trace_id: Optional[str] = None):
+    """Start a trace in the current context; returns the token for end_trace"""
+    return _current_trace.set(Trace(name, trace_id))
+
+
+def end_trace(token) -> Optional[Trace]:
+    """Finish the trace started with token, export it and restore the previous context"""
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    if trace is None:
+        return None
+    trace.finish()
+    export(trace)
+    return trace
+
+
+def register_exporter(exporter: Callable[[Dict[str, Any]], None]):
+    """Add a hook called with every finished trace"""
+    _exporters.append(exporter)
+
+
+def export(trace: Trace):
+    if trace.exported or not _exporters:
+        return
+    trace.exported = True
+    payload = trace.to_dict()
+    for exporter in _exporters:
+        try:
+            exporter(payload)
+        except Exception as e:
+            logger.warning("Trace exporter %r failed: %s", exporter, e)
+
+
+class JsonLinesFileExporter:
+    """Append each trace as one JSON line to a local file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, payload: Dict[str, Any]):
+        line = json.dumps(payload, default=str)
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as handle:
+                handle.write(line + '\n')
+
+    def __repr__(self):
+        return f"JsonLinesFileExporter({self.path!r})"
+
+
+_TRUTHY = ('1', 'true', 'yes', 'on')
+
+
+def _timings_requested(request) -> bool:
+    """Opt-in via ?timings=true, X-Timings header, JSON body or form field"""
+    if request.args.get('timings', '').lower() in _TRUTHY:
+        return True
+    if request.headers.get('X-Timings', '').lower() in _TRUTHY:
+        return True
+    if request.is_json:
+        body = request.get_json(silent=True)
+        return isinstance(body, dict) and body.get('timings') in (True, *_TRUTHY)
+    if request.form:
+        return request.form.get('timings', '').lower() in _TRUTHY
+    return False
+
+
+def init_app(app, export_file: Optional[str] = None, sample_rate: float = 1.0):
+    """
+    Register Flask hooks that trace requests and expose the timings.
+
+    Requests that opt in get a `timings` object in their JSON response; every
+    traced request gets a Server-Timing header. When export_file is set, that
+    fraction (sample_rate) of all requests is traced and written to the file.
+    """
+    from flask import g, request
+
+    if export_file:
+        register_exporter(JsonLinesFileExporter(export_file))
+        logger.info("Trace export enabled: %s (sample rate %s)", export_file, sample_rate)
+
+    @app.before_request
+    def _tracing_start_request():
+        wants_timings = _timings_requested(request)
+        sampled = bool(_exporters) and random.random() < sample_rate
+        if not (wants_timings or sampled):
+            return
+        g.trace_wants_timings = wants_timings
+        # Same id as the request's log records (structured_logging), when that is installed
+        g.trace_token = start_trace(f"{request.method} {request.path}",
+                                    current_request_id() or request.headers.get('X-Request-ID'))
+
+    @app.after_request
+    def _tracing_finish_request(response):
+        trace = current_trace()
+        if trace is None or 'trace_token' not in g:
+            return response
+        trace.finish()
+        response.headers['Server-Timing'] = trace.server_timing()
+        response.headers['X-Trace-ID'] = trace.trace_id
+        if g.get('trace_wants_timings') and response.is_json:
+            body = response.get_json(silent=True)
+            if isinstance(body, dict):
+                body['timings'] = trace.to_dict()
+                response.set_data(app.json.dumps(body))
+        return response
+
+    @app.teardown_request
+    def _tracing_end_request(exc):
+        token = g.pop('trace_token', None)
+        if token is not None:
+            try:
+                end_trace(token)
+            except ValueError:
+                # Token created in a different context; nothing left to restore
+                pass
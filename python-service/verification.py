@@ -0,0 +1,68 @@
+"""
+Geometric verification for /compare
+Fits a homography (RANSAC) to the ratio-test matches between the query and a
+candidate and scores the candidate by its inliers, which separates true
+matches from look-alikes far better than the raw match ratio.
+"""
+
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Candidates (by similarity) that are verified when a request asks for it
+TOP_K = int(os.getenv('VERIFY_TOP_K', 5))
+# Verified candidates need at least this many inliers to be a match
+MIN_INLIERS = int(os.getenv('VERIFY_MIN_INLIERS', 12))
+# Maximum reprojection error (pixels) for a match to count as an inlier
+RANSAC_REPROJECTION_ERROR = float(os.getenv('VERIFY_RANSAC_THRESHOLD', 5.0))
+
+# Inlier count at which confidence stops growing with the count
+CONFIDENT_INLIERS = 40
+# Homographies scaling area by more than this (or its inverse) are degenerate fits
+MAX_AREA_SCALE = 25.0
+
+
+def valid_keypoints(keypoints: Optional[np.ndarray], descriptor_count: int) -> bool:
+    """Keypoints usable for verification: one (x, y) per descriptor"""
+    return keypoints is not None and len(keypoints) == descriptor_count and descriptor_count > 0
+
+
+def _plausible(homography: np.ndarray) -> bool:
+    # Mirror images and collapsed or exploded areas are RANSAC fitting noise
+    affine = homography[:2, :2] / homography[2, 2]
+    area_scale = float(np.linalg.det(affine))
+    return 1.0 / MAX_AREA_SCALE < area_scale < MAX_AREA_SCALE
+
+
+def verify_homography(query_points: np.ndarray, stored_points: np.ndarray,
+                      pairs: List[Tuple[int, int]]) -> Dict[str, Any]:
+    """
+    RANSAC homography over (query index, stored index) match pairs.
+    Returns inliers and a confidence in [0, 1]: the inlier ratio, scaled down
+    while the inlier count is below CONFIDENT_INLIERS.
+    """
+    result = {"inliers": 0, "confidence": 0.0}
+    if len(pairs) < 4:
+        return result
+    indices = np.array(pairs)
+    src = np.float32(query_points[indices[:, 0]]).reshape(-1, 1, 2)
+    dst = np.float32(stored_points[indices[:, 1]]).reshape(-1, 1, 2)
+    homography, mask = cv2.findHomography(src, dst, cv2.RANSAC, RANSAC_REPROJECTION_ERROR,
+                                          maxIters=2000, confidence=0.995)
+    if homography is None or mask is None or not _plausible(homography):
+        return result
+    inliers = int(mask.sum())
+    confidence = inliers / len(pairs) * min(1.0, inliers / CONFIDENT_INLIERS)
+    result.update({"inliers": inliers, "confidence": round(confidence, 4)})
+    return result
+
+
+def rerank(verified: List[Dict[str, Any]], min_inliers: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Best verified candidate (most confident, then most inliers) with enough inliers, or None"""
+    min_inliers = MIN_INLIERS if min_inliers is None else min_inliers
+    accepted = [m for m in verified if m.get('inliers', 0) >= min_inliers]
+    if not accepted:
+        return None
+    return max(accepted, key=lambda m: (m['confidence'], m['inliers']))